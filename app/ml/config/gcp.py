@@ -23,6 +23,7 @@ class GCPSettings(BaseSettings):
     Attributes:
       model_path: (DirectoryPath) path to the model file
       model_name: (str) name of the model file
+      gcp_endpoint_url: (str) URL of the Cloud Run prediction service
     """
 
     # Initialize config based on .env file
@@ -36,6 +37,8 @@ class GCPSettings(BaseSettings):
     gcp_project_id: str
     gcp_region: str
     gcp_service_name: str
+    gcp_endpoint_url: str = \
+        'https://mlops-endpoint-416879185829.us-central1.run.app'
 
 
 gcp_settings = GCPSettings()
@@ -22,7 +22,31 @@ class ModelSettings(BaseSettings):
 
     Attributes:
       model_path: (DirectoryPath) path to the model file
-      model_name: (str) name of the model file
+      model_name: (str) name of the model file, the legacy model loaded
+        when no model was published to the model registry, and the base
+        name of the registry versions
+      registry_retention: (int) number of model registry versions kept
+      thread_budget: (bool) divide the cores between the inference
+        workers and their request threads
+      web_workers: (int) gunicorn worker processes
+      web_threads: (int) gunicorn request threads of a worker
+      inference_threads: (int) booster threads of a prediction, derived
+        from the cores and the workers when not set
+      inference_batch_rows: (int) batch size from which a prediction is
+        given the batch threads
+      inference_batch_threads: (int) booster threads of a large batch
+        prediction, all the cores when not set
+      sidecar_socket: (str) Unix domain socket of the model server
+      sidecar_timeout: (float) seconds a worker waits for a prediction
+        of the model server
+      sidecar_max_batch_rows: (int) rows of the requests batched into a
+        prediction by the model server
+      sidecar_max_wait: (float) seconds the model server waits for more
+        requests to batch
+      metrics_enabled: (bool) record the request and inference metrics
+      metrics_path: (str) directory of the worker metrics snapshots
+      metrics_snapshot_interval: (float) seconds between the metrics
+        snapshots of a worker
     """
 
     # Initialize config based on .env file
@@ -35,6 +59,26 @@ class ModelSettings(BaseSettings):
     # ML Model settings
     model_path: DirectoryPath
     model_name: str  # The mode base name
+    registry_retention: int = 5
+
+    # Inference thread budget, the worker topology of the web server
+    thread_budget: bool = True
+    web_workers: int = 4
+    web_threads: int = 2
+    inference_threads: int | None = None
+    inference_batch_rows: int = 10_000
+    inference_batch_threads: int | None = None
+
+    # Model server sidecar, the 'sidecar' inference backend
+    sidecar_socket: str = '/tmp/ml_mental_health_model.sock'
+    sidecar_timeout: float = 5.0
+    sidecar_max_batch_rows: int = 1024
+    sidecar_max_wait: float = 0.002
+
+    # Metrics registry of the workers, see app.ml.metrics
+    metrics_enabled: bool = True
+    metrics_path: str = '/tmp/ml_mental_health_metrics'
+    metrics_snapshot_interval: float = 1.0
 
     def update(self, updates: dict):
         """
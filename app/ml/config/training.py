@@ -0,0 +1,148 @@
+"""
+This module contains the configuration settings for the model training
+pipeline.
+
+The module initializes the training configuration settings and
+makes them available for the application.
+"""
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class TrainingSettings(BaseSettings):
+    """
+    The training configuration settings class.
+
+    The class initializes the settings used by the xgboost training
+    pipeline. The settings are loaded from the .env file located in the
+    root of the application, every setting has a default value.
+
+    Attributes:
+      xgb_tree_method: (str) xgboost tree construction algorithm
+      xgb_max_bin: (int) maximum number of histogram bins per feature
+      split_seed: (int) random seed of the train/validation/test split
+      collapse_duplicates: (bool) train on the unique training rows,
+        weighted by their count
+      categorical_encoding: (bool) encode the survey answer codes as
+        xgboost categorical features
+      max_unknown_code_share: (float) share of the rows of a categorical
+        column whose answer code is outside the feature domain, beyond
+        which the dataset is rejected
+      tuning_log_name: (str) tuning trial log file name, in the model path
+      tuning_init_points: (int) random trials of a new tuning run
+      tuning_n_iter: (int) bayesian optimization trials of a new tuning run
+      tuning_warm_start_n_iter: (int) bayesian optimization trials of a
+        run seeded with the trials of previous runs on the same dataset
+      tuning_param_bounds: (dict) hyperparameter search bounds
+      training_time_budget: (float) default wall-clock budget of a
+        training run in seconds, unbounded when not set
+      tuning_budget_fraction: (float) share of the budget allotted to the
+        hyperparameter tuning, the final training gets the rest
+      external_memory_source: (str) external memory training data source,
+        'db' to stream the database, or 'snapshot' to read the local
+        snapshot files
+      external_memory_chunk_rows: (int) rows per streamed data chunk
+      external_memory_cache_path: (str) directory of the xgboost external
+        memory cache, preferably on a local SSD
+      external_memory_snapshot_path: (str) directory of the local
+        snapshot files
+      holdout_modulo: (int) rows whose id is a multiple
+        of the modulo are held out for validation
+      refresh_rounds: (int) boosting rounds added by a model refresh
+      checkpoint_rounds: (int) checkpoint the training every N rounds
+      checkpoint_interval: (float) checkpoint the training every N seconds
+      distill: (bool) distill a compact serving model after training
+      distill_max_depth: (int) tree depth of the distilled student model
+      distill_rounds: (int) maximum boosting rounds of the student model
+      distill_log_loss_tolerance: (float) log-loss increase accepted from
+        the serving model
+      distill_recall_tolerance: (float) macro recall decrease accepted
+        from the serving model
+      profile_interval: (float) seconds between the RSS samples of the
+        run profiler
+      profile_stacks: (bool) sample the call stacks of the training run,
+        the stacks of the slowest stage are written to the model path
+    """
+
+    # Initialize config based on .env file
+    model_config = SettingsConfigDict(
+        env_file='.env',
+        env_file_encoding='utf-8',
+        extra='ignore'
+    )
+
+    # Histogram settings, the training matrices are quantized once
+    # using these values and shared by every tuning trial.
+    xgb_tree_method: str = 'hist'
+    xgb_max_bin: int = 256
+
+    # A fixed split keeps the tuning trials of an interrupted run
+    # comparable with the trials of the resumed run.
+    split_seed: int = 42
+
+    # Identical training rows are collapsed into one weighted row
+    collapse_duplicates: bool = False
+
+    # The survey answer codes are categorical features, split on sets of
+    # answers rather than on thresholds over the codes
+    categorical_encoding: bool = True
+
+    # The unknown answer codes are encoded as missing values, a dataset
+    # with more of them than the share is not trained on
+    max_unknown_code_share: float = 0.01
+
+    # Hyperparameter tuning settings
+    tuning_log_name: str = 'tuning_trials.jsonl'
+    tuning_init_points: int = 5
+    tuning_n_iter: int = 25
+    tuning_warm_start_n_iter: int = 10
+    tuning_param_bounds: dict[str, tuple[float, float]] = {
+        # n_estimators is num_boost_round for XGBoostClassifier
+        'num_boost_round': (100, 300),
+        'max_depth': (3, 10),
+        'learning_rate': (0.01, 0.1),
+        'subsample': (0.6, 1.0),
+        'colsample_bytree': (0.6, 1.0),
+        'gamma': (0, 5),
+        'reg_alpha': (0, 1),
+        'reg_lambda': (1, 5),
+    }
+
+    # Wall-clock budget of a training run
+    training_time_budget: float | None = None
+    tuning_budget_fraction: float = 0.8
+
+    # External memory training, only one chunk of the dataset is held
+    # in memory at a time, the quantized pages are cached on disk.
+    external_memory_source: str = 'db'
+    external_memory_chunk_rows: int = 100_000
+    external_memory_cache_path: str = '/tmp/xgb_cache'
+    external_memory_snapshot_path: str = './data/snapshot'
+
+    # Holdout rows of the external memory, distributed training and
+    # model refresh, split on the row id
+    holdout_modulo: int = 5
+
+    # Model refresh, boosting continues on the rows added since the
+    # deployed model was trained
+    refresh_rounds: int = 20
+
+    # Training checkpoints, whichever of the two intervals comes first
+    checkpoint_rounds: int = 25
+    checkpoint_interval: float = 300
+
+    # Serving model distillation, the serving model stays within the
+    # tolerance of the full model on the test split
+    distill: bool = True
+    distill_max_depth: int = 4
+    distill_rounds: int = 200
+    distill_log_loss_tolerance: float = 0.01
+    distill_recall_tolerance: float = 0.01
+
+    # Run profiler, the peak RSS of the stages is sampled, the call
+    # stack sampling is opt-in
+    profile_interval: float = 0.05
+    profile_stacks: bool = False
+
+
+training_settings = TrainingSettings()
@@ -47,7 +47,7 @@ def get_prediction(data: List[Dict]):
     #    gcp_settings.gcp_region,
     #    gcp_settings.gcp_service_name
     # )
-    endpoint_url = 'https://mlops-endpoint-416879185829.us-central1.run.app'
+    endpoint_url = gcp_settings.gcp_endpoint_url
 
     if not endpoint_url:
         raise RuntimeError(
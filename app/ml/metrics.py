@@ -0,0 +1,405 @@
+"""
+This module provides the in-process metrics of the application,
+exported in the Prometheus text format.
+
+The hot path records into plain in-process histograms, counters and
+gauges, a dictionary lookup, a bisect and an addition under an
+uncontended lock. Every gunicorn worker keeps its own metrics, and
+writes them periodically into a snapshot file of the metrics directory.
+The /metrics endpoint of the web application merges the snapshots of
+the live workers, each labelled with its worker pid.
+
+    with metrics.timer('predict'):
+        predictions = model.inplace_predict(features)
+
+The registry is recorded by the inference and by the web application,
+the request hooks and the /metrics route are in app.web.metrics and
+app.web.routes.metrics.
+
+When the metrics are disabled, the timers are shared no-op context
+managers and the recording methods return immediately.
+
+The module contains the following classes:
+    - Histogram: Cumulative histogram of observed values
+    - Metrics: In-process metrics registry of the worker
+
+Properties:
+    LATENCY_BUCKETS: tuple
+    BATCH_BUCKETS: tuple
+    metrics: Metrics object
+"""
+
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import nullcontext
+
+from loguru import logger
+
+from app.ml.config import model_settings as settings
+
+# Histogram bucket upper bounds, latencies in seconds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+BATCH_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+
+# Metric descriptions, exported as the Prometheus HELP lines
+_HELP = {
+    'inference_stage_seconds': 'Latency of the inference stages',
+    'http_request_seconds': 'Latency of the HTTP requests',
+    'http_requests_in_flight': 'HTTP requests being served',
+    'inference_requests_total': 'Inference requests, by backend',
+    'inference_fallback_total': 'Predictions falling back to local',
+    'inference_timeout_total': 'Predictions timed out, by backend',
+    'inference_batch_size': 'Rows per inference request',
+    'report_cache_requests_total': 'Report cache lookups, by result',
+    'report_cache_hit_ratio': 'Report cache hit ratio',
+    'model_version_info': 'Model version loaded by the worker',
+    'evaluations_in_flight': 'Evaluations queued or running',
+    'evaluations_refused_total': 'Evaluations refused, the pool full',
+    'admission_in_flight': 'Inference requests admitted and running',
+    'admission_limit': 'Adaptive concurrency limit of the inference',
+    'admission_queue_seconds': 'Wait of the inference requests for a slot',
+    'admission_backlog_seconds':
+        'Wait of the inference requests in the gunicorn backlog',
+    'admission_shed_total': 'Inference requests shed, by route',
+}
+
+_NULL_TIMER = nullcontext()
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values.
+
+    Attributes:
+      buckets: (tuple) bucket upper bounds
+      counts: (list) observations per bucket, the last one is +Inf
+      sum: (float) sum of the observed values
+    """
+
+    __slots__ = ('buckets', 'counts', 'sum', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+
+class _Timer:
+    """ Times a block of code into a histogram """
+
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start)
+        return False
+
+
+class Metrics:
+    """
+    In-process metrics registry of the worker.
+
+    The metrics are keyed by name and label values, e.g.
+    ('inference_stage_seconds', (('stage', 'predict'),)).
+
+    Attributes:
+      enabled: (bool) the metrics are recorded
+      path: (str) directory of the worker snapshot files
+      interval: (float) seconds between the snapshots of the worker
+
+    Methods:
+      timer: Time a block of code into a latency histogram
+      observe: Record a value into a histogram
+      inc: Increment a counter
+      add: Add to a gauge
+      set: Set a gauge
+      info: Set the labels of an info gauge
+      snapshot: Write the worker snapshot file, at most every interval
+      render: Render the metrics of all the workers
+    """
+
+    def __init__(self, enabled=True, path=None, interval=1.0):
+
+        self.enabled = enabled
+        self.path = path
+        self.interval = interval
+
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._snapshot_time = 0.0
+
+    def timer(self, stage, name='inference_stage_seconds'):
+        """
+        Time a block of code into a latency histogram.
+
+        Args:
+          stage: (str) stage label
+          name: (str) histogram name
+
+        Returns:
+          context manager: the timer
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self._histogram(name, (('stage', stage),)))
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        """
+        Record a value into a histogram.
+
+        Args:
+          name: (str) histogram name
+          value: (float) observed value
+          buckets: (tuple) bucket upper bounds of a new histogram
+          labels: label values
+        """
+        if self.enabled:
+            self._histogram(
+                name, tuple(sorted(labels.items())), buckets).observe(value)
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increment a counter.
+
+        Args:
+          name: (str) counter name
+          value: (float) increment
+          labels: label values
+        """
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self._lock:
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def add(self, name, value, **labels):
+        """
+        Add to a gauge, e.g. +1 when a request starts, -1 when it ends.
+
+        Args:
+          name: (str) gauge name
+          value: (float) value added
+          labels: label values
+        """
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self._lock:
+                self._gauges[key] = self._gauges.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge, e.g. the admission concurrency limit.
+
+        Args:
+          name: (str) gauge name
+          value: (float) value
+          labels: label values
+        """
+        if self.enabled:
+            key = (name, tuple(sorted(labels.items())))
+            with self._lock:
+                self._gauges[key] = value
+
+    def info(self, name, **labels):
+        """
+        Set the labels of an info gauge, a gauge of value 1 whose labels
+        carry the information, e.g. the loaded model version.
+
+        Args:
+          name: (str) gauge name
+          labels: label values
+        """
+        if self.enabled:
+            with self._lock:
+                for key in [key for key in self._gauges if key[0] == name]:
+                    del self._gauges[key]
+                self._gauges[(name, tuple(sorted(labels.items())))] = 1
+
+    def snapshot(self, force=False):
+        """
+        Write the worker snapshot file, at most every interval seconds.
+
+        Args:
+          force: (bool) write the snapshot whatever the interval
+        """
+
+        now = time.monotonic()
+        if not self.enabled or not self.path or \
+                (not force and now - self._snapshot_time < self.interval):
+            return
+        self._snapshot_time = now
+
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            path = os.path.join(self.path, f'worker_{os.getpid()}.json')
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(self._state(), f)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            logger.warning(f'Error writing the metrics snapshot: {e}')
+
+    def render(self) -> str:
+        """
+        Render the metrics of all the live workers, in the Prometheus
+        text format, labelled with the worker pid.
+
+        Returns:
+          str: metrics
+        """
+
+        self.snapshot(force=True)
+
+        states = {str(os.getpid()): self._state()}
+        for pid, state in self._read_snapshots():
+            states.setdefault(pid, state)
+
+        # Group the series by metric name
+        series = {}
+        for pid, state in sorted(states.items()):
+            for kind in ('histograms', 'counters', 'gauges'):
+                for name, labels, value in state[kind]:
+                    labels = dict(labels, worker=pid)
+                    series.setdefault((name, kind), []).append(
+                        (labels, value))
+
+        # Cache hit ratio of each worker
+        lookups = {}
+        for labels, value in series.get(
+                ('report_cache_requests_total', 'counters'), []):
+            hits, total = lookups.get(labels['worker'], (0, 0))
+            if labels.get('result') == 'hit':
+                hits += value
+            lookups[labels['worker']] = (hits, total + value)
+        if lookups:
+            series[('report_cache_hit_ratio', 'gauges')] = [
+                ({'worker': pid}, hits / total)
+                for pid, (hits, total) in lookups.items() if total
+            ]
+
+        lines = []
+        for (name, kind), samples in series.items():
+            lines.append(f'# HELP {name} {_HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} {_TYPES[kind]}')
+            for labels, value in samples:
+                if kind == 'histograms':
+                    lines.extend(_histogram_lines(name, labels, value))
+                else:
+                    lines.append(f'{name}{_labels(labels)} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    def _histogram(self, name, labels, buckets=LATENCY_BUCKETS):
+
+        key = (name, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(
+                    key, Histogram(buckets))
+        return histogram
+
+    def _state(self):
+
+        with self._lock:
+            return {
+                'histograms': [
+                    (name, labels, {
+                        'buckets': histogram.buckets,
+                        'counts': list(histogram.counts),
+                        'sum': histogram.sum,
+                    })
+                    for (name, labels), histogram in self._histograms.items()
+                ],
+                'counters': [
+                    (name, labels, value)
+                    for (name, labels), value in self._counters.items()
+                ],
+                'gauges': [
+                    (name, labels, value)
+                    for (name, labels), value in self._gauges.items()
+                ],
+            }
+
+    def _read_snapshots(self):
+        """ Snapshots of the live workers, the others are removed """
+
+        if not self.path or not os.path.isdir(self.path):
+            return
+
+        for fname in os.listdir(self.path):
+            if not fname.startswith('worker_') or \
+                    not fname.endswith('.json'):
+                continue
+            pid = fname[len('worker_'):-len('.json')]
+            path = os.path.join(self.path, fname)
+            try:
+                os.kill(int(pid), 0)
+            except (ValueError, ProcessLookupError):
+                _remove(path)
+                continue
+            except PermissionError:
+                pass
+            try:
+                with open(path, 'r') as f:
+                    yield pid, json.load(f)
+            except (OSError, json.JSONDecodeError):
+                continue
+
+
+_TYPES = {'histograms': 'histogram', 'counters': 'counter', 'gauges': 'gauge'}
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    values = ','.join(
+        f'{key}="{str(value)}"' for key, value in sorted(labels.items()))
+    return f'{{{values}}}'
+
+
+def _histogram_lines(name, labels, histogram):
+
+    lines = []
+    cumulative = 0
+    bounds = list(histogram['buckets']) + ['+Inf']
+    for bound, count in zip(bounds, histogram['counts']):
+        cumulative += count
+        lines.append(
+            f'{name}_bucket{_labels(dict(labels, le=bound))} {cumulative}')
+    lines.append(f'{name}_sum{_labels(labels)} {histogram["sum"]}')
+    lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return lines
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+metrics = Metrics(
+    enabled=settings.metrics_enabled,
+    path=settings.metrics_path,
+    interval=settings.metrics_snapshot_interval
+)
@@ -0,0 +1,390 @@
+"""
+This module provides the champion/challenger evaluation of the models.
+
+The candidates, the deployed model, the last registry versions and
+unpublished model files, are scored on the same holdout rows: the rows
+whose id is a multiple of the holdout modulo. The holdout is read from
+the database once, into a single matrix file of the raw answer codes
+and the labels. The candidates are scored in parallel worker processes,
+each one memory maps the matrix, so the workers share its pages rather
+than copying the rows.
+
+The report records, for each candidate, whether it never trained on the
+holdout rows: the models whose training left out the rows of the same
+holdout modulo, as recorded in their manifest. A model which trained on
+some of the holdout rows, or of an unknown training split, is ranked
+but never the best model, its holdout metrics are optimistic.
+
+Each candidate encodes the raw answer codes with its own preprocessor,
+models trained with different feature encodings are compared on the
+same rows. The metrics are computed per class from the accumulated
+confusion matrix and log-loss sums.
+
+The module contains the following functions:
+    - evaluate_models: Score the candidate models, write the report
+    - write_holdout: Write the holdout rows into the evaluation matrix
+    - registry_candidates: Return the candidate models of the registry
+    - score_candidate: Score a candidate model on the evaluation matrix
+    - class_metrics: Compute the metrics of each class
+"""
+
+import os
+import json
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+import numpy as np
+from loguru import logger
+
+from app.ml.config import model_settings as settings
+from app.ml.config.training import training_settings
+from app.ml.model.pipeline.collection import count_labels_in_db
+from app.ml.model.pipeline.collection import stream_data_from_db
+from app.ml.model.pipeline.preparation import NUM_CLASSES
+from app.ml.model.pipeline.preparation import target_labels
+from app.ml.model.pipeline.preprocessing import Preprocessor
+from app.ml.model.registry import ModelRegistry
+from app.ml.model.serialization import load_model
+
+_TARGET = '_MENT14D'
+
+
+def evaluate_models(n_versions=3, model_files=(), workers=None,
+                    output=None) -> dict:
+    """
+    Score the candidate models on the holdout rows, and write the
+    comparison report.
+
+    Args:
+      n_versions: (int) number of the latest registry versions scored
+      model_files: (list) unpublished model files, the challengers
+      workers: (int) number of worker processes, one per core by default
+      output: (str) report path, in the model path by default
+
+    Returns:
+      dict: comparison report, None when there is nothing to compare
+    """
+
+    start = time.perf_counter()
+    logger.info('Start: Evaluating models...')
+
+    registry = ModelRegistry(settings.model_path)
+    candidates = registry_candidates(registry, n_versions) + [
+        {'name': os.path.basename(path), 'path': path,
+         'holdout_modulo': None}
+        for path in model_files
+    ]
+    if not candidates:
+        logger.error('No model to evaluate.')
+        return None
+
+    workers = min(workers or os.cpu_count() or 1, len(candidates))
+    nthread = max(1, (os.cpu_count() or 1) // workers)
+
+    with tempfile.TemporaryDirectory() as tmp:
+
+        # 1. Read the holdout once, into the shared evaluation matrix
+        holdout_path = os.path.join(tmp, 'holdout.npy')
+        columns, rows = write_holdout(
+            holdout_path,
+            training_settings.external_memory_chunk_rows,
+            training_settings.holdout_modulo
+        )
+        if not rows:
+            logger.error('No holdout rows to evaluate the models on.')
+            return None
+
+        logger.info(
+            f'Scoring {len(candidates)} models on {rows} holdout rows, '
+            f'{workers} workers')
+
+        # 2. Score the candidates in parallel
+        spawn = get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=spawn) as pool:
+            futures = [
+                pool.submit(
+                    score_candidate, candidate, holdout_path, columns,
+                    rows, nthread)
+                for candidate in candidates
+            ]
+            results = []
+            for candidate, future in zip(candidates, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.error(
+                        f'Error scoring model {candidate["name"]}: {e}')
+
+    # 3. Rank the candidates, the champion is the deployed model. The
+    # best model is the best one which never trained on the holdout
+    modulo = training_settings.holdout_modulo
+    for result in results:
+        result['holdout_unseen'] = result.get('holdout_modulo') == modulo
+        if not result['holdout_unseen']:
+            logger.warning(
+                f'Model {result["name"]} may have trained on the holdout '
+                f'rows, its holdout metrics are optimistic')
+
+    results.sort(key=lambda result: result['metrics']['log_loss'])
+    champion = next(
+        (result for result in results if result.get('deployed')), None)
+    best = next(
+        (result for result in results if result['holdout_unseen']), None)
+
+    report = {
+        'created': datetime.now().isoformat(),
+        'holdout': {
+            'rows': rows,
+            'holdout_modulo': modulo,
+            'unseen_by': [
+                result['name'] for result in results
+                if result['holdout_unseen']
+            ],
+        },
+        'champion': champion and champion['name'],
+        'best': best and best['name'],
+        'candidates': results,
+    }
+
+    if output is None:
+        output = os.path.join(
+            settings.model_path, 'evaluations',
+            f'evaluation_{datetime.now().strftime("%Y%m%d%H%M%S")}.json'
+        )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    report['path'] = output
+
+    elapsed = time.perf_counter() - start
+    logger.info(f'End: Evaluating models - elapsed: {elapsed:.2f}s')
+
+    return report
+
+
+def write_holdout(path, chunk_rows, holdout_modulo):
+    """
+    Write the holdout rows into the evaluation matrix file, the raw
+    answer codes followed by the label, one chunk at a time.
+
+    Args:
+      path: (str) matrix file path, '.npy'
+      chunk_rows: (int) rows per streamed chunk
+      holdout_modulo: (int) row id modulo of the holdout rows
+
+    Returns:
+      tuple: feature columns of the matrix, and number of rows
+    """
+
+    n_rows = sum(count_labels_in_db(holdout_modulo, True).values())
+
+    matrix = None
+    columns = []
+    rows = 0
+    for df in stream_data_from_db(chunk_rows, holdout_modulo, True):
+        if matrix is None:
+            columns = [
+                col for col in df.columns if col not in ('id', _TARGET)]
+            matrix = np.lib.format.open_memmap(
+                path, mode='w+', dtype=np.float32,
+                shape=(n_rows, len(columns) + 1))
+
+        # Rows added since the holdout was counted are left out
+        chunk = df.iloc[:n_rows - rows]
+        end = rows + len(chunk)
+        matrix[rows:end, :-1] = chunk[columns].to_numpy()
+        matrix[rows:end, -1] = target_labels(chunk[_TARGET].to_numpy())
+        rows = end
+        if rows == n_rows:
+            break
+
+    if matrix is not None:
+        matrix.flush()
+        del matrix
+
+    return columns, rows
+
+
+def registry_candidates(registry, n_versions) -> list:
+    """
+    Return the candidate models of the latest registry versions, the
+    full model and the serving model of each version. The model named by
+    the model settings when nothing was published yet.
+
+    Args:
+      registry: (ModelRegistry) model registry
+      n_versions: (int) number of the latest versions
+
+    Returns:
+      list: candidate models
+    """
+
+    current = registry.current()
+    if current is None:
+        path = os.path.join(settings.model_path, settings.model_name)
+        if not os.path.exists(path):
+            return []
+        return [{'name': settings.model_name, 'path': path,
+                 'deployed': True, 'holdout_modulo': None}]
+
+    versions = registry.versions()[:n_versions]
+    if current not in versions:
+        versions.append(current)
+
+    candidates = []
+    for version in versions:
+        manifest = registry.manifest(version)
+        artifacts = manifest['artifacts']
+        # The deployed model is the served one, the serving model when
+        # the version has one
+        served = 'serving' if 'serving' in artifacts else 'model'
+        for artifact in ('model', 'serving'):
+            if artifact not in artifacts:
+                continue
+            candidates.append({
+                'name': version if artifact == 'model'
+                else f'{version}/serving',
+                'version': version,
+                'artifact': artifact,
+                'deployed': version == current and artifact == served,
+                # Rows of the training split left out, None when unknown
+                'holdout_modulo': manifest.get(
+                    'dataset', {}).get('holdout_modulo'),
+            })
+
+    return candidates
+
+
+def score_candidate(candidate, holdout_path, columns, rows,
+                    nthread=None) -> dict:
+    """
+    Score a candidate model on the evaluation matrix, one chunk at a
+    time. Runs in the worker processes.
+
+    Args:
+      candidate: (dict) candidate model
+      holdout_path: (str) evaluation matrix file path
+      columns: (list) feature columns of the evaluation matrix
+      rows: (int) number of rows of the evaluation matrix
+      nthread: (int) prediction threads
+
+    Returns:
+      dict: candidate, with its metrics and scoring time
+    """
+
+    start = time.perf_counter()
+
+    model, preprocessor = _load_candidate(candidate)
+    if nthread:
+        model.set_param({'nthread': nthread})
+
+    holdout = np.load(holdout_path, mmap_mode='r')[:rows]
+    index = [columns.index(col) for col in preprocessor.columns]
+    chunk_rows = training_settings.external_memory_chunk_rows
+
+    loss = np.zeros(NUM_CLASSES)
+    confusion = np.zeros((NUM_CLASSES, NUM_CLASSES), dtype=np.int64)
+
+    for first in range(0, rows, chunk_rows):
+        chunk = holdout[first:first + chunk_rows]
+        y = chunk[:, -1].astype(np.intp)
+
+        X = np.empty(
+            (len(chunk), len(preprocessor.feature_names)), np.float32)
+        X[:, :len(index)] = chunk[:, index]
+        preprocessor.apply(X)
+
+        # Normalized and clipped as sklearn's log_loss
+        probs = model.inplace_predict(X)
+        probs = probs / probs.sum(axis=1, keepdims=True)
+        eps = np.finfo(probs.dtype).eps
+        loss += np.bincount(
+            y,
+            weights=-np.log(np.clip(probs[np.arange(len(y)), y], eps, 1)),
+            minlength=NUM_CLASSES
+        )
+        confusion += np.bincount(
+            y * NUM_CLASSES + probs.argmax(axis=1),
+            minlength=NUM_CLASSES ** 2
+        ).reshape(NUM_CLASSES, NUM_CLASSES)
+
+    return {
+        **candidate,
+        'rounds': model.num_boosted_rounds(),
+        'seconds': time.perf_counter() - start,
+        'metrics': class_metrics(confusion, loss),
+    }
+
+
+def class_metrics(confusion, loss) -> dict:
+    """
+    Compute the metrics of each class, and their averages, from the
+    confusion matrix and the log-loss sum of each class. The undefined
+    metrics are zero, as sklearn's zero_division=0.
+
+    Args:
+      confusion: (np.ndarray) confusion matrix, true label by predicted
+      loss: (np.ndarray) log-loss sum of the rows of each true label
+
+    Returns:
+      dict: metrics
+    """
+
+    support = confusion.sum(axis=1)
+    rows = max(int(support.sum()), 1)
+
+    tp = np.diag(confusion).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.nan_to_num(tp / confusion.sum(axis=0))
+        recall = np.nan_to_num(tp / support)
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+        class_loss = np.nan_to_num(loss / support)
+
+    share = support / rows
+    return {
+        'log_loss': float(loss.sum() / rows),
+        'accuracy': float(tp.sum() / rows),
+        'recall': float(recall.mean()),
+        'f1': float(f1.mean()),
+        'weighted_f1': float(f1 @ share),
+        'classes': {
+            'support': support.tolist(),
+            'log_loss': class_loss.tolist(),
+            'precision': precision.tolist(),
+            'recall': recall.tolist(),
+            'f1': f1.tolist(),
+        },
+    }
+
+
+def _load_candidate(candidate):
+    """ Load a candidate model, and its preprocessor """
+
+    if 'path' in candidate:
+        path = candidate['path']
+        model, _ = load_model(
+            path, 'pickle' if path.endswith('.pkl') else 'ubj')
+        return model, Preprocessor.for_model(model)
+
+    registry = ModelRegistry(settings.model_path)
+    version = candidate['version']
+    artifacts = registry.manifest(version)['artifacts']
+
+    artifact = artifacts[candidate['artifact']]
+    model, verification = load_model(
+        registry.artifact_path(version, artifact['file']),
+        artifact['format'],
+        artifact['sha256']
+    )
+    verification.verify()
+
+    if 'preprocessor' not in artifacts:
+        return model, Preprocessor.for_model(model)
+
+    artifact = artifacts['preprocessor']
+    model_path = registry.artifact_path(version, artifact['file'])
+    with open(model_path, 'r') as f:
+        return model, Preprocessor.from_json(f.read())
@@ -8,7 +8,11 @@ a pre-trained model and making predictions.
 from loguru import logger
 
 from app.ml.model.pipeline.xgb_model import build_model
+from app.ml.model.pipeline.xgb_model import build_distributed_model
+from app.ml.model.pipeline.xgb_model import join_distributed_training
+from app.ml.model.pipeline.xgb_model import refresh_model
 from app.ml.config import model_settings as settings
+from app.ml.config.training import training_settings
 
 
 class ModelBuilderService:
@@ -24,6 +28,9 @@ class ModelBuilderService:
 
     Methods:
       train_model: Build and train a  model
+      train_distributed_model: Build and train a model on several workers
+      join_distributed_training: Run workers for a remote coordinator
+      refresh_model: Refresh the deployed model with the new rows
     """
 
     def __init__(self):
@@ -34,21 +41,114 @@ class ModelBuilderService:
         self.model_path = settings.model_path
         self.model_name = settings.model_name
 
-    def train_model(self):
+    def train_model(
+            self, time_budget: float = None, external_memory: bool = False,
+            resume: bool = False):
         """
         Train a model from specified path.
 
         The function builds and trains a model from the specified path,
         The model is saved to the specified path
 
+        The total time budget is split between the hyperparameter tuning
+        and the final training. When the budget runs out, the best model
+        found so far is saved.
+
+        In external memory mode the dataset is streamed in chunks, for
+        datasets which do not fit in memory.
+
+        Args:
+          time_budget: (float) wall-clock budget in seconds, defaults to
+            the configured training time budget
+          external_memory: (bool) train from the streamed dataset chunks
+          resume: (bool) resume from the last training checkpoint
+
         Returns:
           None
         """
 
-        logger.debug('Training model...')
+        if time_budget is None:
+            time_budget = training_settings.training_time_budget
+
+        logger.debug(f'Training model... (time budget: {time_budget})')
 
         # Build, train and save model
-        build_model()
+        build_model(
+            time_budget=time_budget,
+            external_memory=external_memory,
+            resume=resume
+        )
+
+        logger.debug('Training successful')
+        logger.debug(f'Published model into {self.model_path}/registry')
+
+    def train_distributed_model(
+            self, n_workers: int, world_size: int = None,
+            host_ip: str = None, port: int = 0, time_budget: float = None):
+        """
+        Train a model with the training data sharded across workers.
+
+        The coordinator runs the local workers, and waits for the
+        remaining workers of the world size to join from other hosts.
+
+        Args:
+          n_workers: (int) number of local workers
+          world_size: (int) total number of workers, on all hosts
+          host_ip: (str) address the tracker listens on
+          port: (int) port the tracker listens on
+          time_budget: (float) wall-clock budget in seconds, defaults to
+            the configured training time budget
+
+        Returns:
+          None
+        """
+
+        if time_budget is None:
+            time_budget = training_settings.training_time_budget
+
+        logger.debug(f'Training model... ({n_workers} local workers)')
+
+        build_distributed_model(
+            n_workers,
+            world_size=world_size,
+            host_ip=host_ip,
+            port=port,
+            time_budget=time_budget
+        )
 
         logger.debug('Training successful')
-        logger.debug(f'Saved model into {self.model_path}/{self.model_name}')
+
+    def join_distributed_training(
+            self, tracker_uri: str, tracker_port: int, n_workers: int):
+        """
+        Run local workers for a distributed training coordinated from
+        another host.
+
+        Args:
+          tracker_uri: (str) tracker host address
+          tracker_port: (int) tracker port
+          n_workers: (int) number of local workers
+
+        Returns:
+          None
+        """
+
+        join_distributed_training(tracker_uri, tracker_port, n_workers)
+
+    def refresh_model(self, time_budget: float = None):
+        """
+        Refresh the deployed model with the rows added since it was
+        trained. The refreshed model is published only when its holdout
+        log-loss does not regress.
+
+        Args:
+          time_budget: (float) wall-clock budget in seconds
+
+        Returns:
+          None
+        """
+
+        logger.debug('Refreshing model...')
+
+        if refresh_model(time_budget=time_budget) is not None:
+            logger.debug('Refresh successful')
@@ -7,37 +7,29 @@ a pre-trained model and making predictions.
 
 import io
 import base64
+import threading
 from typing import List, Dict
 from pathlib import Path
-import pickle as pk
 from loguru import logger
 
 import matplotlib.pyplot as plt
 import matplotlib
-import pandas as pd
-import xgboost as xgb
+import numpy as np
 
 from app.ml.config.model import model_settings as settings
-from app.ml.model.pipeline.preparation import MentalHealthData
+from app.ml.model.pipeline.preprocessing import Preprocessor
+from app.ml.model.registry import ModelRegistry
+from app.ml.model.serialization import ChecksumVerification
+from app.ml.model.serialization import load_model
+from app.ml.model.sidecar import encode_records, sidecar_client
+from app.ml.model.threads import thread_budget
 from app.ml.config.gcp import gcp_settings
 from app.ml.gcp_endpoint import get_prediction
+from app.ml.metrics import metrics, BATCH_BUCKETS
 
 
 matplotlib.use('Agg')  # Use non-interactive backend
 
-FEATURE_NAMES = [
-    'POORHLTH', 'PHYSHLTH', 'GENHLTH', 'DIFFWALK', 'DIFFALON',
-    'CHECKUP1', 'DIFFDRES', 'ADDEPEV3', 'ACEDEPRS', 'SDLONELY', 'LSATISFY',
-    'EMTSUPRT', 'DECIDE', 'CDSOCIA1', 'CDDISCU1', 'CIMEMLO1', 'SMOKDAY2',
-    'ALCDAY4', 'MARIJAN1', 'EXEROFT1', 'USENOW3', 'FIREARM5', 'INCOME3',
-    'EDUCA', 'EMPLOY1', 'SEX', 'MARITAL', 'ADULT', 'RRCLASS3', 'QSTLANG',
-    '_STATE', 'VETERAN3', 'MEDCOST1', 'SDHBILLS', 'SDHEMPLY', 'SDHFOOD1',
-    'SDHSTRE1', 'SDHUTILS', 'SDHTRNSP', 'CDHOUS1', 'FOODSTMP', 'PREGNANT',
-    'ASTHNOW', 'HAVARTH4', 'CHCSCNC1', 'CHCOCNC1', 'DIABETE4', 'CHCCOPD3',
-    'CHOLCHK3', 'BPMEDS1', 'BPHIGH6', 'CVDSTRK3', 'CVDCRHD4', 'CHCKDNY2',
-    'CHOLMED3'
-]
-
 EXPECTED_FEATURE_ORDER = [
     'poorhlth', 'physhlth', 'genhlth', 'diffwalk', 'diffalon',
     'checkup1', 'diffdres', 'addepev3', 'acedeprs', 'sdlonely', 'lsatisfy',
@@ -51,6 +43,14 @@ EXPECTED_FEATURE_ORDER = [
     'cholmed3'
 ]
 
+# Prediction classes, in the order of the class probabilities
+PREDICTION_CLASSES = ['0 Days', '1-13 Days', '14+ Days', 'Unsure']
+
+
+# Model loaded by the process, and its registry version
+_loaded_model = {}
+_model_lock = threading.Lock()
+
 
 class ModelInferenceService:
     """
@@ -62,14 +62,17 @@ class ModelInferenceService:
 
     Attributes:
       model: pre-trained model
+      preprocessor: feature preprocessing of the model
 
     Methods:
       load_model: Load a pre-trained model from config path
       predict: Make a prediction using the pre-trained model
+      predict_codes: Make a prediction of an answer code matrix
     """
 
     def __init__(self):
         self.model = None
+        self.preprocessor = None
         self.model_path = settings.model_path
         self.model_name = settings.model_name
 
@@ -77,26 +80,91 @@ class ModelInferenceService:
         """
         Load a pre-trained model from config path
 
-        The function loads a pre-trained model from the specified path,
-        when the model is not found at the specified path,
-        the function builds the model.
+        The function loads the model version published to the model
+        registry, the distilled serving model when the version has one.
+        When no model was published, the function loads the model named
+        by the model settings.
+
+        The loaded model is shared by all the service instances of the
+        process. The registry pointer is read on every call, the model
+        is loaded again only once a new version is published. The new
+        version is swapped in once its checksum is verified, a corrupt
+        version leaves the previous model in service.
+
+        The booster threads are set from the thread budget of the
+        process, and the native thread pools are limited on first load.
 
         Returns:
           None
         """
 
-        if self.model is None:
-            try:
+        registry = ModelRegistry(self.model_path)
+        version = registry.current() or self.model_name
+
+        thread_budget.apply()
+
+        with _model_lock:
+            if _loaded_model.get('version') != version:
+                try:
+                    logger.info(f'Loading model version {version}...')
+                    model, verification = self._read_model(
+                        registry, version)
+                    preprocessor = self._read_preprocessor(
+                        registry, version, model)
+                    verification.verify()
+                    _set_nthread(model, thread_budget.nthread(1))
+                    _loaded_model.clear()
+                    _loaded_model.update(
+                        version=version,
+                        model=model,
+                        preprocessor=preprocessor
+                    )
+                    metrics.info('model_version_info', version=version)
+                except Exception as e:
+                    logger.error(f'Error loading model: {e}')
+
+            self.model = _loaded_model.get('model')
+            self.preprocessor = _loaded_model.get('preprocessor')
+
+    def _read_model(self, registry, version):
+        """
+        Read the serving artifact of a version, and its pending checksum
+        verification. The checksum is verified while the model is parsed.
+        """
+
+        if registry.current() is None:
+            # Legacy model, a pickle saved in the model path
+            model_path = Path(f'{self.model_path}/{self.model_name}')
+            logger.info(f'Loading model from {model_path}')
+            return load_model(model_path, 'pickle')
 
-                logger.info('Loading model...')
-                model_path = Path(f'{self.model_path}/{self.model_name}')
+        artifacts = registry.manifest(version)['artifacts']
+        artifact = artifacts.get('serving') or artifacts['model']
+        model_path = registry.artifact_path(version, artifact['file'])
 
-                logger.info(f'Loading model from {model_path}')
-                with open(model_path, 'rb') as model_file:
-                    self.model = pk.load(model_file)
+        logger.info(f'Loading model from {model_path}')
+        return load_model(model_path, artifact['format'], artifact['sha256'])
 
-            except Exception as e:
-                logger.error(f'Error loading model: {e}')
+    def _read_preprocessor(self, registry, version, model):
+        """
+        Read the preprocessor of a version, checksum verified. The
+        versions published without a preprocessor get the preprocessor
+        fitted on the model features.
+        """
+
+        artifact = None
+        if registry.current() is not None:
+            artifact = registry.manifest(version)['artifacts'].get(
+                'preprocessor')
+        if artifact is None:
+            return Preprocessor.for_model(model)
+
+        path = registry.artifact_path(version, artifact['file'])
+        with open(path, 'rb') as f:
+            data = f.read()
+        ChecksumVerification(path, data, artifact['sha256']).verify()
+
+        return Preprocessor.from_json(data)
 
     def predict(self, batch: List[Dict[str, str]]):
         """
@@ -110,78 +178,140 @@ class ModelInferenceService:
           params: (dict) input parameters for prediction
 
         Returns:
-          list: prediction
+          np.ndarray: class probabilities, a row per record, whatever
+            the backend
         """
         logger.info('Making predictions...')
-        logger.debug(f'Data:\n {batch}')
+        # The batch is only formatted when the debug level is logged
+        logger.opt(lazy=True).debug(
+            'Data: {rows} rows\n {batch}', rows=lambda: len(batch),
+            batch=lambda: batch)
+
+        backend = gcp_settings.ai_backend
+        metrics.inc('inference_requests_total', backend=backend)
+        metrics.observe(
+            'inference_batch_size', len(batch), buckets=BATCH_BUCKETS)
 
-        if gcp_settings.ai_backend == 'gcp':
+        if backend == 'gcp':
             # Use GCP model service
             return self._gcp_backend_processing_predict(batch)
+        elif backend == 'sidecar':
+            # Use the model server of the host
+            return self._sidecar_backend_processing_predict(batch)
         else:
             # Use stand-alone built in model service
             return self._local_backend_processing_predict(batch)
 
+    def predict_codes(self, codes, batch=False):
+        """
+        Make a prediction of an answer code matrix, on the model of the
+        process, e.g. the batches of the model server and the scoring jobs.
+
+        Args:
+          codes: (np.ndarray) answer code matrix, a column per request
+            field in the EXPECTED_FEATURE_ORDER
+          batch: (bool) predict with the batch threads, whatever the
+            number of rows, e.g. the chunks of a scoring job
+
+        Returns:
+          np.ndarray: class probabilities
+        """
+
+        self._load_model()
+        if self.model is None:
+            raise RuntimeError('No model loaded.')
+
+        features = self.preprocessor.transform_codes(
+            codes, EXPECTED_FEATURE_ORDER)
+
+        rows = thread_budget.batch_rows if batch else len(codes)
+        model = self.model
+        if thread_budget.nthread(rows) != thread_budget.nthread(1):
+            model = _batch_model(model)
+
+        return model.inplace_predict(features)
+
     def _gcp_backend_processing_predict(self, batch):
         """
         Make a prediction using the pre-trained model in GCP (Vertex AI) platform.
         """
         logger.info('Making prediction using GCP backend...')
 
-        return get_prediction(batch)
+        with metrics.timer('gcp_predict'):
+            # The endpoint returns the probabilities as JSON lists
+            return np.asarray(get_prediction(batch), dtype=np.float32)
 
-    def _local_backend_processing_predict(self, batch: List[Dict[str, str]]):
+    def _sidecar_backend_processing_predict(self, batch):
         """
-        Make a prediction using the pre-trained model on the local python backend.
+        Make a prediction using the model server of the host, see
+        app.ml.model.model_server. The prediction falls back to the local
+        backend when the server is not running. A server timing out is
+        overloaded, the timeout is raised rather than adding a local
+        prediction to the load.
         """
 
-        self._load_model()
+        with metrics.timer('preprocess'):
+            codes = encode_records(batch, EXPECTED_FEATURE_ORDER)
 
-        _batch = self._reorder_features(batch)
-        batch_df = pd.DataFrame(_batch, columns=FEATURE_NAMES)
+        try:
+            with metrics.timer('sidecar_predict'):
+                return sidecar_client.predict(codes)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            logger.warning(f'Model server not running, predicting '
+                           f'locally: {e}')
+            metrics.inc('inference_fallback_total', backend='sidecar')
+        except TimeoutError:
+            logger.warning('Model server timed out')
+            metrics.inc('inference_timeout_total', backend='sidecar')
+            raise
 
-        # Prepare our inference data
-        # MentalHealthData can process both feature with target data,
-        # or just feature data, including composite features
-        # In this case, we are only interested in the feature and composite
-        # data
-        mh = MentalHealthData(batch_df)
+        return self._local_backend_processing_predict(batch)
 
-        # XGb expects data in DMatrix format
-        xgb_features = xgb.DMatrix(mh.get_data())
+    def _local_backend_processing_predict(self, batch: List[Dict[str, str]]):
+        """
+        Make a prediction using the pre-trained model on the local python backend.
+        """
 
-        # Make predictions
-        return self.model.predict(xgb_features)
+        with metrics.timer('load_model'):
+            self._load_model()
 
-    def _reorder_features(self, batch: List[Dict[str, str]]):
-        """
-        Reorder input data to match the expected feature order.
-        The submitted batch data is expected to be without missing values
+        # Encode the batch as the model was trained, the preprocessor
+        # maps the request fields to the model features
+        with metrics.timer('preprocess'):
+            features = self.preprocessor.transform(batch)
 
-        The reordering requires the incoming batch to be in dictionary format
-        so as to be able to determine the feature names of each input value.
-        Once the proper order is determnined, we can now do away with the
-        column names in the batch and return only the values in
-        the correct order.
+        # Make predictions, a large batch with the batch threads
+        model = self.model
+        if thread_budget.nthread(len(batch)) != thread_budget.nthread(1):
+            model = _batch_model(model)
 
-        Args:
-            data list[dict]: Input data as a dictionary.
-            expected_order (list): List of features in the correct order.
+        with metrics.timer('predict'):
+            return model.inplace_predict(features)
 
-        Returns:
-            list[List]: Batch of features in the correct order.
-        """
 
-        ordered_batch = []
+def _set_nthread(model, nthread):
+    """ Set the booster threads, the xgboost default when 0 """
+    if nthread:
+        model.set_param({'nthread': nthread})
+
 
-        for features in batch:
-            _features = [int(features[feature]) for feature in
-                         EXPECTED_FEATURE_ORDER if feature in features]
-            # Append the ordered feature values to the batch
-            ordered_batch.append(_features)
+def _batch_model(model):
+    """
+    Return the booster of the large batch predictions, a copy of the
+    loaded model with the batch threads. The thread count is a booster
+    parameter, the copy leaves the booster shared by the concurrent
+    request predictions untouched.
+    """
 
-        logger.debug(f'Ordered batch: {ordered_batch}')
-        return ordered_batch
+    with _model_lock:
+        if _loaded_model.get('model') is not model:
+            # The model was swapped, predict with the one given
+            return model
+        if 'batch_model' not in _loaded_model:
+            batch_model = model.copy()
+            _set_nthread(batch_model, thread_budget.batch_threads)
+            _loaded_model['batch_model'] = batch_model
+        return _loaded_model['batch_model']
 
 
 def prediction_report(probabilities: list, plot=True) -> tuple[list, str]:
@@ -196,7 +326,7 @@ def prediction_report(probabilities: list, plot=True) -> tuple[list, str]:
     percentages = [p * 100 for p in probabilities]
 
     # Define prediction classes
-    classes_dict = {0: '0 Days', 1: '1-13 Days', 2: '14+ Days', 3: 'Unsure'}
+    classes_dict = dict(enumerate(PREDICTION_CLASSES))
 
     # 2. Prepare the data for the tabular presentation
     dominant_prediction = max(percentages)
@@ -0,0 +1,262 @@
+"""
+This module provides the model server, the sidecar process serving the
+predictions of all the web workers of the host over a Unix domain
+socket, see app.ml.model.sidecar for the protocol.
+
+The server loads the model once, for all the workers, and follows the
+model registry as the workers do: a new version is loaded on the first
+prediction after it is published. Every connection is served by its own
+thread, which hands the request over to the batcher thread. The batcher
+collects the requests of all the connections, up to the maximum batch
+rows or the maximum wait, predicts them with a single call, and hands
+each connection its rows of the result.
+
+    python -m app.model_server_main --socket /tmp/model.sock
+
+The module contains the following classes:
+    - ModelServer: Model server of the web workers
+"""
+
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+
+from app.ml.model.model_inference import EXPECTED_FEATURE_ORDER
+from app.ml.model.model_inference import ModelInferenceService
+from app.ml.model.sidecar import MAGIC, REQUEST_HEADER, RESPONSE_HEADER
+from app.ml.model.sidecar import STATUS_ERROR, STATUS_OK
+from app.ml.model.sidecar import receive_exactly, send_matrix
+from app.ml.model.threads import thread_budget
+
+# Largest request accepted, 220 MB of answer codes
+_MAX_REQUEST_ROWS = 1_000_000
+
+
+class _Pending:
+    """ Request waiting for the batcher """
+
+    __slots__ = ('codes', 'result', 'error', 'done')
+
+    def __init__(self, codes):
+        self.codes = codes
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class ModelServer:
+    """
+    Model server of the web workers.
+
+    Attributes:
+      socket_path: (str) Unix domain socket the server listens on
+      max_batch_rows: (int) rows of the requests batched into a prediction
+      max_wait: (float) seconds the batcher waits for more requests
+
+    Methods:
+      serve_forever: Serve the predictions until the server is shut down
+      shutdown: Stop the server
+      submit: Predict the rows of a request, in the next batch
+    """
+
+    def __init__(self, socket_path, max_batch_rows=1024, max_wait=0.002):
+
+        self.socket_path = socket_path
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait
+
+        # The server is the only process predicting on the host
+        thread_budget.configure(workers=1, threads=1)
+        self.service = ModelInferenceService()
+
+        self._queue = queue.Queue()
+        self._server = None
+        self._ready = threading.Event()
+
+    def serve_forever(self):
+        """
+        Serve the predictions until the server is shut down. The model is
+        loaded before the socket accepts connections.
+        """
+
+        self.service._load_model()
+        if self.service.model is None:
+            raise RuntimeError('No model to serve.')
+
+        _remove_stale_socket(self.socket_path)
+        self._server = _UnixServer(self.socket_path, _Handler)
+        self._server.model_server = self
+        os.chmod(self.socket_path, 0o660)
+
+        batcher = threading.Thread(
+            target=self._batch_loop, name='batcher', daemon=True)
+        batcher.start()
+
+        logger.info(
+            f'Model server listening on {self.socket_path}, batches of '
+            f'up to {self.max_batch_rows} rows, {self.max_wait * 1000:.1f}'
+            f' ms wait')
+        self._ready.set()
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._queue.put(None)
+            batcher.join()
+            self._server.server_close()
+            _remove_socket(self.socket_path)
+
+    def shutdown(self):
+        """ Stop the server, from another thread than serve_forever """
+        self._ready.wait()
+        self._server.shutdown()
+
+    def submit(self, codes) -> np.ndarray:
+        """
+        Predict the rows of a request, in the next batch.
+
+        Args:
+          codes: (np.ndarray) answer code matrix of the request
+
+        Returns:
+          np.ndarray: class probabilities
+        """
+
+        pending = _Pending(codes)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise RuntimeError(pending.error)
+        return pending.result
+
+    def _batch_loop(self):
+
+        while True:
+            pending = self._queue.get()
+            if pending is None:
+                return
+
+            batch = [pending]
+            rows = len(pending.codes)
+            deadline = time.monotonic() + self.max_wait
+            while rows < self.max_batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if pending is None:
+                    # Served after the batch, then stop
+                    self._queue.put(None)
+                    break
+                batch.append(pending)
+                rows += len(pending.codes)
+
+            self._predict(batch)
+
+    def _predict(self, batch):
+        """ Predict a batch of requests, and hand over their results """
+
+        try:
+            codes = batch[0].codes if len(batch) == 1 else np.concatenate(
+                [pending.codes for pending in batch])
+            probs = self.service.predict_codes(codes)
+
+            first = 0
+            for pending in batch:
+                end = first + len(pending.codes)
+                pending.result = probs[first:end]
+                first = end
+
+            logger.debug(
+                f'Predicted {len(batch)} requests, {len(codes)} rows')
+        except Exception as e:
+            logger.error(f'Error predicting batch: {e}')
+            for pending in batch:
+                pending.error = str(e)
+        finally:
+            for pending in batch:
+                pending.done.set()
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    model_server = None
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """ Serves the requests of a connection, one at a time """
+
+    def handle(self):
+
+        sock = self.request
+        cols = len(EXPECTED_FEATURE_ORDER)
+
+        while True:
+            try:
+                magic, rows, request_cols = REQUEST_HEADER.unpack(
+                    receive_exactly(sock, REQUEST_HEADER.size))
+            except (EOFError, ConnectionResetError):
+                return
+
+            # A malformed frame leaves the stream unusable
+            if magic != MAGIC or request_cols != cols or \
+                    rows > _MAX_REQUEST_ROWS:
+                _send_error(
+                    sock, f'Invalid request: {rows} rows, '
+                    f'{request_cols} columns, {cols} expected')
+                return
+
+            # A client may disconnect in the middle of a frame
+            try:
+                data = receive_exactly(sock, rows * cols * 4)
+            except (EOFError, ConnectionResetError):
+                return
+            codes = np.frombuffer(
+                data, dtype=np.float32).reshape(rows, cols)
+
+            try:
+                probs = self.server.model_server.submit(codes)
+            except Exception as e:
+                _send_error(sock, str(e))
+                continue
+
+            send_matrix(sock, probs, RESPONSE_HEADER.pack(
+                STATUS_OK, probs.shape[0], probs.shape[1]))
+
+
+def _send_error(sock, message):
+    data = message.encode('utf-8')
+    sock.sendall(RESPONSE_HEADER.pack(STATUS_ERROR, len(data), 0) + data)
+
+
+def _remove_stale_socket(path):
+    """ Remove the socket of a server which is not running anymore """
+
+    if not os.path.exists(path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        _remove_socket(path)
+    else:
+        raise RuntimeError(f'A model server is running on {path}')
+    finally:
+        probe.close()
+
+
+def _remove_socket(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
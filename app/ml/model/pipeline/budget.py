@@ -0,0 +1,101 @@
+"""
+This module provides the wall-clock time budget of a training run.
+
+A training run is given a total time budget, split between the
+hyperparameter tuning and the final training stages. Each stage checks
+its budget and stops gracefully once it is exhausted.
+
+The module contains the following classes:
+    - TimeBudget: Wall-clock time budget of a training run, or run stage
+"""
+
+import math
+import time
+
+
+class TimeBudget:
+    """
+    Wall-clock time budget of a training run, or run stage.
+
+    A budget without a limit never expires, so the pipeline code does not
+    need to special case unbounded runs.
+
+    Attributes:
+      seconds: (float) allotted seconds, None when unbounded
+      start: (float) monotonic start time
+      deadline: (float) monotonic deadline, inf when unbounded
+      end: (float) monotonic time the budget was stopped at
+
+    Methods:
+      remaining: Seconds left before the deadline
+      consumed: Seconds consumed since the start
+      expired: Whether the budget is exhausted
+      split: Allot a fraction of the remaining time to a stage
+      stop: Stop the budget clock once the stage is done
+      summary: Budget summary for the run manifest
+    """
+
+    def __init__(self, seconds=None, deadline=None):
+
+        self.start = time.monotonic()
+        self.end = None
+        self.seconds = seconds
+
+        if seconds is not None:
+            self.deadline = self.start + seconds
+        else:
+            self.deadline = math.inf
+
+        # A stage budget never outlives its parent budget
+        if deadline is not None:
+            self.deadline = min(self.deadline, deadline)
+            self.seconds = self.deadline - self.start
+
+    def remaining(self) -> float:
+        """ Seconds left before the deadline """
+        return max(0.0, self.deadline - self._now())
+
+    def consumed(self) -> float:
+        """ Seconds consumed since the start """
+        return self._now() - self.start
+
+    def expired(self) -> bool:
+        """ Whether the budget is exhausted """
+        return self._now() >= self.deadline
+
+    def stop(self) -> 'TimeBudget':
+        """ Stop the budget clock once the stage is done """
+        if self.end is None:
+            self.end = time.monotonic()
+        return self
+
+    def split(self, fraction=1.0) -> 'TimeBudget':
+        """
+        Allot a fraction of the remaining time to a run stage.
+
+        Args:
+          fraction: (float) fraction of the remaining time
+
+        Returns:
+          TimeBudget: the stage budget
+        """
+        if math.isinf(self.deadline):
+            return TimeBudget()
+
+        return TimeBudget(self.remaining() * fraction, self.deadline)
+
+    def summary(self) -> dict:
+        """
+        Budget summary for the run manifest.
+
+        Returns:
+          dict: allotted and consumed seconds
+        """
+        return {
+            'allotted': self.seconds,
+            'consumed': round(self.consumed(), 3),
+            'exhausted': self.expired(),
+        }
+
+    def _now(self):
+        return self.end if self.end is not None else time.monotonic()
@@ -0,0 +1,144 @@
+"""
+This module provides the checkpoints of the model training.
+
+The booster is saved to the model path periodically during training,
+every N boosting rounds or every N seconds, whichever comes first. A
+training run killed before the model is published can then resume from
+the last checkpoint instead of starting over.
+
+Every checkpoint is written next to a JSON sidecar holding the dataset
+fingerprint and the hyperparameters, so a checkpoint is only resumed by
+a run on the same data, which continues with the same hyperparameters.
+Both files are written atomically, a crash during a write leaves the
+previous checkpoint intact.
+
+The module contains the following classes and functions:
+    - TrainingCheckpoint: Booster checkpoint callback of a training run
+    - remove_checkpoints: Remove all the checkpoints of the model path
+"""
+
+import os
+import glob
+import json
+import time
+from datetime import datetime
+
+import xgboost as xgb
+from loguru import logger
+
+_PREFIX = 'checkpoint_'
+
+
+class TrainingCheckpoint(xgb.callback.TrainingCallback):
+    """
+    Booster checkpoint callback of a training run.
+
+    Attributes:
+      path: (str) checkpoint file path, without extension
+      fingerprint: (str) dataset fingerprint
+      params: (dict) hyperparameters of the training run
+      rounds: (int) save every N boosting rounds
+      interval: (float) save every N seconds
+
+    Methods:
+      load: Load the checkpoint of the dataset
+      save: Save the booster checkpoint
+    """
+
+    def __init__(self, model_path, fingerprint, rounds, interval):
+        super().__init__()
+
+        self.path = os.path.join(model_path, f'{_PREFIX}{fingerprint}')
+        self.fingerprint = fingerprint
+        self.params = None
+        self.rounds = rounds
+        self.interval = interval
+
+        self._saved_round = 0
+        self._saved_time = time.monotonic()
+
+    def load(self):
+        """
+        Load the checkpoint of the dataset, and the hyperparameters of
+        the training run it was saved by.
+
+        Returns:
+          tuple: checkpoint booster and hyperparameters, None when there
+            is no checkpoint
+        """
+
+        try:
+            with open(f'{self.path}.json', 'r') as f:
+                sidecar = json.load(f)
+            if sidecar['fingerprint'] != self.fingerprint:
+                logger.warning('Checkpoint of a different dataset')
+                return None
+
+            booster = xgb.Booster(model_file=f'{self.path}.ubj')
+        except (OSError, KeyError, json.JSONDecodeError,
+                xgb.core.XGBoostError) as e:
+            logger.info(f'No checkpoint to resume from: {e}')
+            return None
+
+        self.params = sidecar['params']
+        self._saved_round = booster.num_boosted_rounds()
+
+        logger.info(f'Resuming from checkpoint at round {self._saved_round}')
+
+        return booster, self.params
+
+    def save(self, model):
+        """
+        Save the booster checkpoint, then its sidecar.
+
+        Args:
+          model: (xgb.Booster) booster being trained
+        """
+
+        rounds = model.num_boosted_rounds()
+        _write_atomic(f'{self.path}.ubj', model.save_raw('ubj'))
+        _write_atomic(f'{self.path}.json', json.dumps({
+            'fingerprint': self.fingerprint,
+            'params': self.params,
+            'rounds': rounds,
+            'timestamp': datetime.now().isoformat(),
+        }, indent=2).encode('utf-8'))
+
+        self._saved_round = rounds
+        self._saved_time = time.monotonic()
+        logger.debug(f'Saved checkpoint at round {rounds}')
+
+    def after_iteration(self, model, epoch, evals_log):
+
+        rounds = model.num_boosted_rounds() - self._saved_round
+        if rounds >= self.rounds or \
+                time.monotonic() - self._saved_time >= self.interval:
+            self.save(model)
+
+        return False
+
+
+def remove_checkpoints(model_path):
+    """
+    Remove all the checkpoints of the model path, once a model is
+    published the checkpoints are stale.
+
+    Args:
+      model_path: (str) model path
+    """
+    for fname in glob.glob(os.path.join(model_path, f'{_PREFIX}*')):
+        try:
+            os.remove(fname)
+        except OSError as e:
+            logger.warning(f'Error removing checkpoint {fname}: {e}')
+
+
+def _write_atomic(path, data):
+    """ Write the file through a synced temporary file and a rename """
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
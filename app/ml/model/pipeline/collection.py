@@ -4,6 +4,11 @@ dataFrame for model training.
 
 The module contains the following functions:
     - load_data_from_db: Load data from database
+    - stream_data_from_db: Stream data from database in chunks
+    - count_labels_in_db: Count the rows of each target label
+    - load_shard_from_db: Load a training data shard from database
+    - max_id_in_db: Return the greatest row id
+    - table_state_in_db: Return the change tracking state of the table
 """
 
 import pandas as pd
@@ -12,16 +17,19 @@ from loguru import logger
 from app.ml.config import db
 
 from app.web.models.mental_health import MentalHealthDbModel
-from sqlalchemy import select
+from sqlalchemy import select, func, text
 
 
-def load_data_from_db():
+def load_data_from_db(min_id=None):
     """
     Load data from database
 
     If no data is found in the database, the function logs an error
     message and returns an empty DataFrame.
 
+    Args:
+      min_id: (int) only load the rows whose id is greater than min_id
+
     Returns:
       pd.DataFrame: dataset
     """
@@ -30,4 +38,153 @@ def load_data_from_db():
                 MentalHealthDbModel.__table__}`)...')
 
     query = select(MentalHealthDbModel)
+    if min_id is not None:
+        query = query.where(MentalHealthDbModel.id > min_id)
+    return pd.read_sql(query, db.engine)
+
+
+def _holdout_filter(holdout_modulo, holdout):
+    """ Deterministic row split on the row id """
+    is_holdout = MentalHealthDbModel.id % holdout_modulo == 0
+    return is_holdout if holdout else ~is_holdout
+
+
+def stream_data_from_db(chunk_size, holdout_modulo=None, holdout=False):
+    """
+    Stream data from database in chunks
+
+    The rows are read through a server side cursor, only one chunk of
+    rows is held in memory at a time. With a holdout modulo, the rows
+    whose id is a multiple of the modulo are the holdout rows, and
+    only the holdout, or only the remaining rows are streamed.
+
+    Args:
+      chunk_size: (int) number of rows per chunk
+      holdout_modulo: (int) row id modulo of the holdout rows
+      holdout: (bool) stream the holdout rows
+
+    Returns:
+      Iterator[pd.DataFrame]: dataset chunks
+    """
+
+    query = select(MentalHealthDbModel).order_by(MentalHealthDbModel.id)
+    if holdout_modulo:
+        query = query.where(_holdout_filter(holdout_modulo, holdout))
+
+    with db.engine.connect().execution_options(
+            stream_results=True) as connection:
+        yield from pd.read_sql(query, connection, chunksize=chunk_size)
+
+
+def count_labels_in_db(holdout_modulo=None, holdout=False):
+    """
+    Count the rows of each target label
+
+    Args:
+      holdout_modulo: (int) row id modulo of the holdout rows
+      holdout: (bool) count the holdout rows
+
+    Returns:
+      dict: target label to row count
+    """
+
+    label = MentalHealthDbModel.ment14d
+    query = select(label, func.count()).group_by(label)
+    if holdout_modulo:
+        query = query.where(_holdout_filter(holdout_modulo, holdout))
+
+    with db.engine.connect() as connection:
+        return dict(connection.execute(query).all())
+
+
+def load_shard_from_db(rank, world_size, holdout_modulo):
+    """
+    Load a training data shard from database
+
+    The training rows, all rows but the holdout rows, are sharded by
+    blocks of consecutive ids, each block of holdout modulo ids is
+    assigned to one shard in turn, so the shards are the same size.
+
+    Args:
+      rank: (int) shard number
+      world_size: (int) number of shards
+      holdout_modulo: (int) row id modulo of the holdout rows
+
+    Returns:
+      pd.DataFrame: dataset shard
+    """
+
+    block = MentalHealthDbModel.id // holdout_modulo
+    query = select(MentalHealthDbModel).where(
+        _holdout_filter(holdout_modulo, False),
+        block % world_size == rank
+    )
     return pd.read_sql(query, db.engine)
+
+
+def max_id_in_db():
+    """
+    Return the greatest row id, the watermark of the rows a model is
+    trained on.
+
+    Returns:
+      int: greatest row id, None when the table is empty
+    """
+
+    with db.engine.connect() as connection:
+        return connection.execute(
+            select(func.max(MentalHealthDbModel.id))).scalar()
+
+
+def table_state_in_db():
+    """
+    Return the change tracking state of the table, which changes when
+    rows are added, deleted, replaced or updated in place.
+
+    On PostgreSQL, the state is the greatest row id and the inserted,
+    updated and deleted row counters of the table statistics, read
+    without scanning the table. The counters are reported by the server
+    shortly after each transaction, and a statistics reset changes the
+    state, at worst the snapshot is rewritten once more. On the other
+    databases, the state is the row count, the greatest row id and the
+    sum of each column, a scan of the table as the label counts.
+
+    Returns:
+      dict: change tracking state
+    """
+
+    table = MentalHealthDbModel.__table__
+    with db.engine.connect() as connection:
+        max_id = connection.execute(
+            select(func.max(MentalHealthDbModel.id))).scalar()
+
+        if connection.dialect.name == 'postgresql':
+            counters = connection.execute(
+                text(
+                    'SELECT n_tup_ins, n_tup_upd, n_tup_del '
+                    'FROM pg_stat_user_tables '
+                    'WHERE relid = CAST(:table AS regclass)'
+                ),
+                {'table': table.fullname}
+            ).one_or_none()
+            if counters is not None:
+                return {
+                    'max_id': max_id,
+                    'inserted': counters.n_tup_ins,
+                    'updated': counters.n_tup_upd,
+                    'deleted': counters.n_tup_del,
+                }
+
+        columns = list(table.columns)
+        rows, *sums = connection.execute(select(
+            func.count(), *[func.sum(column) for column in columns]
+        )).one()
+
+    return {
+        'rows': rows,
+        'max_id': max_id,
+        'column_sums': {
+            column.name: None if value is None else int(value)
+            for column, value in zip(columns, sums)
+        },
+    }
@@ -0,0 +1,205 @@
+"""
+This module provides the distillation of the trained model into a
+compact serving model.
+
+The tuned model can grow hundreds of rounds of deep trees, every tree is
+evaluated for each prediction. The distillation searches for a smaller
+model, which predicts within a configured tolerance of the full model:
+
+    - the full model truncated to its first rounds
+    - a student model, shallow trees trained on the soft probabilities
+      of the full model
+
+The smallest candidate within the log-loss and recall tolerance of the
+full model, measured on the test split, is the serving model.
+
+The module contains the following functions:
+    - distill_model: Search for a compact serving model
+"""
+
+import time
+
+import numpy as np
+import xgboost as xgb
+from loguru import logger
+from sklearn.metrics import log_loss, recall_score
+
+from app.ml.config.training import training_settings
+from app.ml.model.pipeline.preparation import NUM_CLASSES
+
+# Truncated candidates, share of the full model rounds
+_TRUNCATED_SHARES = (0.25, 0.5, 0.75)
+
+
+def distill_model(teacher, cache, params):
+    """
+    Search for a compact serving model, within the configured tolerance
+    of the full model.
+
+    Args:
+      teacher: (xgb.Booster) full model
+      cache: (DatasetCache) dataset splits, 'train', 'val' and 'test'
+      params: (dict) xgboost parameters of the full model
+
+    Returns:
+      tuple: serving model and distillation report, None when no
+        candidate is within the tolerance
+    """
+
+    start = time.perf_counter()
+    logger.info('Start: Distilling model...')
+
+    x_test, y_test, _ = cache.arrays('test')
+    reference = _measure(teacher, x_test, y_test, cache)
+
+    # 1. Candidates, the full model truncated to its first rounds
+    rounds = teacher.num_boosted_rounds()
+    candidates = {
+        f'truncated_{int(rounds * share)}': teacher[:int(rounds * share)]
+        for share in _TRUNCATED_SHARES if int(rounds * share) > 0
+    }
+
+    # 2. The student model
+    candidates['student'] = _train_student(teacher, cache, params)
+
+    # 3. Keep the smallest candidate within the tolerance
+    report = {'teacher': reference}
+    best = None
+    for name, model in candidates.items():
+        metrics = _measure(model, x_test, y_test, cache)
+        metrics['accepted'] = bool(
+            metrics['log_loss'] <= reference['log_loss'] +
+            training_settings.distill_log_loss_tolerance and
+            metrics['recall'] >= reference['recall'] -
+            training_settings.distill_recall_tolerance
+        )
+        report[name] = metrics
+
+        logger.debug(f'Distillation candidate {name}: {metrics}')
+
+        if metrics['accepted'] and (
+                best is None or metrics['size'] < report[best]['size']):
+            best = name
+
+    elapsed = time.perf_counter() - start
+    logger.info(f'End: Distilling model - elapsed: {elapsed:.2f}s')
+
+    if best is None:
+        logger.warning('No distilled model within the tolerance.')
+        return None
+
+    serving = report[best]
+    report['serving'] = {
+        'model': best,
+        'size_reduction': reference['size'] / serving['size'],
+        'latency_reduction': reference['latency_ms'] / serving['latency_ms'],
+    }
+
+    logger.info(
+        f'Serving model {best}: size '
+        f'{reference["size"]} -> {serving["size"]} bytes, single row '
+        f'latency {reference["latency_ms"]:.3f} -> '
+        f'{serving["latency_ms"]:.3f} ms, log-loss '
+        f'{reference["log_loss"]:.4f} -> {serving["log_loss"]:.4f}'
+    )
+
+    return candidates[best], report
+
+
+def _train_student(teacher, cache, params):
+    """
+    Train the student model on the soft probabilities of the teacher.
+
+    The student minimizes its softmax cross-entropy against the teacher
+    probabilities rather than the hard labels, through a custom
+    objective on the cached training matrix. The training rows are
+    neither copied nor repeated per class.
+    """
+
+    X_train, _, weight = cache.arrays('train')
+    targets = teacher.inplace_predict(X_train)
+    if weight is None:
+        weight = np.ones(len(X_train), dtype=np.float32)
+    weight = weight[:, None]
+
+    def soft_cross_entropy(margins, dtrain):
+        # Gradient and hessian of the multi:softprob objective, with
+        # the teacher probabilities as targets
+        probs = _softmax(margins)
+        grad = (probs - targets) * weight
+        hess = np.maximum(2.0 * probs * (1.0 - probs), 1e-16) * weight
+        return grad, hess
+
+    student_params = dict(params)
+    student_params['max_depth'] = training_settings.distill_max_depth
+    student_params['disable_default_eval_metric'] = 1
+
+    # Stop once the student no longer improves on the validation rows
+    student = xgb.train(
+        student_params,
+        cache.get('train'),
+        num_boost_round=training_settings.distill_rounds,
+        obj=soft_cross_entropy,
+        custom_metric=_mlogloss,
+        evals=[(cache.get('val'), 'val')],
+        early_stopping_rounds=10,
+        verbose_eval=False
+    )
+    return student[:student.best_iteration + 1]
+
+
+def _softmax(margins):
+
+    margins = margins - margins.max(axis=1, keepdims=True)
+    exp = np.exp(margins)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def _mlogloss(margins, dmatrix):
+    """ Log-loss of the hard labels, the custom objective outputs the
+    margins """
+
+    probs = _softmax(margins)
+    labels = dmatrix.get_label().astype(np.intp)
+    loss = -np.log(np.clip(probs[np.arange(len(labels)), labels], 1e-15, 1))
+    weight = dmatrix.get_weight()
+    if len(weight):
+        return 'mlogloss', float(np.average(loss, weights=weight))
+    return 'mlogloss', float(loss.mean())
+
+
+def _matrix(cache, X, y):
+    return xgb.DMatrix(
+        X,
+        label=y,
+        feature_names=cache.feature_names,
+        feature_types=cache.feature_types
+    )
+
+
+def _measure(model, x_test, y_test, cache, repeat=200):
+    """
+    Measure the model size, single row latency and test metrics.
+
+    The recall is the macro recall, every class weighs the same so the
+    recall of the minority classes counts.
+    """
+
+    probs = model.predict(_matrix(cache, x_test, y_test))
+
+    row = np.ascontiguousarray(x_test[:1])
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.inplace_predict(row)
+        latencies.append(time.perf_counter() - start)
+
+    return {
+        'rounds': model.num_boosted_rounds(),
+        'size': len(model.save_raw('ubj')),
+        'latency_ms': float(np.median(latencies) * 1000),
+        'log_loss': float(
+            log_loss(y_test, probs, labels=list(range(NUM_CLASSES)))),
+        'recall': float(recall_score(
+            y_test, probs.argmax(axis=1), average='macro', zero_division=0)),
+    }
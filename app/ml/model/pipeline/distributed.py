@@ -0,0 +1,198 @@
+"""
+This module provides the distributed training of the xgboost model.
+
+The training rows are sharded across worker processes, on one or several
+hosts. Each worker quantizes and builds the histograms of its own shard,
+the histograms are summed with xgboost's collective communication, so
+every worker grows the same trees and ends up with the same model. The
+tracker started by the coordinator assigns the worker ranks and connects
+the workers with each other.
+
+The coordinator runs the first workers, and receives the model trained
+by the worker of rank 0. Workers on other hosts join the tracker, their
+training parameters are broadcast by the worker of rank 0.
+
+The module contains the following classes and functions:
+    - start_tracker: Start the tracker the workers connect to
+    - run_workers: Run local workers, and return their models
+    - train_worker: Train the model on one data shard
+"""
+
+import socket
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import xgboost as xgb
+from loguru import logger
+from xgboost import collective
+from xgboost.tracker import RabitTracker
+
+from app.ml.model.pipeline.preparation import MentalHealthData
+from app.ml.model.pipeline.preparation import NUM_CLASSES
+from app.ml.model.pipeline.preparation import balanced_weights
+
+
+class _CollectiveDeadline(xgb.callback.TrainingCallback):
+    """
+    Stop boosting once the deadline is reached. The workers stop at the
+    same round, as soon as any of them reached the deadline.
+    """
+
+    def __init__(self, deadline):
+        super().__init__()
+        self.deadline = deadline
+        self.stopped = False
+
+    def after_iteration(self, model, epoch, evals_log):
+        expired = np.array([time.time() >= self.deadline], dtype=np.int32)
+        self.stopped = bool(collective.allreduce(
+            expired, collective.Op.MAX)[0])
+        return self.stopped
+
+
+def start_tracker(world_size, host_ip=None, port=0, timeout=0):
+    """
+    Start the tracker the workers connect to.
+
+    The workers are ranked by task id, so the first local worker of the
+    coordinator is always the worker of rank 0.
+
+    Args:
+      world_size: (int) total number of workers, on all hosts
+      host_ip: (str) address the tracker listens on
+      port: (int) port the tracker listens on, 0 for any free port
+      timeout: (int) seconds to wait for all the workers to connect,
+        0 to wait forever
+
+    Returns:
+      tuple: the tracker and the worker connection arguments
+    """
+
+    tracker = RabitTracker(
+        n_workers=world_size,
+        host_ip=host_ip or socket.gethostbyname(socket.gethostname()),
+        port=port,
+        sortby='task',
+        timeout=timeout
+    )
+    tracker.start()
+    worker_args = tracker.worker_args()
+
+    logger.info(
+        f'Tracker listening on {worker_args["dmlc_tracker_uri"]}:'
+        f'{worker_args["dmlc_tracker_port"]}, '
+        f'waiting for {world_size} workers'
+    )
+
+    return tracker, worker_args
+
+
+def run_workers(n_workers, worker_args, load_shard, task_prefix,
+                params=None, num_boost_round=None, deadline=None):
+    """
+    Run local workers in spawned processes, and return their models.
+
+    Args:
+      n_workers: (int) number of local workers
+      worker_args: (dict) tracker connection arguments
+      load_shard: (callable) picklable shard loader, called with the
+        worker rank and the world size, returns the shard DataFrame
+      task_prefix: (str) task id prefix of the local workers, ranks
+        follow the task id order
+      params: (dict) xgboost parameters, broadcast from rank 0
+      num_boost_round: (int) boosting rounds, broadcast from rank 0
+      deadline: (float) epoch time training stops at, broadcast
+        from rank 0
+
+    Returns:
+      list: trained model of each local worker, in task order
+    """
+
+    spawn = get_context('spawn')
+    with ProcessPoolExecutor(n_workers, mp_context=spawn) as pool:
+        futures = [
+            pool.submit(
+                train_worker,
+                {**worker_args, 'dmlc_task_id': f'{task_prefix}-{i:04d}'},
+                load_shard,
+                params,
+                num_boost_round,
+                deadline
+            )
+            for i in range(n_workers)
+        ]
+        return [future.result() for future in futures]
+
+
+def train_worker(worker_args, load_shard, params=None,
+                 num_boost_round=None, deadline=None):
+    """
+    Train the model on one data shard, in a worker process.
+
+    The class weights are computed from the label counts summed over
+    all the shards, the same weights as a single process training.
+
+    Args:
+      worker_args: (dict) tracker connection arguments, and task id
+      load_shard: (callable) shard loader
+      params: (dict) xgboost parameters, used by rank 0
+      num_boost_round: (int) boosting rounds, used by rank 0
+      deadline: (float) epoch time training stops at, used by rank 0
+
+    Returns:
+      xgb.Booster: trained model
+    """
+
+    with collective.CommunicatorContext(**worker_args):
+        rank = collective.get_rank()
+        world_size = collective.get_world_size()
+
+        # 1. The training configuration of rank 0 is used by all workers
+        params, num_boost_round, deadline = collective.broadcast(
+            (params, num_boost_round, deadline), 0)
+
+        # 2. Load and prepare the shard
+        start = time.perf_counter()
+        df = load_shard(rank, world_size)
+        mh = MentalHealthData(df.drop(columns='id', errors='ignore'))
+
+        counts = collective.allreduce(
+            np.bincount(mh.labels, minlength=NUM_CLASSES).astype(np.float64),
+            collective.Op.SUM
+        )
+        weights = balanced_weights(counts)
+
+        dtrain = xgb.QuantileDMatrix(
+            mh.features,
+            label=mh.labels,
+            weight=weights[mh.labels],
+            max_bin=params.get('max_bin'),
+            feature_names=mh.feature_names,
+            feature_types=mh.feature_types
+        )
+        logger.debug(
+            f'Worker {rank}/{world_size}: loaded {len(mh.labels)} rows '
+            f'in {time.perf_counter() - start:.2f}s'
+        )
+
+        # 3. Train, the histograms are synchronized every round
+        callbacks = []
+        if deadline is not None:
+            callbacks.append(_CollectiveDeadline(deadline))
+
+        start = time.perf_counter()
+        booster = xgb.train(
+            params,
+            dtrain,
+            num_boost_round=num_boost_round,
+            callbacks=callbacks
+        )
+        logger.debug(
+            f'Worker {rank}/{world_size}: trained '
+            f'{booster.num_boosted_rounds()} rounds '
+            f'in {time.perf_counter() - start:.2f}s'
+        )
+
+        return booster
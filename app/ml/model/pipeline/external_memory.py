@@ -0,0 +1,371 @@
+"""
+This module provides the external memory training data of the xgboost
+model, for datasets which do not fit in memory.
+
+The dataset is streamed in chunks, from the database or from the local
+snapshot files, and fed to xgboost through a data iterator. xgboost
+quantizes every chunk into pages cached on disk, so only one chunk of
+the dataset is held in memory at a time, whatever the dataset size. The
+composite features are computed on each chunk by MentalHealthData.
+
+The rows are split on their id, the rows whose id is a multiple of the
+holdout modulo are held out for validation, the other rows are used for
+training. The split is stable as new rows are added to the dataset.
+
+The module contains the following classes and functions:
+    - DbChunkSource: Stream the dataset chunks from the database
+    - SnapshotChunkSource: Read the dataset chunks from snapshot files
+    - ChunkIterator: xgboost data iterator over the dataset chunks
+    - get_chunk_source: Return the configured dataset chunk source
+    - evaluate: Evaluate a model on the streamed holdout rows
+    - remove_cache: Remove the external memory cache files
+"""
+
+import os
+import glob
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from loguru import logger
+
+from app.ml.config.training import training_settings
+from app.ml.model.pipeline.collection import count_labels_in_db
+from app.ml.model.pipeline.collection import stream_data_from_db
+from app.ml.model.pipeline.collection import table_state_in_db
+from app.ml.model.pipeline.preparation import MentalHealthData
+from app.ml.model.pipeline.preparation import NUM_CLASSES
+from app.ml.model.pipeline.preparation import target_labels
+
+_PARTITIONS = {False: 'train', True: 'holdout'}
+
+
+class DbChunkSource:
+    """
+    Stream the dataset chunks from the database, through a server side
+    cursor.
+
+    Attributes:
+      chunk_rows: (int) rows per chunk
+      holdout_modulo: (int) row id modulo of the holdout rows
+
+    Methods:
+      chunks: Iterate over the chunks of a dataset partition
+      label_counts: Row count of each label of a dataset partition
+    """
+
+    def __init__(self, chunk_rows, holdout_modulo):
+
+        self.chunk_rows = chunk_rows
+        self.holdout_modulo = holdout_modulo
+
+    def chunks(self, holdout=False):
+        """
+        Iterate over the chunks of a dataset partition.
+
+        Args:
+          holdout: (bool) the holdout partition, or the training one
+
+        Returns:
+          Iterator[pd.DataFrame]: dataset chunks, without the row id
+        """
+        for df in stream_data_from_db(
+                self.chunk_rows, self.holdout_modulo, holdout):
+            yield df.drop(columns='id')
+
+    def label_counts(self, holdout=False) -> np.ndarray:
+        """
+        Row count of each label of a dataset partition, counted by the
+        database.
+
+        Args:
+          holdout: (bool) the holdout partition, or the training one
+
+        Returns:
+          np.ndarray: row counts, indexed by label
+        """
+        counts = np.zeros(NUM_CLASSES, dtype=np.int64)
+        for code, count in count_labels_in_db(
+                self.holdout_modulo, holdout).items():
+            counts[target_labels([code])[0]] = count
+        return counts
+
+
+class SnapshotChunkSource:
+    """
+    Read the dataset chunks from the local snapshot files.
+
+    The snapshot is a copy of the database table, one '.npy' file per
+    chunk and partition, memory mapped when read. The snapshot is
+    written from the database when missing, and written again when the
+    database no longer matches the snapshot: its row counts, greatest
+    row id, or column sums.
+
+    Attributes:
+      path: (str) snapshot directory
+      db: (DbChunkSource) the database the snapshot is written from
+
+    Methods:
+      chunks: Iterate over the chunks of a dataset partition
+      label_counts: Row count of each label of a dataset partition
+      refresh: Write the snapshot, unless it is up to date
+    """
+
+    def __init__(self, path, chunk_rows, holdout_modulo):
+
+        self.path = path
+        self.db = DbChunkSource(chunk_rows, holdout_modulo)
+        self._meta = None
+
+    def chunks(self, holdout=False):
+        """
+        Iterate over the chunks of a dataset partition.
+
+        Args:
+          holdout: (bool) the holdout partition, or the training one
+
+        Returns:
+          Iterator[pd.DataFrame]: dataset chunks
+        """
+        meta = self.refresh()
+        partition = os.path.join(self.path, _PARTITIONS[holdout])
+
+        for fname in sorted(glob.glob(f'{partition}/chunk_*.npy')):
+            yield pd.DataFrame(
+                np.load(fname, mmap_mode='r'),
+                columns=meta['columns'],
+                copy=False
+            )
+
+    def label_counts(self, holdout=False) -> np.ndarray:
+        """
+        Row count of each label of a dataset partition, recorded when
+        the snapshot was written.
+
+        Args:
+          holdout: (bool) the holdout partition, or the training one
+
+        Returns:
+          np.ndarray: row counts, indexed by label
+        """
+        meta = self.refresh()
+        return np.array(meta['label_counts'][_PARTITIONS[holdout]])
+
+    def refresh(self) -> dict:
+        """
+        Write the snapshot, unless it is up to date with the database.
+
+        The snapshot is written into a temporary directory, then moved in
+        place, so a crashed write never leaves a partial snapshot behind.
+
+        Returns:
+          dict: snapshot metadata
+        """
+
+        if self._meta is not None:
+            return self._meta
+
+        # 1. Compare the snapshot with the database state, the label
+        # counts miss the rows replaced or updated in place
+        counts = {
+            name: self.db.label_counts(holdout).tolist()
+            for holdout, name in _PARTITIONS.items()
+        }
+        state = table_state_in_db()
+        meta = self._read_meta()
+        if meta and meta['label_counts'] == counts and \
+                meta.get('table_state') == state and \
+                meta['holdout_modulo'] == self.db.holdout_modulo:
+            self._meta = meta
+            return meta
+
+        logger.info(f'Writing dataset snapshot into {self.path}')
+
+        # 2. Stream the database partitions into the chunk files
+        tmp_path = f'{self.path}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+        columns = None
+        for holdout, name in _PARTITIONS.items():
+            os.makedirs(os.path.join(tmp_path, name))
+            for i, df in enumerate(self.db.chunks(holdout)):
+                columns = list(df.columns)
+                np.save(
+                    os.path.join(tmp_path, name, f'chunk_{i:06d}.npy'),
+                    df.to_numpy()
+                )
+
+        meta = {
+            'columns': columns,
+            'label_counts': counts,
+            'table_state': state,
+            'holdout_modulo': self.db.holdout_modulo,
+        }
+        with open(os.path.join(tmp_path, 'snapshot.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+        # 3. Swap the snapshot
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp_path, self.path)
+
+        self._meta = meta
+        return meta
+
+    def _read_meta(self):
+
+        try:
+            with open(os.path.join(self.path, 'snapshot.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+
+class ChunkIterator(xgb.DataIter):
+    """
+    xgboost data iterator over the dataset chunks.
+
+    The composite features, labels and sample weights are computed on
+    each chunk as it is handed to xgboost.
+
+    Attributes:
+      source: (DbChunkSource | SnapshotChunkSource) dataset chunk source
+      weights: (np.ndarray) class weights, indexed by label
+      rows: (int) number of rows iterated in the last pass
+    """
+
+    def __init__(self, source, weights, cache_prefix):
+
+        self.source = source
+        self.weights = weights
+        self.rows = 0
+        self._chunks = None
+
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data) -> int:
+
+        if self._chunks is None:
+            self._chunks = self.source.chunks()
+
+        df = next(self._chunks, None)
+        if df is None:
+            return 0
+
+        mh = MentalHealthData(df)
+        input_data(
+            data=mh.features,
+            label=mh.labels,
+            weight=self.weights[mh.labels],
+            feature_names=mh.feature_names,
+            feature_types=mh.feature_types
+        )
+        self.rows += len(mh.labels)
+
+        return 1
+
+    def reset(self):
+
+        if self._chunks is not None:
+            self._chunks.close()
+        self._chunks = None
+        self.rows = 0
+
+
+def get_chunk_source():
+    """
+    Return the configured dataset chunk source.
+
+    Returns:
+      DbChunkSource | SnapshotChunkSource: dataset chunk source
+    """
+
+    chunk_rows = training_settings.external_memory_chunk_rows
+    holdout_modulo = training_settings.holdout_modulo
+
+    if training_settings.external_memory_source == 'snapshot':
+        return SnapshotChunkSource(
+            training_settings.external_memory_snapshot_path,
+            chunk_rows,
+            holdout_modulo
+        )
+
+    return DbChunkSource(chunk_rows, holdout_modulo)
+
+
+def evaluate(model, source) -> dict:
+    """
+    Evaluate a model on the holdout rows, one chunk at a time.
+
+    The log-loss is accumulated per row, the other metrics are computed
+    from the accumulated confusion matrix. The metrics match the sklearn
+    metrics, with the 'weighted' average.
+
+    Args:
+      model: (xgb.Booster) trained model
+      source: (DbChunkSource | SnapshotChunkSource) dataset chunk source
+
+    Returns:
+      dict: holdout metrics
+    """
+
+    loss = 0.0
+    confusion = np.zeros((NUM_CLASSES, NUM_CLASSES), dtype=np.int64)
+
+    categorical = 'c' in (model.feature_types or [])
+    for df in source.chunks(holdout=True):
+        mh = MentalHealthData(df, categorical=categorical)
+        y = mh.labels
+
+        probs = model.predict(xgb.DMatrix(
+            mh.features,
+            feature_names=mh.feature_names,
+            feature_types=mh.feature_types
+        ))
+
+        # Normalized and clipped as sklearn's log_loss
+        probs = probs / probs.sum(axis=1, keepdims=True)
+        eps = np.finfo(probs.dtype).eps
+        loss -= np.log(np.clip(probs[np.arange(len(y)), y], eps, 1)).sum()
+
+        confusion += np.bincount(
+            y * NUM_CLASSES + probs.argmax(axis=1),
+            minlength=NUM_CLASSES ** 2
+        ).reshape(NUM_CLASSES, NUM_CLASSES)
+
+    support = confusion.sum(axis=1)
+    rows = support.sum()
+    if rows == 0:
+        return {'rows': 0}
+
+    # Per class metrics, zero when undefined
+    tp = np.diag(confusion).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.nan_to_num(tp / confusion.sum(axis=0))
+        recall = np.nan_to_num(tp / support)
+        f1 = np.nan_to_num(2 * precision * recall / (precision + recall))
+
+    share = support / rows
+    return {
+        'rows': int(rows),
+        'log_loss': float(loss / rows),
+        'accuracy': float(tp.sum() / rows),
+        'precision': float(precision @ share),
+        'recall': float(recall @ share),
+        'f1': float(f1 @ share),
+    }
+
+
+def remove_cache(cache_prefix):
+    """
+    Remove the external memory cache files of a training run.
+
+    Args:
+      cache_prefix: (str) cache file prefix
+    """
+    for fname in glob.glob(f'{cache_prefix}*'):
+        try:
+            os.remove(fname)
+        except OSError as e:
+            logger.warning(f'Error removing cache file {fname}: {e}')
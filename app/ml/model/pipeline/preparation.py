@@ -4,12 +4,51 @@ This module prepares (preprocessing) the dataset for model training
 We define here the different characteristics of the dataset we want to
 provde to the model.
 
+The dataset is held as one contiguous feature matrix plus a label array.
+When the dataset is split, the rows are laid out once in split order,
+[train | validation | test], so each split is a view of the matrix
+and never a copy.
+
+The survey answers are categorical codes, e.g. 1/2/7/9 for yes, no,
+not sure and refused. With the categorical encoding, the codes of every
+categorical feature are mapped to dense category codes, using the fixed
+answer domain of the feature in the survey input form, and handed to
+xgboost as categorical features. The trees then split on sets of
+answers instead of thresholds over the codes. Codes outside the answer
+domain are missing values. The composite features and the encoding are
+computed by the preprocessor of the dataset, which the inference runs
+as well.
+
 The module contains the following functions:
     - prepare_df: Load, prepare data
+    - target_labels: Convert the target codes to xgboost labels
+    - class_weights: Compute the balanced weight of each class
+    - balanced_weights: Compute the balanced class weights from counts
+    - collapse_duplicates: Group identical rows into weighted unique rows
+    - get_mental_health_data: Load, prepare and split the dataset
+    - get_new_mental_health_data: Load and split the rows above a watermark
 """
 
+import hashlib
+
+import numpy as np
+import pandas as pd
 from loguru import logger
+from sklearn.model_selection import train_test_split
+
+from app.ml.config.training import training_settings
 from app.ml.model.pipeline.collection import load_data_from_db
+from app.ml.model.pipeline.preprocessing import COMPOSITE_FEATURES
+from app.ml.model.pipeline.preprocessing import CONTINUOUS_FEATURES
+from app.ml.model.pipeline.preprocessing import Preprocessor
+
+# _MENT14D target codes to xgboost labels lookup table, xgboost requires
+# the class labels to start from 0: {1: 0, 2: 1, 3: 2, 9: 3}
+_TARGET_CODES = np.array([1, 2, 3, 9])
+_LABEL_LOOKUP = np.full(_TARGET_CODES.max() + 1, -1, dtype=np.int32)
+_LABEL_LOOKUP[_TARGET_CODES] = np.arange(len(_TARGET_CODES))
+
+NUM_CLASSES = len(_TARGET_CODES)
 
 
 class MentalHealthData():
@@ -19,91 +58,404 @@ class MentalHealthData():
 
     Attributes:
       target (str): target variable
+      feature_names (list): feature matrix column names
+      feature_types (list): xgboost feature types of the matrix columns
       categorical_features (list): list of categorical features
+      categorical (bool): the categorical features are encoded as
+        xgboost categorical features
+      preprocessor (Preprocessor): feature preprocessing of the dataset
+      watermark (int): greatest row id of the dataset, when loaded from
+        the database
     """
 
-    def __init__(self, df):
+    def __init__(self, df, row_order=None, split_sizes=None,
+                 categorical=None):
         """
         Initialize the dataset and define the dataset characteristics
 
         Task:
           - Load and prepare the dataset
           - Define the dataset characteristics
+
+        Args:
+          df: (pd.DataFrame) dataset, with or without the target
+          row_order: (array) row positions of the dataset, in split order
+          split_sizes: (dict) number of rows of each split, in split order
+          categorical: (bool) encode the categorical features, defaults
+            to the training settings
         """
 
-        # 1. Make a copy of the dataset
-        self._df = df.copy()
+        # 1. Define the target variable
+        self.target = '_MENT14D'
+        self.watermark = None
 
-        # Integrate composite features
-        self._integrate_composite_features()
+        if categorical is None:
+            categorical = training_settings.categorical_encoding
+        self.categorical = categorical
 
-        # 2. Define the target variable
-        self.target = '_MENT14D'
+        columns = [col for col in df.columns if col != self.target]
+        self.preprocessor = Preprocessor.fit(columns, categorical)
+        self.feature_names = self.preprocessor.feature_names
+        self.feature_types = self.preprocessor.feature_types
 
         # Define the feature groups
 
-        # 3. Numeric features need scaler
-        continuous_features = ['PHYSHLTH', 'POORHLTH', 'MARIJAN1']
-        aggregated_features = [
-            'Mental_Health_Composite',
-            'Income_Education_Interaction',
-            'Physical_Mental_Interaction',
-        ]
-        non_categorical_features = continuous_features + aggregated_features
+        # Numeric features need scaler
+        non_categorical_features = CONTINUOUS_FEATURES + COMPOSITE_FEATURES
 
-        # 4. Categorical features
+        # Categorical features
         self.categorical_features = [
-            col for col in self._df.columns
-            if col not in (non_categorical_features + [self.target])
+            col for col in columns if col not in non_categorical_features
         ]
 
+        # 2. Copy the dataset into one contiguous feature matrix, one
+        # column at a time, so only a single column is ever duplicated
+        n_rows = len(df) if row_order is None else len(row_order)
+        self._X = np.empty(
+            (n_rows, len(self.feature_names)), dtype=np.float32)
+
+        for i, col in enumerate(columns):
+            values = df[col].to_numpy()
+            self._X[:, i] = values if row_order is None else values[row_order]
+
+        self._check_answer_codes()
+
+        # Integrate composite features, and encode the categorical
+        # features
+        self.preprocessor.apply(self._X)
+
+        self._y = None
+        if self.target in df.columns:
+            values = df[self.target].to_numpy()
+            self._y = target_labels(
+                values if row_order is None else values[row_order])
+
+        # Row slices of the dataset splits
+        self._splits = {}
+        start = 0
+        for name, size in (split_sizes or {}).items():
+            self._splits[name] = slice(start, start + size)
+            start += size
+
+    @property
+    def features(self) -> np.ndarray:
+        """ The feature matrix """
+        return self._X
+
+    @property
+    def labels(self) -> np.ndarray:
+        """ The xgboost labels, None when the dataset has no target """
+        return self._y
+
+    def split(self, name) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the features and labels of a dataset split. Both are
+        views of the dataset arrays.
+
+        Args:
+          name: (str) split name, e.g. 'train'
+
+        Returns:
+          tuple: split features and labels
+        """
+        rows = self._splits[name]
+        return self._X[rows], self._y[rows]
+
     def get_data(self):
         """
-        Return the dataset
+        Return the feature matrix as a DataFrame, without copying it
 
         Returns:
           pd.DataFrame: dataset
         """
-        return self._df
+        return pd.DataFrame(self._X, columns=self.feature_names, copy=False)
+
+    def _check_answer_codes(self):
+        """
+        Count the answer codes outside the feature domains, encoded as
+        missing values, and reject the dataset when a column has too
+        many of them.
+
+        Raises:
+          ValueError: the unknown codes of a column exceed the
+            max_unknown_code_share setting
+        """
+
+        n_rows = len(self._X)
+        if n_rows == 0:
+            return
+
+        limit = training_settings.max_unknown_code_share
+        rejected = []
+        for col, count in self.preprocessor.unknown_codes(self._X).items():
+            share = count / n_rows
+            logger.warning(
+                f'{col}: {count} unknown answer codes ({share:.2%} of '
+                f'the rows), encoded as missing values'
+            )
+            if share > limit:
+                rejected.append(col)
+
+        if rejected:
+            raise ValueError(
+                f'Unknown answer codes above {limit:.2%} of the rows: '
+                f'{", ".join(rejected)}'
+            )
+
+    def fingerprint(self) -> str:
+        """
+        Return the dataset fingerprint, a digest of the column names
+        and the row values. Identical datasets share the fingerprint.
+
+        Returns:
+          str: dataset fingerprint
+        """
+        digest = hashlib.sha256(','.join(self.feature_names).encode())
+        digest.update(np.ascontiguousarray(self._X).data)
+        if self._y is not None:
+            digest.update(np.ascontiguousarray(self._y).data)
+        return digest.hexdigest()[:16]
+
+
+def target_labels(y):
+    """
+    Convert the target codes to xgboost labels, using the label
+    lookup table.
+
+    Args:
+      y: (array) _MENT14D target codes
+
+    Returns:
+      np.ndarray: xgboost labels
+    """
+    return _LABEL_LOOKUP[np.asarray(y, dtype=np.intp)]
+
+
+def class_weights(y):
+    """
+    Compute the balanced weight of each class, the same weights as
+    sklearn's compute_class_weight('balanced'). The weight of a sample
+    is looked up by its label: class_weights(y)[y].
+
+    Args:
+      y: (array) xgboost labels
+
+    Returns:
+      np.ndarray: class weights, indexed by label
+    """
+    return balanced_weights(np.bincount(y, minlength=NUM_CLASSES))
 
-    def _integrate_composite_features(self):
-        # Create a new copy of the cleaned dataset
-        mental_health_features = ['EMTSUPRT', 'ADDEPEV3', 'POORHLTH']
-        # Using Nonlinear interaction
-        self._df['Physical_Mental_Interaction'] = self._df['GENHLTH'].astype(
-            int) * self._df['PHYSHLTH']
-        # Income and Education Interaction
-        self._df['Income_Education_Interaction'] = self._df['INCOME3'].astype(
-            int) * self._df['EDUCA'].astype(int)
-        # Mental Health
-        self._df['Mental_Health_Composite'] = self._df[
-            mental_health_features
-        ].mean(axis=1)
 
+def balanced_weights(counts):
+    """
+    Compute the balanced class weights from the row count of each class,
+    for datasets too large to hold the labels in memory.
+
+    Args:
+      counts: (array) row count of each class, indexed by label
+
+    Returns:
+      np.ndarray: class weights, indexed by label
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    n_classes = np.count_nonzero(counts)
+    with np.errstate(divide='ignore'):
+        weights = np.where(
+            counts > 0, counts.sum() / (n_classes * counts), 0)
+    return weights
+
+
+def collapse_duplicates(X, y):
+    """
+    Group identical (features, target) rows into unique rows.
+
+    Survey answers are small categorical codes, many respondents share
+    the same answers and target. Training on the unique rows, each
+    weighted by its count, optimizes the same objective on fewer rows.
+
+    Args:
+      X: (array) features
+      y: (array) xgboost labels
+
+    Returns:
+      tuple: unique features, unique labels, and the count of each row
+    """
+
+    # View each (features, target) row as a single opaque value
+    rows = np.empty((len(X), X.shape[1] + 1), dtype=np.float32)
+    rows[:, :-1] = X
+    rows[:, -1] = y
+    keys = rows.view(np.dtype((np.void, rows.itemsize * rows.shape[1])))
+
+    _, first, counts = np.unique(
+        keys.ravel(), return_index=True, return_counts=True)
+    del rows, keys
+
+    logger.info(
+        f'Collapsed {len(X)} rows into {len(first)} unique rows, '
+        f'compression ratio: {len(X) / max(len(first), 1):.2f}'
+    )
+
+    return X[first], y[first], counts
+
+
+def _split_order(labels, test_size, val_size, seed):
+    """
+    Stratified split of the dataset rows.
+
+    Returns:
+      tuple: row positions in split order, and the size of each split
+    """
+    rows = np.arange(len(labels))
+
+    train_rows, temp_rows = train_test_split(
+        rows,
+        stratify=labels,
+        test_size=test_size,
+        random_state=seed
+    )
+    # split once more for the validation and test sets
+    val_rows, test_rows = train_test_split(
+        temp_rows,
+        stratify=labels[temp_rows],
+        test_size=val_size,
+        random_state=seed
+    )
+
+    order = np.concatenate([train_rows, val_rows, test_rows])
+    sizes = {
+        'train': len(train_rows),
+        'val': len(val_rows),
+        'test': len(test_rows),
+    }
+    return order, sizes
 
-def _prepare_df():
+
+def _holdout_split_order(labels, holdout, val_share, seed):
+    """
+    Split of the dataset rows, the holdout rows are the test rows, the
+    other rows are split in a stratified manner.
+
+    Returns:
+      tuple: row positions in split order, and the size of each split
+    """
+    rows = np.flatnonzero(~holdout)
+    test_rows = np.flatnonzero(holdout)
+
+    # The validation rows keep their share of the whole dataset
+    n_val = min(round(val_share * len(labels)), len(rows) // 2)
+    train_rows, val_rows = train_test_split(
+        rows,
+        stratify=labels[rows],
+        test_size=max(n_val, 1),
+        random_state=seed
+    )
+
+    order = np.concatenate([train_rows, val_rows, test_rows])
+    sizes = {
+        'train': len(train_rows),
+        'val': len(val_rows),
+        'test': len(test_rows),
+    }
+    return order, sizes
+
+
+def _prepare_df(min_id=None):
     """
     Load, Prepare data. Return dataframe
 
+    Args:
+      min_id: (int) only load the rows whose id is greater than min_id
+
     Returns:
-      pd.DataFrame: dataset
+      tuple: dataset, and the row ids
     """
     # Load dataset from collection
-    df = load_data_from_db()
+    df = load_data_from_db(min_id)
     # Remove the column id
-    df.drop('id', axis=1, inplace=True)
+    ids = df.pop('id').to_numpy()
 
     logger.debug('Loaded data from db successfully.')
 
-    return df
+    return df, ids
 
 
-def get_mental_health_data() -> MentalHealthData:
+def get_mental_health_data(
+        test_size=None, val_size=0.5, seed=None,
+        holdout_modulo=None) -> MentalHealthData:
     """
     Load and prepare the dataset
 
+    With a test size the dataset is split in a stratified manner into
+    the 'train', 'val' and 'test' splits. The test size is the share of
+    the rows set aside for validation and testing, the validation size
+    is the share of these rows used for validation.
+
+    With a holdout modulo, the 'test' split is the holdout rows instead,
+    the rows whose id is a multiple of the modulo, as the external
+    memory, distributed and refresh training. The holdout rows are never
+    trained on, and the models are compared on them, see
+    app.ml.model.evaluation. The other rows are split into the 'train'
+    and 'val' splits, the 'val' split keeps its share of the dataset.
+
+    Args:
+      test_size: (float) share of the validation and test rows
+      val_size: (float) validation share of the validation and test rows
+      seed: (int) random seed of the split
+      holdout_modulo: (int) row id modulo of the test rows
+
     Returns:
       MentalHealthData: dataset characteristics
     """
-    df = _prepare_df()
-    return MentalHealthData(df)
+    df, ids = _prepare_df()
+
+    if test_size is None:
+        mh = MentalHealthData(df)
+    elif holdout_modulo:
+        labels = target_labels(df['_MENT14D'].to_numpy())
+        order, sizes = _holdout_split_order(
+            labels, ids % holdout_modulo == 0,
+            test_size * (1 - val_size), seed)
+        mh = MentalHealthData(df, row_order=order, split_sizes=sizes)
+    else:
+        labels = target_labels(df['_MENT14D'].to_numpy())
+        order, sizes = _split_order(labels, test_size, val_size, seed)
+        mh = MentalHealthData(df, row_order=order, split_sizes=sizes)
+
+    mh.watermark = int(ids.max()) if len(ids) else None
+    return mh
+
+
+def get_new_mental_health_data(watermark, holdout_modulo, categorical=None):
+    """
+    Load the rows added since a model was trained, the rows whose id is
+    greater than the model watermark.
+
+    The rows are split on their id into the 'train' and 'val' splits,
+    the rows whose id is a multiple of the holdout modulo are the
+    validation rows.
+
+    Args:
+      watermark: (int) greatest row id the model was trained on
+      holdout_modulo: (int) row id modulo of the validation rows
+      categorical: (bool) encode the categorical features, as the
+        model the rows are added to
+
+    Returns:
+      MentalHealthData: new rows, None when there are none
+    """
+    df, ids = _prepare_df(min_id=watermark)
+    if not len(ids):
+        return None
+
+    holdout = ids % holdout_modulo == 0
+    train_rows, val_rows = np.flatnonzero(~holdout), np.flatnonzero(holdout)
+
+    mh = MentalHealthData(
+        df,
+        row_order=np.concatenate([train_rows, val_rows]),
+        split_sizes={'train': len(train_rows), 'val': len(val_rows)},
+        categorical=categorical
+    )
+    mh.watermark = int(ids.max())
+    return mh
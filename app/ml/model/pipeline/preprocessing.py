@@ -0,0 +1,381 @@
+"""
+This module provides the preprocessing of the model features, shared by
+the training and the inference.
+
+The preprocessor is fitted at training time on the dataset columns:
+the column order of the model, the survey answer codes of every
+categorical feature and the composite feature formulas. It is saved as
+JSON in the model bundle, next to the model, so the inference encodes
+the features exactly as the model was trained, with a handful of numpy
+operations.
+
+    {
+      "columns": ["POORHLTH", "PHYSHLTH", "GENHLTH", ...],
+      "inputs": ["poorhlth", "physhlth", "genhlth", ...],
+      "categories": {"GENHLTH": [1, 2, 3, 4, 5, 7, 9], ...},
+      "composites": [["Physical_Mental_Interaction", "product",
+                      ["GENHLTH", "PHYSHLTH"]], ...]
+    }
+
+The answer codes of the categorical features are the codes of the BRFSS
+codebook, checked in as ANSWER_CODES, not the options of the survey
+input form. A code outside of its feature domain is a missing value.
+
+The module contains the following classes and functions:
+    - Preprocessor: Feature preprocessing of a model
+    - category_codes: Return the answer codes of every survey feature
+"""
+
+import json
+from functools import lru_cache
+
+import numpy as np
+
+# Composite features, appended after the dataset features, computed
+# from the answer codes: (name, operation, input columns)
+COMPOSITES = [
+    # Using Nonlinear interaction
+    ('Physical_Mental_Interaction', 'product', ('GENHLTH', 'PHYSHLTH')),
+    # Income and Education Interaction
+    ('Income_Education_Interaction', 'product', ('INCOME3', 'EDUCA')),
+    # Mental Health
+    ('Mental_Health_Composite', 'mean', ('EMTSUPRT', 'ADDEPEV3', 'POORHLTH')),
+]
+COMPOSITE_FEATURES = [name for name, _, _ in COMPOSITES]
+
+# Features answered with a count of days, kept as numeric features
+CONTINUOUS_FEATURES = ['PHYSHLTH', 'POORHLTH', 'MARIJAN1']
+
+# Answer codes of a count of days, 77/777 don't know, 88/888 none,
+# 99/999 refused
+_DAYS = list(range(1, 31)) + [77, 88, 99]
+_DAYS_3 = list(range(1, 31)) + [777, 888, 999]
+# Answer codes of a yes/no question, 7 don't know, 9 refused
+_YES_NO = [1, 2, 7, 9]
+
+# Answer codes of every survey feature, from the BRFSS codebook, in the
+# database column order
+ANSWER_CODES = {
+    'POORHLTH': _DAYS,
+    'PHYSHLTH': _DAYS,
+    'GENHLTH': [1, 2, 3, 4, 5, 7, 9],
+    'DIFFWALK': _YES_NO,
+    'DIFFALON': _YES_NO,
+    'CHECKUP1': [1, 2, 3, 4, 7, 8, 9],
+    'DIFFDRES': _YES_NO,
+    'ADDEPEV3': _YES_NO,
+    'ACEDEPRS': _YES_NO,
+    'SDLONELY': [1, 2, 3, 4, 5, 7, 9],
+    'LSATISFY': [1, 2, 3, 4, 7, 9],
+    'EMTSUPRT': [1, 2, 3, 4, 5, 7, 9],
+    'DECIDE': _YES_NO,
+    'CDSOCIA1': _YES_NO,
+    'CDDISCU1': _YES_NO,
+    'CIMEMLO1': _YES_NO,
+    'SMOKDAY2': [1, 2, 3, 7, 9],
+    'ALCDAY4': _DAYS_3,
+    'MARIJAN1': _DAYS,
+    'EXEROFT1': list(range(1, 31)) + [777, 999],
+    'USENOW3': [1, 2, 3, 7, 9],
+    'FIREARM5': _YES_NO,
+    'INCOME3': list(range(1, 12)) + [77, 99],
+    'EDUCA': [1, 2, 3, 4, 5, 6, 9],
+    'EMPLOY1': [1, 2, 3, 4, 5, 6, 7, 8, 9],
+    'SEX': _YES_NO,
+    'MARITAL': [1, 2, 3, 4, 5, 6, 9],
+    'ADULT': [1, 2],
+    'RRCLASS3': [1, 2, 3, 4, 5, 6, 7, 8, 77, 99],
+    'QSTLANG': [1, 2],
+    '_STATE': [
+        1, 2, 4, 5, 6, 8, 9, 10, 11, 12, 13, 15, 16, 17, 18, 19, 20, 21,
+        22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36, 37,
+        38, 39, 40, 41, 42, 44, 45, 46, 47, 48, 49, 50, 51, 53, 54, 55,
+        56, 66, 72, 78
+    ],
+    'VETERAN3': _YES_NO,
+    'MEDCOST1': _YES_NO,
+    'SDHBILLS': _YES_NO,
+    'SDHEMPLY': _YES_NO,
+    'SDHFOOD1': [1, 2, 3, 4, 5, 7, 9],
+    'SDHSTRE1': [1, 2, 3, 4, 5, 7, 9],
+    'SDHUTILS': _YES_NO,
+    'SDHTRNSP': _YES_NO,
+    'CDHOUS1': _YES_NO,
+    'FOODSTMP': _YES_NO,
+    'PREGNANT': _YES_NO,
+    'ASTHNOW': _YES_NO,
+    'HAVARTH4': _YES_NO,
+    'CHCSCNC1': _YES_NO,
+    'CHCOCNC1': _YES_NO,
+    'DIABETE4': [1, 2, 3, 4, 7, 9],
+    'CHCCOPD3': _YES_NO,
+    'CHOLCHK3': [1, 2, 3, 4, 5, 6, 7, 9],
+    'BPMEDS1': _YES_NO,
+    'BPHIGH6': [1, 2, 3, 4, 7, 9],
+    'CVDSTRK3': _YES_NO,
+    'CVDCRHD4': _YES_NO,
+    'CHCKDNY2': _YES_NO,
+    'CHOLMED3': _YES_NO,
+}
+
+
+class Preprocessor:
+    """
+    Feature preprocessing of a model.
+
+    Attributes:
+      columns: (list) dataset feature columns, in the model order
+      inputs: (list) request field of each column
+      categories: (dict) answer codes of each categorical column
+      composites: (list) composite feature formulas
+      feature_names: (list) model feature names
+      feature_types: (list) model xgboost feature types
+
+    Methods:
+      fit: Fit the preprocessor on the dataset columns
+      for_model: Fit the preprocessor of a trained model
+      apply: Compute the composite features and encode the categories
+      transform: Build the model feature matrix of request records
+      transform_codes: Build the model feature matrix of answer codes
+      unknown_codes: Count the answer codes outside the domains
+      to_json: Serialize the preprocessor
+      from_json: Load a serialized preprocessor
+    """
+
+    def __init__(self, columns, inputs, categories, composites):
+
+        self.columns = list(columns)
+        self.inputs = list(inputs)
+        self.categories = {
+            col: [int(code) for code in codes]
+            for col, codes in categories.items()
+        }
+        self.composites = [
+            (name, op, tuple(args)) for name, op, args in composites
+        ]
+
+        self.feature_names = self.columns + [
+            name for name, _, _ in self.composites]
+        self.feature_types = [
+            'c' if col in self.categories else 'int' for col in self.columns
+        ] + ['float'] * len(self.composites)
+
+        # Compiled form: column positions and lookup tables
+        index = {name: i for i, name in enumerate(self.feature_names)}
+        self._lookups = [
+            (index[col], _lookup_table(codes))
+            for col, codes in self.categories.items()
+        ]
+        self._composites = [
+            (index[name], op, [index[arg] for arg in args])
+            for name, op, args in self.composites
+        ]
+
+    @classmethod
+    def fit(cls, columns, categorical=True):
+        """
+        Fit the preprocessor on the dataset columns.
+
+        Args:
+          columns: (list) dataset feature columns
+          categorical: (bool) encode the categorical features
+
+        Returns:
+          Preprocessor: fitted preprocessor
+        """
+
+        codes = category_codes() if categorical else {}
+        categories = {
+            col: codes[col].tolist() for col in columns
+            if col in codes and col not in CONTINUOUS_FEATURES
+        }
+        return cls(
+            columns,
+            [col.lstrip('_').lower() for col in columns],
+            categories,
+            COMPOSITES
+        )
+
+    @classmethod
+    def for_model(cls, model):
+        """
+        Fit the preprocessor of a trained model, on the model features.
+
+        Args:
+          model: (xgb.Booster) trained model
+
+        Returns:
+          Preprocessor: fitted preprocessor
+
+        Raises:
+          ValueError: the model features are not the preprocessor ones
+        """
+
+        names = list(model.feature_names)
+        preprocessor = cls.fit(
+            [name for name in names if name not in COMPOSITE_FEATURES],
+            categorical='c' in (model.feature_types or [])
+        )
+        if preprocessor.feature_names != names:
+            raise ValueError('The model features do not match the dataset')
+        return preprocessor
+
+    def apply(self, X):
+        """
+        Compute the composite features from the answer codes, then encode
+        the categorical features, in place.
+
+        Args:
+          X: (np.ndarray) feature matrix, the answer codes of the columns
+            followed by the composite features to compute
+        """
+
+        for i, op, args in self._composites:
+            if op == 'product':
+                np.multiply(X[:, args[0]], X[:, args[1]], out=X[:, i])
+            else:
+                # The mean of the answered codes, as pandas skips the
+                # missing values, NaN when none is answered
+                codes = X[:, args].astype(np.float64)
+                answered = np.count_nonzero(~np.isnan(codes), axis=1)
+                with np.errstate(invalid='ignore'):
+                    X[:, i] = np.nansum(codes, axis=1) / answered
+
+        for i, lookup in self._lookups:
+            X[:, i] = _encode(X[:, i], lookup)
+
+    def transform(self, records) -> np.ndarray:
+        """
+        Build the model feature matrix of request records, keyed by the
+        request fields. A missing field is a missing value.
+
+        Args:
+          records: (list) records, request field to answer code
+
+        Returns:
+          np.ndarray: feature matrix
+        """
+
+        X = np.empty((len(records), len(self.feature_names)), np.float32)
+        X[:, :len(self.columns)] = [
+            [record.get(field, 'nan') for field in self.inputs]
+            for record in records
+        ]
+        self.apply(X)
+        return X
+
+    def transform_codes(self, codes, fields) -> np.ndarray:
+        """
+        Build the model feature matrix of an answer code matrix, whose
+        columns are request fields. A missing field is a missing value.
+
+        Args:
+          codes: (np.ndarray) answer code matrix
+          fields: (list) request field of each column of the matrix
+
+        Returns:
+          np.ndarray: feature matrix
+        """
+
+        X = np.full(
+            (len(codes), len(self.feature_names)), np.nan, np.float32)
+        position = {field: i for i, field in enumerate(fields)}
+        for i, field in enumerate(self.inputs):
+            if field in position:
+                X[:, i] = codes[:, position[field]]
+        self.apply(X)
+        return X
+
+    def unknown_codes(self, X) -> dict:
+        """
+        Count the answer codes outside the domain of each categorical
+        column, encoded as missing values. The missing answers are not
+        counted.
+
+        Args:
+          X: (np.ndarray) feature matrix, the answer codes before they
+            are encoded
+
+        Returns:
+          dict: column name to the count of unknown codes, for the
+            columns with unknown codes
+        """
+
+        counts = {}
+        for col, codes in self.categories.items():
+            values = X[:, self.feature_names.index(col)]
+            unknown = np.count_nonzero(
+                ~np.isnan(values) & ~np.isin(values, codes))
+            if unknown:
+                counts[col] = unknown
+        return counts
+
+    def to_json(self) -> str:
+        """
+        Serialize the preprocessor.
+
+        Returns:
+          str: JSON document
+        """
+        return json.dumps({
+            'columns': self.columns,
+            'inputs': self.inputs,
+            'categories': self.categories,
+            'composites': self.composites,
+        }, indent=2)
+
+    @classmethod
+    def from_json(cls, document):
+        """
+        Load a serialized preprocessor.
+
+        Args:
+          document: (str) JSON document
+
+        Returns:
+          Preprocessor: preprocessor
+        """
+        data = json.loads(document)
+        return cls(
+            data['columns'],
+            data['inputs'],
+            data['categories'],
+            data['composites']
+        )
+
+
+@lru_cache(maxsize=1)
+def category_codes() -> dict:
+    """
+    Return the answer codes of every survey feature, from the BRFSS
+    codebook, in the database column order.
+
+    Returns:
+      dict: column name to the sorted array of answer codes
+    """
+    return {
+        col: np.array(sorted(codes)) for col, codes in ANSWER_CODES.items()
+    }
+
+
+def _lookup_table(codes):
+    """
+    Dense category lookup table, indexed by answer code. The answer codes
+    are mapped to 0..n-1, the codes outside the answer domain to NaN,
+    e.g. for the codes 1/2/7/9: [nan, 0, 1, nan, nan, nan, nan, 2, nan, 3].
+    """
+    codes = np.asarray(codes, dtype=np.intp)
+    lookup = np.full(codes.max() + 1, np.nan, dtype=np.float32)
+    lookup[codes] = np.arange(len(codes))
+    return lookup
+
+
+def _encode(values, lookup):
+    """ Map the answer codes to the dense category codes """
+
+    codes = np.nan_to_num(values, nan=-1).astype(np.intp)
+    known = (codes >= 0) & (codes < len(lookup))
+
+    encoded = np.full(len(codes), np.nan, dtype=np.float32)
+    encoded[known] = lookup[codes[known]]
+    return encoded
@@ -0,0 +1,306 @@
+"""
+This module provides the profiler of a training run.
+
+The stages of a training run are timed with the run profiler: the wall
+time, the CPU time of the process and of its child processes, and the
+peak RSS of each stage. The RSS is sampled by a background thread, so
+the peaks reached inside xgboost are recorded, not only the RSS at the
+stage boundaries.
+
+    profiler = RunProfiler()
+    with profiler.stage('tune'):
+        h_params = _hyper_parameter_tuning(cache, fingerprint, budget)
+
+The summary of the run, along with the tuning trials and the thread
+settings, is recorded in the run manifest.
+
+With stack sampling enabled, the sampler thread also samples the call
+stack of the profiled thread. The stacks of the slowest stage are
+written in the folded stacks format, one `frame;frame;frame count` line
+per stack, read by flamegraph.pl and speedscope.
+
+The module contains the following classes and functions:
+    - RunProfiler: Profiler of the stages of a training run
+    - thread_settings: Return the thread settings of the process
+"""
+
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from datetime import datetime
+
+import psutil
+from loguru import logger
+from threadpoolctl import threadpool_info
+
+
+class _Stage:
+    """ Measurements of a run stage """
+
+    __slots__ = ('name', 'wall', 'cpu', 'peak_rss', 'stacks',
+                 '_start', '_cpu_start')
+
+    def __init__(self, name):
+        self.name = name
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss = 0
+        self.stacks = Counter()
+
+
+class RunProfiler:
+    """
+    Profiler of the stages of a training run.
+
+    Attributes:
+      interval: (float) seconds between the samples
+      sample_stacks: (bool) sample the call stack of the profiled thread
+      stages: (list) the stages, in the order they were started
+      trials: (list) the tuning trials
+
+    Methods:
+      stage: Profile a stage of the run
+      trial: Record a tuning trial
+      summary: Run summary for the run manifest
+      write_stacks: Write the sampled stacks of a stage
+    """
+
+    def __init__(self, interval=0.05, sample_stacks=False):
+
+        self.interval = interval
+        self.sample_stacks = sample_stacks
+        self.stages = []
+        self.trials = []
+
+        self._process = psutil.Process()
+        self._active = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_id = None
+        self._start = time.perf_counter()
+
+    def stage(self, name):
+        """
+        Profile a stage of the run, the stages may be nested.
+
+        Args:
+          name: (str) stage name
+
+        Returns:
+          context manager: the stage
+        """
+        return _StageContext(self, name)
+
+    def trial(self, seconds, rounds, truncated=False):
+        """
+        Record a tuning trial.
+
+        Args:
+          seconds: (float) trial duration
+          rounds: (int) boosting rounds trained
+          truncated: (bool) the trial was stopped by the time budget
+        """
+        self.trials.append({
+            'seconds': seconds,
+            'rounds': rounds,
+            'truncated': truncated,
+        })
+
+    def summary(self) -> dict:
+        """
+        Run summary for the run manifest: the measurements of every
+        stage, the tuning trials and the thread settings.
+
+        Returns:
+          dict: run summary
+        """
+
+        wall = time.perf_counter() - self._start
+        trial_seconds = [trial['seconds'] for trial in self.trials]
+
+        return {
+            'wall_seconds': wall,
+            'peak_rss_mb': max(
+                (stage.peak_rss for stage in self.stages), default=0
+            ) / 2 ** 20,
+            'stages': {
+                stage.name: {
+                    'wall_seconds': stage.wall,
+                    'cpu_seconds': stage.cpu,
+                    'cpu_utilization': stage.cpu / stage.wall
+                    if stage.wall else 0.0,
+                    'peak_rss_mb': stage.peak_rss / 2 ** 20,
+                }
+                for stage in self.stages
+            },
+            'trials': {
+                'count': len(self.trials),
+                'seconds': sum(trial_seconds),
+                'max_seconds': max(trial_seconds, default=0.0),
+                'rounds': sum(trial['rounds'] for trial in self.trials),
+                'runs': self.trials,
+            },
+            'threads': thread_settings(),
+        }
+
+    def write_stacks(self, path, stage=None) -> str:
+        """
+        Write the sampled stacks of a stage, the slowest stage by default,
+        in the folded stacks format.
+
+        Args:
+          path: (str) directory of the stacks file
+          stage: (str) stage name
+
+        Returns:
+          str: stacks file path, None when no stack was sampled
+        """
+
+        stages = [s for s in self.stages if stage in (None, s.name)]
+        if not stages:
+            return None
+        slowest = max(stages, key=lambda s: s.wall)
+        if not slowest.stacks:
+            return None
+
+        os.makedirs(path, exist_ok=True)
+        file_path = os.path.join(
+            path,
+            f'stacks_{datetime.now().strftime("%Y%m%d%H%M%S")}_'
+            f'{slowest.name}.folded'
+        )
+        with open(file_path, 'w') as f:
+            for stack, count in slowest.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+        logger.info(
+            f'Sampled stacks of stage `{slowest.name}`: {file_path}')
+        return file_path
+
+    def _enter(self, stage):
+
+        if self._thread_id is None:
+            self._thread_id = threading.get_ident()
+
+        stage._start = time.perf_counter()
+        stage._cpu_start = self._cpu_time()
+        stage.peak_rss = self._rss()
+
+        # The sampler thread stops once no stage is active
+        with self._lock:
+            self.stages.append(stage)
+            self._active.append(stage)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._sample, name='run-profiler', daemon=True)
+                self._thread.start()
+
+    def _exit(self, stage):
+
+        rss = self._rss()
+        with self._lock:
+            self._active.remove(stage)
+            stage.peak_rss = max(stage.peak_rss, rss)
+
+        stage.wall = time.perf_counter() - stage._start
+        stage.cpu = self._cpu_time() - stage._cpu_start
+
+        logger.debug(
+            f'Stage `{stage.name}`: {stage.wall:.2f}s wall, '
+            f'{stage.cpu:.2f}s cpu, '
+            f'{stage.peak_rss / 2 ** 20:.1f} MB peak RSS')
+
+    def _sample(self):
+        """ Sampler thread, runs as long as a stage is active """
+
+        while True:
+            time.sleep(self.interval)
+
+            rss = self._rss()
+            stack = self._stack() if self.sample_stacks else None
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                for stage in self._active:
+                    stage.peak_rss = max(stage.peak_rss, rss)
+                    if stack:
+                        stage.stacks[stack] += 1
+
+    def _stack(self):
+        """ Folded call stack of the profiled thread, root first """
+
+        frame = sys._current_frames().get(self._thread_id)
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(
+                f'{os.path.basename(code.co_filename)}:{code.co_name}')
+            frame = frame.f_back
+        return ';'.join(reversed(frames))
+
+    def _rss(self):
+        try:
+            return self._process.memory_info().rss
+        except psutil.Error:
+            return 0
+
+    def _cpu_time(self):
+        """ CPU time of the process, and of its child processes """
+        times = self._process.cpu_times()
+        return times.user + times.system + \
+            times.children_user + times.children_system
+
+
+class _StageContext:
+
+    __slots__ = ('_profiler', '_stage')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._stage = _Stage(name)
+
+    def __enter__(self):
+        self._profiler._enter(self._stage)
+        return self._stage
+
+    def __exit__(self, *exc):
+        self._profiler._exit(self._stage)
+        return False
+
+
+def thread_settings() -> dict:
+    """
+    Return the thread settings of the process: the cores available, and
+    the thread pools of the native libraries loaded, the OpenMP pool of
+    xgboost and the BLAS pools of numpy and scipy.
+
+    Returns:
+      dict: thread settings
+    """
+
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count()
+
+    return {
+        'cpu_count': os.cpu_count(),
+        'available_cores': cores,
+        'thread_pools': [
+            {
+                'api': pool['internal_api'],
+                'library': pool['prefix'],
+                'num_threads': pool['num_threads'],
+            }
+            for pool in threadpool_info()
+        ],
+        'env': {
+            name: os.environ[name]
+            for name in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                         'MKL_NUM_THREADS')
+            if name in os.environ
+        },
+    }
@@ -0,0 +1,188 @@
+"""
+This module provides the persistent hyperparameter tuning trial log.
+
+Every tuning trial (parameters, score, duration and boosting rounds) is
+appended to a JSON lines file stored next to the model artifacts. The log
+is used to resume an interrupted tuning run, and to seed a new run with
+the trials of previous runs on the same dataset fingerprint.
+
+The module contains the following classes:
+    - TuningTrialLog: Append, and replay the tuning trials of a dataset
+"""
+
+import os
+import json
+import uuid
+from datetime import datetime
+
+from loguru import logger
+
+
+class TuningTrialLog:
+    """
+    Durable, append only log of the hyperparameter tuning trials.
+
+    Each line of the log file is a JSON record, either a 'trial' record
+    appended after every trial, or a 'complete' record appended once the
+    tuning run finished. A run without a 'complete' record was interrupted
+    and is resumed by the next run on the same dataset fingerprint.
+
+    Attributes:
+      path: (str) log file path
+      fingerprint: (str) dataset fingerprint of the tuning run
+      run_id: (str) identifier of the current tuning run
+      resumed: (list) trials of the interrupted run being resumed
+      previous: (list) trials of the completed runs on the same dataset
+
+    Methods:
+      load: Load the trials recorded for the dataset fingerprint
+      append: Append a trial record to the log
+      complete: Mark the current tuning run as complete
+      latest_best: Return the best trial of the last completed run
+    """
+
+    def __init__(self, path, fingerprint):
+
+        self.path = path
+        self.fingerprint = fingerprint
+
+        self.run_id = None
+        self.resumed = []
+        self.previous = []
+
+    def load(self):
+        """
+        Load the trials recorded for the dataset fingerprint.
+
+        When the last run on the dataset was interrupted, its run id
+        is reused so the remaining trials are appended to the same run.
+
+        Returns:
+          TuningTrialLog: self
+        """
+
+        runs = {}
+        completed = set()
+
+        for record in self._read():
+            if record.get('fingerprint') != self.fingerprint:
+                continue
+
+            run_id = record.get('run_id')
+            if record.get('type') == 'complete':
+                completed.add(run_id)
+            elif record.get('type') == 'trial':
+                runs.setdefault(run_id, []).append(record)
+
+        # Runs are listed in the order they were appended to the log
+        for run_id, trials in runs.items():
+            if run_id in completed:
+                self.previous.extend(trials)
+            else:
+                # Only the last interrupted run can be resumed
+                self.previous.extend(self.resumed)
+                self.run_id, self.resumed = run_id, trials
+
+        if self.run_id is None:
+            self.run_id = datetime.now().strftime('%Y%m%d%H%M%S_') + \
+                uuid.uuid4().hex[:8]
+        else:
+            logger.info(
+                f'Resuming tuning run {self.run_id}, '
+                f'{len(self.resumed)} trials completed'
+            )
+
+        logger.debug(
+            f'Loaded {len(self.previous)} previous trials '
+            f'for dataset {self.fingerprint}'
+        )
+
+        return self
+
+    def append(self, params, score, duration, rounds, truncated=False):
+        """
+        Append a trial record to the log.
+
+        The record is flushed and synced to disk before returning,
+        so a crash never loses a completed trial.
+
+        Args:
+          params: (dict) trial hyperparameters
+          score: (float) trial score
+          duration: (float) trial duration in seconds
+          rounds: (int) boosting rounds trained
+          truncated: (bool) the trial was stopped by the time budget
+        """
+
+        self._write({
+            'type': 'trial',
+            'run_id': self.run_id,
+            'fingerprint': self.fingerprint,
+            'timestamp': datetime.now().isoformat(),
+            'params': params,
+            'score': score,
+            'duration': duration,
+            'rounds': rounds,
+            'truncated': truncated,
+        })
+
+    def complete(self, best):
+        """
+        Mark the current tuning run as complete.
+
+        Args:
+          best: (dict) best trial of the run
+        """
+
+        self._write({
+            'type': 'complete',
+            'run_id': self.run_id,
+            'fingerprint': self.fingerprint,
+            'timestamp': datetime.now().isoformat(),
+            'best': best,
+        })
+
+    def latest_best(self):
+        """
+        Return the best trial parameters of the last completed run on
+        the dataset fingerprint, or on any dataset without a fingerprint.
+
+        Returns:
+          dict: best trial parameters, None when no run completed
+        """
+
+        best = None
+        for record in self._read():
+            if self.fingerprint not in (None, record.get('fingerprint')):
+                continue
+            if record.get('type') == 'complete' and record.get('best'):
+                best = record['best']
+
+        return best
+
+    def _read(self):
+
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # Partially written record of a crashed run
+                    logger.warning('Skipping corrupt tuning log record')
+
+    def _write(self, record):
+
+        line = (json.dumps(record) + '\n').encode('utf-8')
+
+        with open(self.path, 'ab+') as f:
+            # Terminate a record left partially written by a crash
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    line = b'\n' + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
@@ -15,30 +15,55 @@ the best model and evaluated using the test set.
 
 import os
 
+import json
+import socket
 import time
-from datetime import datetime
+import uuid
+from collections import Counter
+from functools import partial
 import humanfriendly
-import pickle as pkl
 from loguru import logger
 
-import numpy as np
-
 import xgboost as xgb
-from sklearn.model_selection import train_test_split
 from bayes_opt import BayesianOptimization
 from sklearn.metrics import log_loss
-from sklearn.utils.class_weight import compute_class_weight
 from sklearn.metrics import accuracy_score, precision_score
 from sklearn.metrics import recall_score, f1_score
 
 
 from app.ml.config import model_settings as settings
+from app.ml.config.training import training_settings
 from app.ml.model.pipeline.preparation import get_mental_health_data
+from app.ml.model.pipeline.preparation import get_new_mental_health_data
 from app.ml.model.pipeline.preparation import MentalHealthData
+from app.ml.model.pipeline.preparation import NUM_CLASSES
+from app.ml.model.pipeline.preparation import class_weights
+from app.ml.model.pipeline.preparation import balanced_weights
+from app.ml.model.pipeline.preparation import collapse_duplicates
+from app.ml.model.pipeline.preprocessing import Preprocessor
+from app.ml.model.pipeline.tuning_log import TuningTrialLog
+from app.ml.model.pipeline.budget import TimeBudget
+from app.ml.model.pipeline.profiling import RunProfiler
+from app.ml.model.registry import ModelRegistry
+from app.ml.model.serialization import load_model
+from app.ml.model.serialization import save_model
+from app.ml.model.pipeline.checkpoint import TrainingCheckpoint
+from app.ml.model.pipeline.checkpoint import remove_checkpoints
+from app.ml.model.pipeline.collection import load_shard_from_db
+from app.ml.model.pipeline.collection import max_id_in_db
+from app.ml.model.pipeline.distillation import distill_model
+from app.ml.model.pipeline.distributed import run_workers
+from app.ml.model.pipeline.distributed import start_tracker
+from app.ml.model.pipeline.external_memory import ChunkIterator
+from app.ml.model.pipeline.external_memory import DbChunkSource
+from app.ml.model.pipeline.external_memory import evaluate
+from app.ml.model.pipeline.external_memory import get_chunk_source
+from app.ml.model.pipeline.external_memory import remove_cache
 
 """
   Xgboost model class helper functions and variables
-  xgboost requires the class labels to start from 0
+  xgboost requires the class labels to start from 0, the target labels
+  are converted by the preparation pipeline.
 """
 
 # Mapping class description of the actual target label.
@@ -50,15 +75,166 @@ from app.ml.model.pipeline.preparation import MentalHealthData
 #                              1: '1-13 Days', 2: '14+ Days', 3: 'Unsure'}
 
 
-def _target_label_mapping(y=None):
-    """ Convert target dataset labels to xgboost """
-    # _MENT14D_ to xgboost label mapping
-    label_mapping = {1: 0, 2: 1, 3: 2, 9: 3}
-    # Convert to xgboost labels
-    return np.vectorize(label_mapping.get)(y)
+# Tree methods that can consume the pre-binned QuantileDMatrix
+_QUANTILE_TREE_METHODS = ('hist',)
+
+
+class DatasetCache:
+    """
+    Dataset cache for the xgboost training matrices.
+
+    Every dataset split is converted into an xgboost matrix only once,
+    on first use, and the same matrix is shared by all the tuning trials
+    and the final fit. With the histogram tree method the training split
+    is quantized (pre-binned) into a QuantileDMatrix, the evaluation splits
+    reuse its bin boundaries, so the quantile sketch is computed once
+    for the whole pipeline run instead of once per matrix.
+
+    Attributes:
+      tree_method: (str) xgboost tree method
+      max_bin: (int) maximum number of bins per feature
+      feature_names: (list) feature names of the split matrices
+      feature_types: (list) xgboost feature types of the split matrices
+
+    Methods:
+      add_split: Register a dataset split
+      get: Return the xgboost matrix of a dataset split
+      arrays: Return the arrays of a dataset split
+      params: Return the xgboost parameters bound to the cached matrices
+    """
+
+    def __init__(self, tree_method=None, max_bin=None,
+                 feature_names=None, feature_types=None):
+
+        self.tree_method = tree_method or training_settings.xgb_tree_method
+        self.max_bin = max_bin or training_settings.xgb_max_bin
+        self.feature_names = feature_names
+        self.feature_types = feature_types
+
+        self._splits = {}
+        self._matrices = {}
+        self._reference = None
+
+    def add_split(self, name, X, y, weight=None, reference=False):
+        """
+        Register a dataset split. The matrix is built on first access.
+
+        Args:
+          name: (str) split name, e.g. 'train'
+          X: (array) split features
+          y: (array) split target
+          weight: (array) sample weights
+          reference: (bool) the split provides the histogram bins
+            shared by all other splits
+        """
+        self._splits[name] = (X, y, weight)
+        if reference:
+            self._reference = name
+
+    def get(self, name) -> xgb.DMatrix:
+        """
+        Return the xgboost matrix of a dataset split.
+
+        Args:
+          name: (str) split name
+
+        Returns:
+          xgb.DMatrix: the cached split matrix
+        """
+
+        if name not in self._matrices:
+            self._matrices[name] = self._build(name)
+
+        return self._matrices[name]
+
+    def arrays(self, name) -> tuple:
+        """
+        Return the arrays of a dataset split, for the consumers which
+        need the raw feature values rather than the xgboost matrix.
+
+        Args:
+          name: (str) split name
+
+        Returns:
+          tuple: split features, target and sample weights
+        """
+        return self._splits[name]
+
+    def params(self) -> dict:
+        """
+        Return the training parameters the cached matrices were built for.
+
+        Returns:
+          dict: xgboost parameters
+        """
+        return {
+            'tree_method': self.tree_method,
+            'max_bin': self.max_bin,
+        }
+
+    def _build(self, name):
+
+        start = time.perf_counter()
+        X, y, weight = self._splits[name]
+
+        if self.tree_method in _QUANTILE_TREE_METHODS:
+            # The reference split must be binned first, the other
+            # splits are quantized using its cut points
+            ref = None
+            if self._reference is not None and name != self._reference:
+                ref = self.get(self._reference)
+
+            matrix = xgb.QuantileDMatrix(
+                X,
+                label=y,
+                weight=weight,
+                ref=ref,
+                max_bin=self.max_bin,
+                feature_names=self.feature_names,
+                feature_types=self.feature_types,
+                enable_categorical=True
+            )
+        else:
+            matrix = xgb.DMatrix(
+                X,
+                label=y,
+                weight=weight,
+                feature_names=self.feature_names,
+                feature_types=self.feature_types,
+                enable_categorical=True
+            )
+
+        elapsed = _get_elapsed(start, time.perf_counter())
+        logger.debug(f'Built `{name}` matrix - elapsed: {elapsed}')
+
+        return matrix
+
+
+def _base_params(cache: DatasetCache) -> dict:
+    """ Learning task parameters shared by tuning and training """
+    params = {
+        'eval_metric': 'mlogloss',
+        'objective': 'multi:softprob',
+        'num_class': NUM_CLASSES,
+    }
+    params.update(cache.params())
+    return params
+
 
+class _DeadlineCallback(xgb.callback.TrainingCallback):
+    """ Stop boosting once the time budget is exhausted """
 
-def build_model():
+    def __init__(self, budget: TimeBudget):
+        super().__init__()
+        self.budget = budget
+        self.stopped = False
+
+    def after_iteration(self, model, epoch, evals_log):
+        self.stopped = self.budget.expired()
+        return self.stopped
+
+
+def build_model(time_budget=None, external_memory=False, resume=False):
     """
     Train model given a dataset, then save the model
 
@@ -67,84 +243,559 @@ def build_model():
     trains the model using the training set, evaluates the model
     using the test set, and saves the model.
 
+    With a time budget, the hyperparameter tuning is given its configured
+    share of the budget and the final training the rest. Each stage stops
+    once its share is exhausted, and the best model found so far is
+    saved. The budget consumed by each stage is recorded in the manifest.
+
+    In external memory mode the dataset is streamed instead of loaded,
+    see _build_external_memory_model.
+
+    The final training is checkpointed periodically. A resumed run on the
+    same dataset skips the tuning and continues the final training from
+    the last checkpoint, with the hyperparameters it was trained with.
+    The checkpoints are removed once the model is saved.
+
+    The stages of the run are profiled, their wall time, CPU time and
+    peak RSS are recorded in the manifest, along with the tuning trials
+    and the thread settings, see _run_profile.
+
+    Args:
+      time_budget: (float) total wall-clock budget in seconds,
+        None for an unbounded run
+      external_memory: (bool) train from the streamed dataset chunks
+      resume: (bool) resume from the last training checkpoint
+
     Returns:
       float: model score
     """
 
     logger.info('Building model...')
 
-    # Load the preprocessed dataset
-    mh: MentalHealthData = get_mental_health_data()
-    df = mh.get_data()
-    # Identify X and y
-    X, y = df.drop(columns=[mh.target]), df[mh.target]
-
-    # Split the dataset into train and validation/tests sets
-    # Set aside 60% for training, 20% for validation, and 20% for testing
-    X_train, x_temp, y_train, y_temp = train_test_split(
-        X,
-        y,
-        stratify=y,
-        test_size=0.4
+    budget = TimeBudget(time_budget)
+    profiler = _run_profiler()
+
+    if external_memory:
+        return _build_external_memory_model(budget, profiler)
+
+    # Load the preprocessed dataset, split into train and validation/tests
+    # sets. Set aside 20% for validation, and the holdout rows, 20% with
+    # the default modulo, for testing, never trained on. The splits are
+    # views of the dataset matrix.
+    with profiler.stage('data'):
+        mh: MentalHealthData = get_mental_health_data(
+            test_size=0.4,
+            val_size=0.5,
+            seed=training_settings.split_seed,
+            holdout_modulo=training_settings.holdout_modulo
+        )
+        X_train, y_train = mh.split('train')
+        x_val, y_val = mh.split('val')
+        x_test, y_test = mh.split('test')
+
+    logger.debug(f'Model features: {mh.feature_names}')
+
+    with profiler.stage('matrices'):
+        # Compute class weights and train the model with it.
+        weights = class_weights(y_train)
+        train_rows = len(y_train)
+
+        if training_settings.collapse_duplicates:
+            # Fold the duplicate counts into the sample weights
+            X_train, y_train, counts = collapse_duplicates(X_train, y_train)
+            sample_weight = weights[y_train] * counts
+        else:
+            sample_weight = weights[y_train]
+
+        # Build the xgboost matrices once, shared by tuning and training
+        cache = DatasetCache(
+            feature_names=mh.feature_names,
+            feature_types=mh.feature_types
+        )
+        cache.add_split(
+            'train', X_train, y_train, sample_weight, reference=True)
+        cache.add_split('val', x_val, y_val)
+        cache.add_split('test', x_test, y_test)
+        for name in ('train', 'val', 'test'):
+            cache.get(name)
+
+    fingerprint = mh.fingerprint()
+    checkpoint = TrainingCheckpoint(
+        settings.model_path,
+        fingerprint,
+        training_settings.checkpoint_rounds,
+        training_settings.checkpoint_interval
     )
+    resumed = checkpoint.load() if resume else None
+
+    # Hyper parameter tuning - use validation data
+    tuning_budget = budget.split(training_settings.tuning_budget_fraction)
+    if resumed is None:
+        with profiler.stage('tune'):
+            h_params = _hyper_parameter_tuning(
+                cache, fingerprint, tuning_budget, profiler)
+    else:
+        # The checkpoint was trained with the tuned hyperparameters
+        h_params = resumed[1]
+    tuning_budget.stop()
+    if h_params is None:
+        logger.error('Error tuning hyperparameters. Model not trained.')
+        return None
+
+    logger.info('Training model...')
+    # Train the model using the best hyperparameters, the final
+    # training is given whatever is left of the total budget
+
+    checkpoint.params = h_params
+    training_budget = budget.split()
+    with profiler.stage('fit'):
+        xgb_model, metrics = _create_and_train_model(
+            cache, h_params, training_budget, checkpoint,
+            resumed and resumed[0])
+    training_budget.stop()
+
+    if xgb_model is None:
+        logger.error('Error training model. Model not trained.')
+        return None
+
+    # Distill the compact serving model, published next to the model
+    distilled = None
+    if training_settings.distill:
+        with profiler.stage('distill'):
+            distilled = distill_model(xgb_model, cache, {
+                **_base_params(cache),
+                **{name: value for name, value in h_params.items()
+                   if name != 'num_boost_round'},
+            })
+
+    # Save the model, and its manifest
+    _save_model(xgb_model, {
+        'dataset': {
+            'rows': len(mh.labels),
+            'train_rows': train_rows,
+            'train_matrix_rows': len(y_train),
+            'holdout_modulo': training_settings.holdout_modulo,
+            **_dataset_shape(mh),
+        },
+        'fingerprint': fingerprint,
+        'watermark': mh.watermark,
+        'params': h_params,
+        'metrics': metrics,
+        'rounds': xgb_model.num_boosted_rounds(),
+        'resumed_round': resumed and resumed[0].num_boosted_rounds(),
+        'distillation': distilled and distilled[1],
+        'budget': {
+            **budget.stop().summary(),
+            'tuning': tuning_budget.summary(),
+            'training': training_budget.summary(),
+        },
+        'profile': _run_profile(profiler),
+    }, serving_model=distilled and distilled[0])
+    remove_checkpoints(settings.model_path)
+
+
+def _build_external_memory_model(budget: TimeBudget, profiler: RunProfiler):
+    """
+    Train the model on a dataset which does not fit in memory, then
+    save the model.
+
+    The training rows are streamed in chunks through the ChunkIterator,
+    xgboost caches the quantized pages on disk, in the external memory
+    cache path. The model is then evaluated on the streamed holdout rows.
+
+    Tuning trains dozens of models, which is not practical on such a
+    dataset: the best hyperparameters of the last completed tuning run
+    are used, or the middle of the search bounds when there is none.
+
+    Args:
+      budget: (TimeBudget) training time budget
+      profiler: (RunProfiler) run profiler
+
+    Returns:
+      object: trained model
+    """
+
+    start = time.perf_counter()
+    logger.info('Start: External memory training...')
+
+    # 1. Class weights of the training rows, counted by the source. The
+    # watermark is read first, rows added while streaming may be trained
+    # on again by the next refresh.
+    with profiler.stage('data'):
+        watermark = max_id_in_db()
+        source = get_chunk_source()
+        weights = balanced_weights(source.label_counts())
+
+    # 2. Hyperparameters of the last tuning run
+    h_params = _tuned_params()
+    params = _hist_params(h_params)
+
+    # 3. Train from the on-disk cache, removed once the model is trained
+    cache_path = training_settings.external_memory_cache_path
+    os.makedirs(cache_path, exist_ok=True)
+    cache_prefix = os.path.join(cache_path, f'mh-{uuid.uuid4().hex[:8]}')
+
+    try:
+        with profiler.stage('matrices'):
+            iterator = ChunkIterator(source, weights, cache_prefix)
+            dtrain = xgb.DMatrix(iterator)
+            train_rows = dtrain.num_row()
+
+        with profiler.stage('fit'):
+            deadline = _DeadlineCallback(budget)
+            model_xgb = xgb.train(
+                params,
+                dtrain,
+                num_boost_round=h_params['num_boost_round'],
+                callbacks=[deadline]
+            )
+        del dtrain
+    except Exception as e:
+        logger.error(f'Error training model: {e}')
+        return None
+    finally:
+        remove_cache(cache_prefix)
+
+    if deadline.stopped:
+        logger.warning(
+            'Training budget exhausted after '
+            f'{model_xgb.num_boosted_rounds()} of '
+            f'{h_params["num_boost_round"]} boosting rounds'
+        )
+
+    # 4. Evaluate on the streamed holdout rows
+    with profiler.stage('evaluate'):
+        metrics = evaluate(model_xgb, source)
+    logger.info(f'Holdout metrics: {metrics}')
+
+    elapsed = _get_elapsed(start, time.perf_counter())
+    logger.info(f'End: External memory training - elapsed(mins): {elapsed}')
+
+    _save_model(model_xgb, {
+        'dataset': {
+            'source': training_settings.external_memory_source,
+            'train_rows': train_rows,
+            'holdout_rows': metrics['rows'],
+            'holdout_modulo': training_settings.holdout_modulo,
+        },
+        'watermark': watermark,
+        'params': h_params,
+        'rounds': model_xgb.num_boosted_rounds(),
+        'metrics': metrics,
+        'budget': budget.stop().summary(),
+        'profile': _run_profile(profiler),
+    })
+
+    return model_xgb
+
+
+def build_distributed_model(n_workers, world_size=None, host_ip=None,
+                            port=0, time_budget=None):
+    """
+    Train the model on the training rows sharded across worker
+    processes, then save the model.
+
+    The coordinator starts the tracker and runs the local workers. With
+    a world size larger than the number of local workers, the training
+    waits for the remaining workers to join from other hosts, see
+    join_distributed_training. The model is evaluated on the holdout
+    rows, which are not part of any shard.
 
-    logger.debug(f'Model features: {X_train.columns}')
+    Like the external memory training, the best hyperparameters of the
+    last completed tuning run are used.
 
-    # split once more for the validation and test sets
-    x_val, x_test, y_val, y_test = train_test_split(
-        x_temp,
-        y_temp,
-        stratify=y_temp,
-        test_size=0.5
+    Args:
+      n_workers: (int) number of local workers
+      world_size: (int) total number of workers, defaults to the
+        number of local workers
+      host_ip: (str) address the tracker listens on
+      port: (int) port the tracker listens on, 0 for any free port
+      time_budget: (float) wall-clock budget in seconds
+
+    Returns:
+      object: trained model
+    """
+
+    start = time.perf_counter()
+    world_size = world_size or n_workers
+    logger.info(
+        f'Start: Distributed training, {n_workers} local workers, '
+        f'{world_size} workers total...'
     )
 
-    _y_train = _target_label_mapping(y=y_train)
-    _y_test = _target_label_mapping(y=y_test)
-    _y_val = _target_label_mapping(y=y_val)
+    budget = TimeBudget(time_budget)
+    profiler = _run_profiler()
+    holdout_modulo = training_settings.holdout_modulo
+    watermark = max_id_in_db()
+
+    h_params = _tuned_params()
+    params = _hist_params(h_params)
+
+    # The deadline is shared with the workers as a wall-clock time
+    deadline = None
+    if time_budget is not None:
+        deadline = time.time() + budget.remaining()
 
-    # Compute class weights and train the model with it.
-    class_weights = compute_class_weight(
-        'balanced',
-        classes=np.unique(_y_train),
-        y=_y_train
+    try:
+        with profiler.stage('fit'):
+            tracker, worker_args = start_tracker(world_size, host_ip, port)
+            boosters = run_workers(
+                n_workers,
+                worker_args,
+                partial(load_shard_from_db, holdout_modulo=holdout_modulo),
+                '0-coordinator',
+                params,
+                h_params['num_boost_round'],
+                deadline
+            )
+            tracker.wait_for()
+    except Exception as e:
+        logger.error(f'Error training model: {e}')
+        return None
+
+    # Every worker trained the same model
+    model_xgb = boosters[0]
+
+    with profiler.stage('evaluate'):
+        metrics = evaluate(model_xgb, DbChunkSource(
+            training_settings.external_memory_chunk_rows, holdout_modulo))
+    logger.info(f'Holdout metrics: {metrics}')
+
+    elapsed = _get_elapsed(start, time.perf_counter())
+    logger.info(f'End: Distributed training - elapsed(mins): {elapsed}')
+
+    _save_model(model_xgb, {
+        'dataset': {
+            'source': 'db',
+            'holdout_rows': metrics['rows'],
+            'holdout_modulo': training_settings.holdout_modulo,
+        },
+        'watermark': watermark,
+        'distributed': {
+            'local_workers': n_workers,
+            'world_size': world_size,
+        },
+        'params': h_params,
+        'rounds': model_xgb.num_boosted_rounds(),
+        'metrics': metrics,
+        'budget': budget.stop().summary(),
+        'profile': _run_profile(profiler),
+    })
+
+    return model_xgb
+
+
+def join_distributed_training(tracker_uri, tracker_port, n_workers):
+    """
+    Run local workers joining a distributed training run coordinated
+    from another host. The model is saved by the coordinator.
+
+    Args:
+      tracker_uri: (str) tracker host address
+      tracker_port: (int) tracker port
+      n_workers: (int) number of local workers
+    """
+
+    logger.info(
+        f'Joining distributed training at {tracker_uri}:{tracker_port} '
+        f'with {n_workers} workers...'
     )
-    class_weights_dict = dict(enumerate(class_weights))
-    sample_weight = np.array([class_weights_dict[class_label]
-                             for class_label in _y_train])
 
-    # Hyper parameter tuning - use validation data
-    h_params = _hyper_parameter_tuning(
-        X_train,
-        _y_train,
-        x_val,
-        _y_val,
-        sample_weight
+    run_workers(
+        n_workers,
+        {'dmlc_tracker_uri': tracker_uri, 'dmlc_tracker_port': tracker_port},
+        partial(
+            load_shard_from_db,
+            holdout_modulo=training_settings.holdout_modulo
+        ),
+        f'1-{socket.gethostname()}'
     )
-    if h_params is None:
-        logger.error('Error tuning hyperparameters. Model not trained.')
+
+
+def refresh_model(time_budget=None):
+    """
+    Refresh the deployed model with the rows added since it was trained,
+    then publish the refreshed model.
+
+    Boosting continues from the deployed model, for a bounded number of
+    extra rounds, on the rows whose id is greater than the watermark
+    recorded in the model manifest. The new rows are split on their id,
+    the holdout rows are used to validate both models. The refreshed
+    model is published only when the holdout log-loss does not regress,
+    otherwise the watermark is left as is and the rows are used again
+    by the next refresh.
+
+    Args:
+      time_budget: (float) wall-clock budget in seconds
+
+    Returns:
+      object: refreshed model, None when not published
+    """
+
+    start = time.perf_counter()
+    logger.info('Start: Refreshing model...')
+
+    budget = TimeBudget(time_budget)
+    profiler = _run_profiler()
+
+    # 1. Load the deployed model and its manifest
+    try:
+        with profiler.stage('load_model'):
+            base_model, base_manifest, base_version = _load_deployed_model()
+    except (OSError, KeyError, json.JSONDecodeError) as e:
+        logger.error(f'Error loading the deployed model: {e}')
         return None
 
-    logger.info('Training model...')
-    # Train the model using the best hyperparameters
-
-    xgb_model = _create_and_train_model(
-        X_train,
-        _y_train,
-        x_test,
-        _y_test,
-        h_params,
-        sample_weight
+    watermark = base_manifest.get('watermark')
+    if watermark is None:
+        logger.error('The deployed model has no watermark, build a model.')
+        return None
+
+    # 2. Load the new rows
+    with profiler.stage('data'):
+        mh = get_new_mental_health_data(
+            watermark,
+            training_settings.holdout_modulo,
+            categorical='c' in (base_model.feature_types or [])
+        )
+    if mh is None:
+        logger.info(f'No rows added since row {watermark}, nothing to do.')
+        return None
+
+    X_train, y_train = mh.split('train')
+    x_val, y_val = mh.split('val')
+    if not len(y_train) or not len(y_val):
+        logger.info(
+            f'Not enough new rows to refresh: {len(y_train)} training, '
+            f'{len(y_val)} holdout rows.')
+        return None
+
+    logger.info(
+        f'Refreshing on {len(y_train)} new rows, '
+        f'{len(y_val)} holdout rows')
+
+    cache = DatasetCache(
+        feature_names=mh.feature_names,
+        feature_types=mh.feature_types
     )
+    cache.add_split(
+        'train', X_train, y_train, class_weights(y_train)[y_train],
+        reference=True)
+    cache.add_split('val', x_val, y_val)
+
+    # 3. Continue boosting from the deployed model
+    h_params = _cast_params(base_manifest['params'])
+    params = _base_params(cache)
+    params.update({
+        name: value for name, value in h_params.items()
+        if name != 'num_boost_round'
+    })
 
-    if xgb_model is None:
-        logger.error('Error training model. Model not trained.')
+    try:
+        with profiler.stage('fit'):
+            deadline = _DeadlineCallback(budget)
+            model_xgb = xgb.train(
+                params,
+                cache.get('train'),
+                num_boost_round=training_settings.refresh_rounds,
+                xgb_model=base_model,
+                callbacks=[deadline]
+            )
+    except Exception as e:
+        logger.error(f'Error refreshing model: {e}')
         return None
 
-    # Save the model
-    _save_model(xgb_model)
+    # 4. Validate both models on the holdout rows
+    with profiler.stage('evaluate'):
+        labels = list(range(NUM_CLASSES))
+        loss_before = log_loss(
+            y_val, base_model.predict(cache.get('val')), labels=labels)
+        loss_after = log_loss(
+            y_val, model_xgb.predict(cache.get('val')), labels=labels)
+
+    logger.info(
+        f'Holdout Log-Loss: {loss_before:.4f} -> {loss_after:.4f}')
+
+    elapsed = _get_elapsed(start, time.perf_counter())
+    logger.info(f'End: Refreshing model - elapsed(mins): {elapsed}')
+
+    if loss_after > loss_before:
+        logger.warning('Holdout log-loss regressed, model not published.')
+        return None
+
+    _save_model(model_xgb, {
+        'dataset': {
+            'train_rows': len(y_train),
+            'holdout_rows': len(y_val),
+            # The holdout rows are left out as long as the base model
+            # left them out
+            'holdout_modulo': (
+                training_settings.holdout_modulo
+                if base_manifest.get('dataset', {}).get('holdout_modulo') ==
+                training_settings.holdout_modulo else None),
+            **_dataset_shape(mh),
+        },
+        'watermark': mh.watermark,
+        'refresh': {
+            'base_model': base_version,
+            'base_watermark': watermark,
+            'rounds': model_xgb.num_boosted_rounds() -
+            base_model.num_boosted_rounds(),
+            'log_loss_before': loss_before,
+            'log_loss_after': loss_after,
+        },
+        'params': h_params,
+        'rounds': model_xgb.num_boosted_rounds(),
+        'metrics': {'log_loss': loss_after},
+        'budget': budget.stop().summary(),
+        'profile': _run_profile(profiler),
+    })
+
+    return model_xgb
+
+
+def _tuned_params():
+    """
+    Return the best hyperparameters of the last completed tuning run,
+    or the middle of the search bounds when there is none.
+    """
+
+    h_params = TuningTrialLog(
+        f'{settings.model_path}/{training_settings.tuning_log_name}', None
+    ).latest_best()
+    if h_params is None:
+        logger.warning('No completed tuning run, using default parameters')
+        h_params = {
+            name: (low + high) / 2
+            for name, (low, high)
+            in training_settings.tuning_param_bounds.items()
+        }
+    return _cast_params(h_params)
 
 
-def _hyper_parameter_tuning(X_train, y_train, x_test, y_test, sample_weight):
+def _hist_params(h_params):
+    """
+    Training parameters of the histogram tree method, required by the
+    external memory and distributed training.
+    """
+
+    params = {
+        'eval_metric': 'mlogloss',
+        'objective': 'multi:softprob',
+        'num_class': NUM_CLASSES,
+        'tree_method': 'hist',
+        'max_bin': training_settings.xgb_max_bin,
+    }
+    params.update({
+        name: value for name, value in h_params.items()
+        if name != 'num_boost_round'
+    })
+    return params
+
+
+def _hyper_parameter_tuning(
+        cache: DatasetCache, fingerprint: str, budget: TimeBudget,
+        profiler: RunProfiler = None):
     """
     This function tunes the hyperparameters for the model using
     the training and validation data.
@@ -155,12 +806,22 @@ def _hyper_parameter_tuning(X_train, y_train, x_test, y_test, sample_weight):
     test parameters and  measures the log-loss. The model with the
     lowest log-loss is selected as the best model.
 
+    Every trial is appended to the tuning trial log. The trials of an
+    interrupted run on the same dataset are replayed and the run resumes
+    where it stopped. The trials of previous runs on the same dataset seed
+    the optimizer, which then needs fewer iterations to converge.
+
+    The search stops once the tuning budget is exhausted, and the best
+    trial found so far is returned. A trial still running at the deadline
+    is cut short, it is logged as truncated, and is neither registered
+    with the optimizer nor replayed, so a truncated trial is never the
+    best trial of a run, whether the run is resumed or not.
+
     Args:
-      X_train: (array) training set features
-      y_train: (array) training set target
-      x_test: (array) validation set features
-      y_test: (array) validation set target
-      sample_weight: (array) class weights
+      cache: (DatasetCache) training and validation matrices
+      fingerprint: (str) dataset fingerprint
+      budget: (TimeBudget) tuning time budget
+      profiler: (RunProfiler) run profiler the trials are recorded in
 
     Returns:
       dict: best hyperparameters
@@ -170,91 +831,123 @@ def _hyper_parameter_tuning(X_train, y_train, x_test, y_test, sample_weight):
     logger.info('Start: Hyperparameter tuning....')
 
     try:
-        # Create the tuning model using DMatrix for XGBoost
-        _x_train = xgb.DMatrix(
-            X_train,
-            label=y_train,
-            enable_categorical=True,
-            weight=sample_weight
-        )
+        # The tuning matrices are built once and reused by every trial
+        _x_train = cache.get('train')
+        _x_test = cache.get('val')
+        y_test = _x_test.get_label().astype(int)
 
-        _x_test = xgb.DMatrix(
-            x_test,
-            label=y_test,
-            enable_categorical=True
-        )
+        param_bounds = training_settings.tuning_param_bounds
+        trial_log = TuningTrialLog(
+            f'{settings.model_path}/{training_settings.tuning_log_name}',
+            fingerprint
+        ).load()
 
         # Define Bayesian optimization callback function
         # and train at each iteration
         def xgb_eval(max_depth, learning_rate, num_boost_round, subsample,
                      colsample_bytree, gamma, reg_alpha, reg_lambda):
-            params = {
-                'eval_metric': 'mlogloss',
-                'objective': 'multi:softprob',
-                'num_class': 4,
-                'max_depth': int(max_depth),
+            trial_params = {
+                'max_depth': max_depth,
                 'learning_rate': learning_rate,
+                'num_boost_round': num_boost_round,
                 'subsample': subsample,
                 'colsample_bytree': colsample_bytree,
                 'gamma': gamma,
                 'reg_alpha': reg_alpha,
                 'reg_lambda': reg_lambda
             }
+            trial_start = time.perf_counter()
+
+            params = _base_params(cache)
+            params.update({
+                'max_depth': int(max_depth),
+                'learning_rate': learning_rate,
+                'subsample': subsample,
+                'colsample_bytree': colsample_bytree,
+                'gamma': gamma,
+                'reg_alpha': reg_alpha,
+                'reg_lambda': reg_lambda
+            })
 
             # Train model with current hyperparameters
+            deadline = _DeadlineCallback(budget)
             model = xgb.train(
                 params,
                 _x_train,
                 num_boost_round=int(num_boost_round),
                 # evals=[(_x_test, 'eval')],
-                verbose_eval=False
+                verbose_eval=False,
+                callbacks=[deadline]
             )
 
             # Predict probabilities
             y_pred_probs = model.predict(_x_test)
             # Compute log-loss
-            return -log_loss(y_test, y_pred_probs)
-
-        # Bounds for hyperparameters
-        # TODO - configurable hyperparameters
-        param_bounds = {
-            # n_estimators is num_boost_round for XGBoostClassifier
-            'num_boost_round': [100, 300],
-            'max_depth': [3, 10],
-            'learning_rate': [0.01, 0.1],
-            'subsample': [0.6, 1.0],
-            'colsample_bytree': [0.6, 1.0],
-            'gamma': [0, 5],
-            'reg_alpha': [0, 1],
-            'reg_lambda': [1, 5],
-        }
+            score = -log_loss(y_test, y_pred_probs)
+
+            # Persist the trial before handing the score to the optimizer
+            trial_seconds = time.perf_counter() - trial_start
+            trial_log.append(
+                trial_params,
+                score,
+                trial_seconds,
+                model.num_boosted_rounds(),
+                truncated=deadline.stopped
+            )
+            if profiler is not None:
+                profiler.trial(
+                    trial_seconds, model.num_boosted_rounds(),
+                    deadline.stopped)
+            return score, deadline.stopped
 
-        # Bayesian optimization
+        # Bayesian optimization, the trials are run by the loop below
         optimizer = BayesianOptimization(
-            f=xgb_eval,
+            f=None,
             pbounds=param_bounds,
-            verbose=False
+            verbose=False,
+            allow_duplicate_points=True
         )
-        # Run the optimization tasks then extract optimized results
-        optimizer.maximize(init_points=5, n_iter=25)
+
+        # Replay the recorded trials, then run the remaining trials
+        init_points, n_iter = _register_trials(
+            optimizer, trial_log, param_bounds)
+
+        logger.info(
+            f'Tuning trials: {init_points} random, {n_iter} optimized')
+
+        # Run the optimization tasks one trial at a time, so the
+        # search can stop at the deadline, then extract optimized results.
+        # Only the complete trials are registered, as when replayed
+        for trial in range(init_points + n_iter):
+            if budget.expired():
+                logger.warning(
+                    f'Tuning budget exhausted after {trial} trials')
+                break
+            if trial < init_points:
+                trial_params = optimizer.space.array_to_params(
+                    optimizer.space.random_sample())
+            else:
+                trial_params = optimizer.suggest()
+
+            score, truncated = xgb_eval(**trial_params)
+            if not truncated:
+                optimizer.register(params=trial_params, target=score)
+        else:
+            # Only a run which completed its schedule is not resumed
+            trial_log.complete(optimizer.max and optimizer.max['params'])
+
+        if optimizer.max is None:
+            logger.error('No tuning trial completed within the budget.')
+            return None
 
         elapsed = _get_elapsed(start, time.perf_counter())
         logger.info(f'End: Hyperparameter tuning - elapsed(mins): {elapsed}')
 
         # Tuning is done, get the best parameters
 
-        best_params = optimizer.max['params']
-        best_params['max_depth'] = int(best_params['max_depth'])
-        best_params['num_boost_round'] = int(best_params['num_boost_round'])
-        best_params['learning_rate'] = float(best_params['learning_rate'])
-        best_params['subsample'] = float(best_params['subsample'])
-        best_params['colsample_bytree'] = float(
-            best_params['colsample_bytree'])
-        best_params['gamma'] = int(best_params['gamma'])
-        best_params['reg_alpha'] = float(best_params['reg_alpha'])
-        best_params['reg_lambda'] = int(best_params['reg_lambda'])
+        best_params = _cast_params(optimizer.max['params'])
 
-        logger.info("Best Parameters:", best_params)
+        logger.info(f'Best Parameters: {best_params}')
 
         return best_params
     except Exception as e:
@@ -262,8 +955,70 @@ def _hyper_parameter_tuning(X_train, y_train, x_test, y_test, sample_weight):
         return None
 
 
+def _cast_params(params):
+    """ Cast the optimizer hyperparameters to the xgboost types """
+    params = dict(params)
+    params['max_depth'] = int(params['max_depth'])
+    params['num_boost_round'] = int(params['num_boost_round'])
+    params['learning_rate'] = float(params['learning_rate'])
+    params['subsample'] = float(params['subsample'])
+    params['colsample_bytree'] = float(params['colsample_bytree'])
+    params['gamma'] = int(params['gamma'])
+    params['reg_alpha'] = float(params['reg_alpha'])
+    params['reg_lambda'] = int(params['reg_lambda'])
+    return params
+
+
+def _register_trials(optimizer, trial_log, param_bounds):
+    """
+    Register the recorded trials of the dataset with the optimizer,
+    and compute the number of trials left to run.
+
+    A run seeded with the trials of previous runs skips the random
+    exploration and runs the shorter warm start schedule. A resumed run
+    only runs the trials of its schedule it has not completed yet.
+
+    Args:
+      optimizer: (BayesianOptimization) the optimizer
+      trial_log: (TuningTrialLog) loaded trial log
+      param_bounds: (dict) hyperparameter search bounds
+
+    Returns:
+      tuple: random and optimized trials left to run
+    """
+
+    def in_bounds(params):
+        return params.keys() == param_bounds.keys() and all(
+            low <= params[name] <= high
+            for name, (low, high) in param_bounds.items()
+        )
+
+    # Truncated trials, or trials outside of the current bounds
+    # cannot be replayed
+    seeded = 0
+    for trial in trial_log.previous + trial_log.resumed:
+        if not trial.get('truncated') and in_bounds(trial['params']):
+            optimizer.register(params=trial['params'], target=trial['score'])
+            seeded += trial in trial_log.previous
+
+    if seeded:
+        logger.info(f'Warm start from {seeded} previous trials')
+        init_points, n_iter = 0, training_settings.tuning_warm_start_n_iter
+    else:
+        init_points = training_settings.tuning_init_points
+        n_iter = training_settings.tuning_n_iter
+
+    # A resumed run only runs the trials it has not completed yet
+    done = len(trial_log.resumed)
+    remaining = max(0, init_points + n_iter - done)
+    init_points = max(0, init_points - done)
+
+    return init_points, remaining - init_points
+
+
 def _create_and_train_model(
-        X_train, y_train, x_test, y_test, h_params, sample_weight):
+        cache: DatasetCache, h_params, budget: TimeBudget = None,
+        checkpoint: TrainingCheckpoint = None, base_model=None):
     """
     This function trains the xgboost model using the optimized
     hyperparameters. The model is a classifier with categorical and
@@ -275,26 +1030,27 @@ def _create_and_train_model(
     The model parameter chosen is to minimize the log-
     loss and optimize recall for the minority classes.
 
+    When the time budget is exhausted the boosting stops early, and the
+    model trained so far is returned.
+
     Args:
-      X_train: (array) training set features
-      y_train: (array) training set target
-      x_test: (array) test set features
-      y_test: (array) test set target
+      cache: (DatasetCache) training and test matrices
       h_params: (dict) hyperparameters
-      sample_weight: (array) class weights
+      budget: (TimeBudget) training time budget
+      checkpoint: (TrainingCheckpoint) checkpoint callback
+      base_model: (xgb.Booster) checkpoint booster the training
+        continues from
 
     Returns:
-      object: trained model
+      tuple: trained model, and its test metrics
     """
 
     start = time.perf_counter()
     logger.info('Start: Training model...')
 
     # Train model with best parameters
-    params = {
-        'eval_metric': 'mlogloss',
-        'objective': 'multi:softprob',
-        'num_class': 4,
+    params = _base_params(cache)
+    params.update({
         'max_depth': h_params['max_depth'],
         'learning_rate': h_params['learning_rate'],
         'subsample': h_params['subsample'],
@@ -302,33 +1058,42 @@ def _create_and_train_model(
         'gamma': h_params['gamma'],
         'reg_alpha': h_params['reg_alpha'],
         'reg_lambda': h_params['reg_lambda'],
-    }
+    })
     num_boost_round = h_params['num_boost_round']
 
     try:
 
-        # Create the tuning model using DMatrix for XGBoost
-        _x_train = xgb.DMatrix(
-            X_train,
-            label=y_train,
-            enable_categorical=True,
-            weight=sample_weight
-        )
+        # Reuse the matrices built during hyperparameter tuning
+        _x_train = cache.get('train')
+        _x_test = cache.get('test')
+        y_test = _x_test.get_label().astype(int)
 
-        _x_test = xgb.DMatrix(
-            x_test,
-            label=y_test,
-            enable_categorical=True,
-        )
+        # Train model, the rounds of the checkpoint are not trained again
+        deadline = _DeadlineCallback(budget or TimeBudget())
+        callbacks = [deadline]
+        if checkpoint is not None:
+            callbacks.append(checkpoint)
+
+        trained_rounds = 0
+        if base_model is not None:
+            trained_rounds = base_model.num_boosted_rounds()
 
-        # Train model
         model_xgb = xgb.train(
             params,
             _x_train,
             # evals=[(_x_test, 'eval')],
-            num_boost_round=int(num_boost_round),
+            num_boost_round=max(0, int(num_boost_round) - trained_rounds),
+            xgb_model=base_model,
+            callbacks=callbacks
         )
 
+        if deadline.stopped:
+            logger.warning(
+                'Training budget exhausted after '
+                f'{model_xgb.num_boosted_rounds()} of {num_boost_round} '
+                'boosting rounds'
+            )
+
         # Predict
         y_pred_probs = model_xgb.predict(_x_test)
         y_pred = y_pred_probs.argmax(axis=1)
@@ -352,68 +1117,139 @@ def _create_and_train_model(
             f'Recall: {recall:.3f}, F1: {f1:.3f}'
         )
 
-        return model_xgb
+        return model_xgb, {
+            'log_loss': final_log_loss,
+            'accuracy': accuracy,
+            'precision': precision,
+            'recall': recall,
+            'f1': f1,
+        }
 
     except Exception as e:
         logger.error(f'Error training model: {e}')
-        return None
+        return None, None
 
 
-def _save_model(model):
+def _save_model(model, manifest=None, serving_model=None):
     """
-    Save model to disk. The function saves the trained model
-    to the specified path using pickle.
+    Publish the model as a new version of the model registry.
 
-    The model filename will be in the format: 'model_name_YYYYMMDDHHMMSS.pkl'
-    - with the postfixed build timestamp, to serve as its unique version
-    identifier.
+    The version manifest records the training run manifest, along with
+    the feature order of the model and the training duration. A
+    distilled serving model is published as the 'serving' artifact of
+    the version, next to the full 'model' artifact. The models are saved
+    in the xgboost native binary format, along with the 'preprocessor'
+    artifact, the feature preprocessing the models were trained with.
 
-    The environment variable responsible for disseminating the correct
-    model file to deploy for the inference  service will dynamically
-    update. This operation updates the in-memory setting, as well as
-    the environment file on disk.
+    The version is published with an atomic pointer switch, inference
+    processes pick up the new version on their next prediction.
 
     Args:
       model: (object) trained model
+      manifest: (dict) training run manifest
+      serving_model: (object) distilled serving model
+
+    Returns:
+      str: published version
     """
 
-    # Begin: Saving model to disk
+    manifest = manifest or {}
 
-    # 1. Get the current deployed model name
+    # 1. The model artifacts
+    artifacts = {
+        'model': ('model.ubj', 'ubj', save_model(model)),
+        'preprocessor': (
+            'preprocessor.json', 'json',
+            Preprocessor.for_model(model).to_json().encode('utf-8')),
+    }
+    if serving_model is not None:
+        artifacts['serving'] = (
+            'serving.ubj', 'ubj', save_model(serving_model))
 
-    model_path = settings.model_path
-    model_fname = settings.model_name
+    # 2. The version base name, the configured model name without its
+    # build timestamp
+    base = os.path.splitext(settings.model_name)[0]
+    if '_' in base:
+        base = base.rsplit('_', 1)[0]
 
-    # 2. Prepare the timestamp suffix for the model filename
+    registry = ModelRegistry(settings.model_path, settings.registry_retention)
+    return registry.publish(base, artifacts, {
+        'features': model.feature_names,
+        'duration': manifest.get('budget', {}).get('consumed'),
+        **manifest,
+    })
 
-    date_suffix = datetime.now().strftime('%Y%m%d%H%M%S')
 
-    # 3. Split the current filename to remove the old timestamp and
+def _load_deployed_model():
+    """
+    Load the published model and its manifest, or the model named by the
+    model settings when nothing was published to the registry yet.
 
-    # reuse the base filename
-    base, ext = os.path.splitext(model_fname)
+    Returns:
+      tuple: model, manifest and version
+    """
+
+    registry = ModelRegistry(settings.model_path)
+    version = registry.current()
+
+    if version is None:
+        # Legacy model, saved next to its manifest in the model path
+        base = os.path.splitext(settings.model_name)[0]
+        model, _ = load_model(
+            f'{settings.model_path}/{settings.model_name}', 'pickle')
+        with open(f'{settings.model_path}/{base}.json', 'r') as f:
+            return model, json.load(f), settings.model_name
+
+    manifest = registry.manifest(version)
+    artifact = manifest['artifacts']['model']
+    model, verification = load_model(
+        registry.artifact_path(version, artifact['file']),
+        artifact['format'],
+        artifact['sha256']
+    )
+    verification.verify()
+
+    return model, manifest, version
+
+
+def _run_profiler():
+    """ Profiler of a training run, with the configured sampling """
+    return RunProfiler(
+        training_settings.profile_interval,
+        training_settings.profile_stacks
+    )
 
-    # Find the last underscore in the base
-    if "_" in base:
-        base_name, _ = base.rsplit("_", 1)
-        model_fname = base_name
 
-    # 4. Build the new model filename
+def _run_profile(profiler: RunProfiler) -> dict:
+    """
+    Return the profile of a training run for the manifest, and log its
+    stages. With stack sampling, the sampled stacks of the slowest stage
+    are written to the profiles directory of the model path.
+    """
 
-    model_fname = f'{model_fname}_{date_suffix}.pkl'
-    # Set the new model path and filename
-    model_pname = f'{model_path}/{model_fname}'
+    profile = profiler.summary()
+    for name, stage in profile['stages'].items():
+        logger.info(
+            f'Stage `{name}`: {stage["wall_seconds"]:.2f}s wall, '
+            f'{stage["cpu_seconds"]:.2f}s cpu, '
+            f'{stage["peak_rss_mb"]:.1f} MB peak RSS'
+        )
 
-    # 5. Save model into the deployment path
+    if profiler.sample_stacks:
+        profile['stacks'] = profiler.write_stacks(
+            os.path.join(settings.model_path, 'profiles'))
 
-    logger.debug(f'Saving model to {model_pname}')
-    with open(model_pname, 'wb') as f:
-        # Serialize the model
-        pkl.dump(model, f)
+    return profile
 
-    # 6. Update the deployed model name in the settings
 
-    settings.update({'MODEL_NAME': model_fname})
+def _dataset_shape(mh: MentalHealthData) -> dict:
+    """ Shape and types of the dataset matrix, for the manifest """
+    return {
+        'shape': list(mh.features.shape),
+        'dtype': str(mh.features.dtype),
+        'nbytes': mh.features.nbytes,
+        'feature_types': dict(Counter(mh.feature_types)),
+    }
 
 
 def _get_elapsed(start, end):
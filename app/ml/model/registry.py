@@ -0,0 +1,195 @@
+"""
+This module provides the versioned model registry.
+
+Every published model is a version directory of the registry, holding
+the model artifacts and the version manifest: metrics, dataset
+fingerprint, feature order, training duration, and the checksum and
+format of every artifact. The published version is named by the
+`CURRENT` pointer file, which is switched atomically, so a reader
+sees either the previous or the new version, never a partial one.
+
+    <model_path>/registry/
+        CURRENT
+        xgb_model_v1_20250101120000/
+            manifest.json
+            model.ubj
+            serving.ubj
+
+Inference processes read the pointer, a few bytes, to find out whether
+a new version was published. The last N versions are retained.
+
+The module contains the following classes:
+    - ModelRegistry: Publish, and look up the registry model versions
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+
+from loguru import logger
+
+_POINTER = 'CURRENT'
+_MANIFEST = 'manifest.json'
+
+
+class ModelRegistry:
+    """
+    Versioned model registry.
+
+    Attributes:
+      root: (str) registry directory
+      retention: (int) number of versions retained
+
+    Methods:
+      publish: Publish a new model version
+      current: Return the published version
+      versions: Return the retained versions, newest first
+      manifest: Return the manifest of a version
+      artifact_path: Return the file path of a version artifact
+    """
+
+    def __init__(self, model_path, retention=5):
+
+        self.root = os.path.join(model_path, 'registry')
+        self.retention = retention
+
+    def publish(self, name, artifacts, manifest) -> str:
+        """
+        Publish a new model version.
+
+        The version is written into a staging directory, renamed into
+        place, then the pointer is switched to it. The oldest versions
+        beyond the retention are removed.
+
+        Args:
+          name: (str) model base name, prefix of the version name
+          artifacts: (dict) artifact name to (file name, format, bytes)
+          manifest: (dict) version manifest
+
+        Returns:
+          str: the published version
+        """
+
+        os.makedirs(self.root, exist_ok=True)
+
+        # 1. Unique version name, the build timestamp
+        version = f'{name}_{datetime.now().strftime("%Y%m%d%H%M%S")}'
+        suffix = 1
+        while os.path.exists(os.path.join(self.root, version)):
+            version = f'{version.rsplit(".", 1)[0]}.{suffix}'
+            suffix += 1
+
+        # 2. Write the artifacts and manifest into the staging directory
+        staging = os.path.join(self.root, f'.staging-{version}')
+        os.makedirs(staging)
+
+        entries = {}
+        for artifact, (fname, fmt, data) in artifacts.items():
+            _write_synced(os.path.join(staging, fname), data)
+            entries[artifact] = {
+                'file': fname,
+                'format': fmt,
+                'size': len(data),
+                'sha256': hashlib.sha256(data).hexdigest(),
+            }
+
+        manifest = {
+            'version': version,
+            'created': datetime.now().isoformat(),
+            **manifest,
+            'artifacts': entries,
+        }
+        _write_synced(
+            os.path.join(staging, _MANIFEST),
+            json.dumps(manifest, indent=2).encode('utf-8')
+        )
+
+        # 3. Move the version into place, then switch the pointer
+        os.replace(staging, os.path.join(self.root, version))
+        _write_synced(
+            os.path.join(self.root, f'{_POINTER}.tmp'), version.encode())
+        os.replace(
+            os.path.join(self.root, f'{_POINTER}.tmp'),
+            os.path.join(self.root, _POINTER)
+        )
+
+        logger.info(f'Published model version {version}')
+
+        self._apply_retention(version)
+
+        return version
+
+    def current(self) -> str:
+        """
+        Return the published version.
+
+        Returns:
+          str: published version, None when nothing was published
+        """
+        try:
+            with open(os.path.join(self.root, _POINTER), 'r') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def versions(self) -> list:
+        """
+        Return the retained versions, newest first.
+
+        Returns:
+          list: model versions
+        """
+        try:
+            entries = [
+                entry for entry in os.scandir(self.root)
+                if entry.is_dir() and not entry.name.startswith('.')
+            ]
+        except FileNotFoundError:
+            return []
+
+        entries.sort(key=lambda entry: entry.stat().st_mtime_ns, reverse=True)
+        return [entry.name for entry in entries]
+
+    def manifest(self, version) -> dict:
+        """
+        Return the manifest of a version.
+
+        Args:
+          version: (str) model version
+
+        Returns:
+          dict: version manifest
+        """
+        with open(os.path.join(self.root, version, _MANIFEST), 'r') as f:
+            return json.load(f)
+
+    def artifact_path(self, version, fname) -> str:
+        """
+        Return the file path of a version artifact.
+
+        Args:
+          version: (str) model version
+          fname: (str) artifact file name
+
+        Returns:
+          str: artifact path
+        """
+        return os.path.join(self.root, version, fname)
+
+    def _apply_retention(self, current):
+
+        for version in self.versions()[self.retention:]:
+            if version == current:
+                continue
+            logger.debug(f'Removing model version {version}')
+            shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
+
+
+def _write_synced(path, data):
+
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,161 @@
+"""
+This module provides the serialization of the model artifacts.
+
+Models are saved in xgboost's native binary format (UBJSON), which is
+portable across xgboost and python versions and safe to load. Pickle is
+still loaded, for the artifacts saved before the native format.
+
+A native model file is loaded by the public xgboost loader from its path,
+it is never copied into a python buffer. Its checksum is verified lazily,
+on a read-only memory map of the file, in the background while the model
+is parsed, and memoized per file so a file is only hashed once per
+process. A pickle is verified before it is unpickled, unpickling runs
+arbitrary code.
+
+The module contains the following classes and functions:
+    - ChecksumVerification: Lazy, memoized artifact checksum verification
+    - save_model: Serialize a model into an artifact format
+    - load_model: Load a model artifact
+"""
+
+import os
+import mmap
+import hashlib
+import pickle as pkl
+import threading
+
+import xgboost as xgb
+
+# Artifact formats
+NATIVE = 'ubj'
+PICKLE = 'pickle'
+
+# Verified artifacts of the process: (path, size, mtime) -> checksum
+_verified = {}
+_verified_lock = threading.Lock()
+
+
+class ChecksumVerification:
+    """
+    Lazy, memoized artifact checksum verification.
+
+    The checksum is computed in a background thread, hashlib releases
+    the GIL while hashing, the result is memoized per artifact file.
+    Without a buffer, the file is memory mapped by the thread, and
+    unmapped once hashed.
+
+    Methods:
+      verify: Wait for the verification, raise on a checksum mismatch
+    """
+
+    def __init__(self, path, buffer, expected):
+        """
+        Args:
+          path: (str) artifact path
+          buffer: (bytes) artifact content, None to map the file
+          expected: (str) expected checksum, None to skip the
+            verification
+        """
+
+        self.path = path
+        self.expected = expected
+        self._key = _file_key(path)
+        self._actual = None
+
+        with _verified_lock:
+            self._actual = _verified.get(self._key)
+
+        self._thread = None
+        if expected is not None and self._actual is None:
+            self._thread = threading.Thread(
+                target=self._hash, args=(buffer,), daemon=True)
+            self._thread.start()
+
+    def verify(self):
+        """
+        Wait for the verification, raise on a checksum mismatch.
+
+        Raises:
+          ValueError: the artifact does not match its checksum
+        """
+
+        if self.expected is None:
+            return
+        if self._thread is not None:
+            self._thread.join()
+
+        if self._actual != self.expected:
+            with _verified_lock:
+                _verified.pop(self._key, None)
+            raise ValueError(f'Checksum mismatch of {self.path}')
+
+    def _hash(self, buffer):
+
+        if buffer is None:
+            with open(self.path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                self._actual = hashlib.sha256(m).hexdigest()
+        else:
+            self._actual = hashlib.sha256(buffer).hexdigest()
+
+        with _verified_lock:
+            _verified[self._key] = self._actual
+
+
+def save_model(model, fmt=NATIVE) -> bytes:
+    """
+    Serialize a model into an artifact format.
+
+    Args:
+      model: (xgb.Booster) model
+      fmt: (str) artifact format, 'ubj' or 'pickle'
+
+    Returns:
+      bytes: serialized model
+    """
+    if fmt == NATIVE:
+        return bytes(model.save_raw('ubj'))
+    return pkl.dumps(model)
+
+
+def load_model(path, fmt, sha256=None):
+    """
+    Load a model artifact.
+
+    The native format is verified lazily, call verify() on the returned
+    verification before trusting the model. The pickle format is
+    verified before it is loaded.
+
+    Args:
+      path: (str) artifact path
+      fmt: (str) artifact format, 'ubj' or 'pickle'
+      sha256: (str) expected checksum, None to skip the verification
+
+    Returns:
+      tuple: the model and its checksum verification
+
+    Raises:
+      ValueError: unknown format, or a pickle checksum mismatch
+    """
+
+    if fmt == PICKLE:
+        with open(path, 'rb') as f:
+            data = f.read()
+        verification = ChecksumVerification(path, data, sha256)
+        verification.verify()
+        return pkl.loads(data), verification
+    if fmt != NATIVE:
+        raise ValueError(f'Unknown model format {fmt}')
+
+    # Hashed while xgboost reads and parses the file, the file is never
+    # held in a python buffer
+    verification = ChecksumVerification(path, None, sha256)
+    model = xgb.Booster(model_file=path)
+
+    return model, verification
+
+
+def _file_key(path):
+
+    stat = os.stat(path)
+    return (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
@@ -0,0 +1,199 @@
+"""
+This module provides the protocol and the client of the model server
+sidecar.
+
+The model server is a local process which loads the model once, and
+serves the predictions of all the web workers of the host over a Unix
+domain socket, see app.ml.model.model_server. The workers do not load
+the model, and the server batches the requests of all the workers into
+a single prediction.
+
+The protocol is a binary request/response exchange on a persistent
+connection. A request is the answer codes of the batch, a float32
+matrix whose columns are the request fields, in the EXPECTED_FEATURE_ORDER
+of the inference service. A response is the float32 matrix of the class
+probabilities, or an error message:
+
+    request:   b'MHP1' | rows: u32 | cols: u32 | float32[rows * cols]
+    response:  status: u8 | rows: u32 | cols: u32 | float32[rows * cols]
+    error:     status: u8 | length: u32 | 0: u32 | utf-8 message
+
+The module contains the following classes and functions:
+    - SidecarClient: Client of the model server
+    - SidecarError: Error returned by the model server
+    - encode_records: Encode request records into an answer code matrix
+    - send_matrix: Send a matrix frame
+    - receive_exactly: Receive an exact number of bytes
+
+Properties:
+    sidecar_client: SidecarClient object
+"""
+
+import socket
+import struct
+import threading
+
+import numpy as np
+
+from app.ml.config.model import model_settings as settings
+
+MAGIC = b'MHP1'
+REQUEST_HEADER = struct.Struct('<4sII')
+RESPONSE_HEADER = struct.Struct('<BII')
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+class SidecarError(RuntimeError):
+    """ Error returned by the model server """
+
+
+class SidecarClient:
+    """
+    Client of the model server.
+
+    Every thread of the worker keeps its own persistent connection to the
+    server, the requests of a thread are sent one at a time.
+
+    Attributes:
+      socket_path: (str) Unix domain socket of the model server
+      timeout: (float) seconds to wait for a response
+
+    Methods:
+      predict: Return the class probabilities of a batch
+      close: Close the connection of the calling thread
+    """
+
+    def __init__(self, socket_path, timeout=5.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def predict(self, codes) -> np.ndarray:
+        """
+        Return the class probabilities of a batch. A stale connection,
+        closed by a server restart, is opened again once.
+
+        Args:
+          codes: (np.ndarray) answer code matrix, see encode_records
+
+        Returns:
+          np.ndarray: class probabilities
+
+        Raises:
+          TimeoutError: the model server did not respond in time
+          OSError: the model server is not reachable
+          SidecarError: the model server failed to predict
+        """
+
+        try:
+            return self._request(codes)
+        except (BrokenPipeError, ConnectionResetError, EOFError):
+            self.close()
+            return self._request(codes)
+
+    def close(self):
+        """ Close the connection of the calling thread """
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            self._local.sock = None
+            sock.close()
+
+    def _request(self, codes):
+
+        sock = self._connection()
+        try:
+            send_matrix(sock, codes, REQUEST_HEADER.pack(
+                MAGIC, codes.shape[0], codes.shape[1]))
+
+            status, rows, cols = RESPONSE_HEADER.unpack(
+                receive_exactly(sock, RESPONSE_HEADER.size))
+            if status != STATUS_OK:
+                message = receive_exactly(sock, rows).decode('utf-8')
+                raise SidecarError(message)
+
+            data = receive_exactly(sock, rows * cols * 4)
+        except socket.timeout:
+            # The response may still arrive, the connection is dropped
+            self.close()
+            raise
+
+        return np.frombuffer(data, dtype=np.float32).reshape(rows, cols)
+
+    def _connection(self):
+
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        return sock
+
+
+def encode_records(records, fields) -> np.ndarray:
+    """
+    Encode request records into the answer code matrix of the protocol.
+    A missing field is a missing value.
+
+    Args:
+      records: (list) records, request field to answer code
+      fields: (list) request fields, the matrix columns
+
+    Returns:
+      np.ndarray: float32 answer code matrix
+    """
+    return np.array(
+        [[record.get(field, 'nan') for field in fields]
+         for record in records],
+        dtype=np.float32
+    ).reshape(len(records), len(fields))
+
+
+def send_matrix(sock, matrix, header):
+    """
+    Send a matrix frame, the header followed by the float32 values.
+
+    Args:
+      sock: (socket.socket) connected socket
+      matrix: (np.ndarray) matrix
+      header: (bytes) frame header
+    """
+    data = np.ascontiguousarray(matrix, dtype=np.float32)
+    sock.sendall(header + data.tobytes())
+
+
+def receive_exactly(sock, size) -> bytearray:
+    """
+    Receive an exact number of bytes.
+
+    Args:
+      sock: (socket.socket) connected socket
+      size: (int) number of bytes
+
+    Returns:
+      bytearray: received bytes
+
+    Raises:
+      EOFError: the connection was closed
+    """
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise EOFError('Connection closed by the peer')
+        received += n
+    return buffer
+
+
+sidecar_client = SidecarClient(
+    settings.sidecar_socket,
+    settings.sidecar_timeout
+)
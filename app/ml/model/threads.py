@@ -0,0 +1,169 @@
+"""
+This module provides the CPU thread budget of the inference processes.
+
+Every gunicorn worker runs its own booster, and xgboost, OpenMP and the
+BLAS libraries of numpy each default to a thread per core. With several
+workers, each serving several requests at a time, the predictions run
+many more threads than cores, and the tail latency spikes as the threads
+preempt each other.
+
+The thread budget divides the cores of the process between the workers
+and the request threads of a worker:
+
+    cores available      8   (affinity, and container CPU quota)
+    worker threads       8 // 4 workers = 2   native thread pools limit
+    request threads      2 // 2 request threads = 1   booster nthread
+
+A prediction of a large batch, an offline job, is given the batch
+threads instead, all the cores by default.
+
+The module contains the following classes and functions:
+    - ThreadBudget: CPU thread budget of an inference process
+    - available_cores: Return the number of cores available
+
+Properties:
+    thread_budget: ThreadBudget object
+"""
+
+import math
+import os
+import threading
+
+from loguru import logger
+from threadpoolctl import threadpool_limits
+
+from app.ml.config.model import model_settings as settings
+
+# cgroup v2 CPU quota of the container
+_CPU_MAX_PATH = '/sys/fs/cgroup/cpu.max'
+
+
+class ThreadBudget:
+    """
+    CPU thread budget of an inference process.
+
+    Attributes:
+      enabled: (bool) the budget is applied
+      cores: (int) cores available to the process
+      workers: (int) worker processes sharing the cores
+      threads: (int) request threads of a worker
+      worker_threads: (int) threads of the native thread pools of a worker
+      request_threads: (int) booster threads of a prediction
+      batch_rows: (int) batch size from which the batch threads are used
+      batch_threads: (int) booster threads of a large batch prediction
+
+    Methods:
+      configure: Set the worker topology of the budget
+      apply: Limit the native thread pools of the process
+      nthread: Return the booster threads of a prediction
+    """
+
+    def __init__(self, enabled=True, cores=None, workers=1, threads=1,
+                 request_threads=None, batch_rows=10_000,
+                 batch_threads=None):
+
+        self.enabled = enabled
+        self.batch_rows = batch_rows
+
+        self._request_threads = request_threads
+        self._batch_threads = batch_threads
+        self._limits = None
+        self._lock = threading.Lock()
+
+        self.configure(workers, threads, cores)
+
+    def configure(self, workers, threads, cores=None):
+        """
+        Set the worker topology of the budget, before it is applied.
+        e.g. the model server is the only process predicting on the host,
+        and the scoring jobs are given a share of the cores.
+
+        Args:
+          workers: (int) worker processes sharing the cores
+          threads: (int) request threads of a worker
+          cores: (int) cores of the budget, the available cores when not
+            set
+        """
+
+        self.cores = cores or available_cores()
+        self.workers = max(1, workers)
+        self.threads = max(1, threads)
+        self.worker_threads = max(1, self.cores // self.workers)
+        self.request_threads = self._request_threads or max(
+            1, self.worker_threads // self.threads)
+        self.batch_threads = min(
+            self._batch_threads or self.cores, self.cores)
+
+    def apply(self):
+        """
+        Limit the native thread pools of the process, the OpenMP and BLAS
+        pools, to the worker threads. Only the first call has an effect.
+        """
+
+        if not self.enabled or self._limits is not None:
+            return
+
+        with self._lock:
+            if self._limits is None:
+                self._limits = threadpool_limits(limits=self.worker_threads)
+                logger.info(
+                    f'Thread budget: {self.cores} cores, '
+                    f'{self.workers} workers x {self.threads} threads, '
+                    f'{self.worker_threads} worker threads, '
+                    f'{self.request_threads} request threads, '
+                    f'{self.batch_threads} threads from '
+                    f'{self.batch_rows} rows'
+                )
+
+    def nthread(self, rows) -> int:
+        """
+        Return the booster threads of a prediction.
+
+        Args:
+          rows: (int) rows of the predicted batch
+
+        Returns:
+          int: booster threads, 0 for the xgboost default when the budget
+            is disabled
+        """
+
+        if not self.enabled:
+            return 0
+        if rows >= self.batch_rows:
+            return self.batch_threads
+        return self.request_threads
+
+
+def available_cores() -> int:
+    """
+    Return the number of cores available to the process, the cores of
+    its CPU affinity, bounded by the CPU quota of its container.
+
+    Returns:
+      int: number of cores
+    """
+
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    try:
+        with open(_CPU_MAX_PATH, 'r') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            cores = min(cores, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return cores
+
+
+thread_budget = ThreadBudget(
+    enabled=settings.thread_budget,
+    workers=settings.web_workers,
+    threads=settings.web_threads,
+    request_threads=settings.inference_threads,
+    batch_rows=settings.inference_batch_rows,
+    batch_threads=settings.inference_batch_threads
+)
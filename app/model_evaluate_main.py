@@ -0,0 +1,97 @@
+"""
+This module is the entry point for the champion/challenger evaluation.
+
+The deployed model, the latest registry versions and unpublished model
+files are scored on the same holdout rows, and compared in a report:
+
+    # The last 3 registry versions
+    python -m app.model_evaluate_main
+
+    # A new model against the deployed one
+    python -m app.model_evaluate_main --versions 1 --model new_model.ubj
+"""
+
+import argparse
+
+from app.ml.model.evaluation import evaluate_models
+
+_CLASSES = ['0 Days', '1-13 Days', '14+ Days', 'Unsure']
+
+
+def process_args():
+    """
+    Terminal argument parser for the model evaluation application.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Compare the models on the holdout rows.'
+    )
+
+    parser.add_argument(
+        '--versions',
+        type=int,
+        default=3,
+        help='Number of the latest registry versions to evaluate'
+    )
+    parser.add_argument(
+        '--model',
+        action='append',
+        default=[],
+        help='Unpublished model file to evaluate, ".ubj" or ".pkl", '
+             'may be repeated'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of worker processes, one per core by default'
+    )
+    parser.add_argument(
+        '--output',
+        default=None,
+        help='Report path, in the model path by default'
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """
+    Run the model evaluation, and print the comparison.
+    """
+    args = process_args()
+
+    print('Running model evaluation...')
+
+    report = evaluate_models(
+        n_versions=args.versions,
+        model_files=args.model,
+        workers=args.workers,
+        output=args.output
+    )
+    if report is None:
+        print('Nothing to evaluate.')
+        return
+
+    print(f'\n  Holdout rows: {report["holdout"]["rows"]}\n')
+    print(f'  {"Model":<44} {"Log-Loss":>9} {"Recall":>7} {"F1":>7}  '
+          + ' '.join(f'{name:>10}' for name in _CLASSES))
+
+    for result in report['candidates']:
+        metrics = result['metrics']
+        marker = '*' if result['name'] == report['champion'] else ' '
+        if not result['holdout_unseen']:
+            marker += '!'
+        recall = ' '.join(
+            f'{value:>10.3f}' for value in metrics['classes']['recall'])
+        print(f'{marker:<2} {result["name"]:<43} {metrics["log_loss"]:>9.4f} '
+              f'{metrics["recall"]:>7.3f} {metrics["f1"]:>7.3f}  {recall}')
+
+    print('\n  * deployed model, ! trained on holdout rows, or unknown, '
+          'per class columns: recall')
+    print(f'  Best model: {report["best"]}')
+    print(f'  Report: {report["path"]}\n')
+
+
+if __name__ == '__main__':
+    main()
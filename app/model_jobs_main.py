@@ -0,0 +1,88 @@
+"""
+This module is the entry point for the scoring job workers.
+
+The module contains the main function that runs the job workers, the
+processes scoring the CSV uploads of the prediction API in the
+background, see app.web.jobs. The workers are niced, and their thread
+budget limited to JOB_THREADS cores, so the jobs do not compete with
+the interactive predictions of the web workers.
+"""
+
+import argparse
+import os
+import signal
+import threading
+from multiprocessing import get_context
+
+from app.web.settings import settings
+
+
+def process_args():
+    """
+    Terminal argument parser for the job worker application.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Score the queued CSV upload jobs.'
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=settings.JOB_WORKERS,
+        help='Job worker processes'
+    )
+
+    return parser.parse_args()
+
+
+def run_worker():
+    """
+    Run a job worker until it is terminated. The job it scores is
+    resumed by the next worker, from its last scored chunk.
+    """
+
+    os.nice(settings.JOB_NICE)
+
+    from app.ml.model.threads import thread_budget
+    from app.web.jobs import JobWorker, scoring_jobs
+
+    # Before the model is loaded, the budget is applied with it
+    thread_budget.configure(workers=1, threads=1, cores=settings.JOB_THREADS)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    JobWorker(scoring_jobs, settings.JOB_POLL_INTERVAL).run(stop)
+
+
+def main():
+    """
+    Run the job workers.
+    """
+    args = process_args()
+
+    if args.workers <= 1:
+        run_worker()
+        return
+
+    spawn = get_context('spawn')
+    workers = [spawn.Process(target=run_worker) for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    # Stop the workers with the main process
+    def stop(signum, frame):
+        for worker in workers:
+            worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+This module is the entry point for the model server application.
+
+The module contains the main function that runs the model server, the
+sidecar serving the predictions of the web workers of the host, when
+their inference backend is 'sidecar'.
+"""
+
+import argparse
+import signal
+import threading
+
+from app.ml.config.model import model_settings as settings
+from app.ml.model.model_server import ModelServer
+
+
+def process_args():
+    """
+    Terminal argument parser for the model server application.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Serve the model predictions of the web workers.'
+    )
+
+    parser.add_argument(
+        '--socket',
+        default=settings.sidecar_socket,
+        help='Unix domain socket the server listens on'
+    )
+    parser.add_argument(
+        '--max-batch-rows',
+        type=int,
+        default=settings.sidecar_max_batch_rows,
+        help='Rows of the requests batched into a prediction'
+    )
+    parser.add_argument(
+        '--max-wait',
+        type=float,
+        default=settings.sidecar_max_wait,
+        help='Seconds the batcher waits for more requests'
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """
+    Run the model server until it is terminated.
+    """
+    args = process_args()
+
+    server = ModelServer(args.socket, args.max_batch_rows, args.max_wait)
+
+    # The server is stopped from another thread than serve_forever
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
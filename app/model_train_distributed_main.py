@@ -0,0 +1,105 @@
+"""
+This module is the entry point for the distributed model training.
+
+The coordinator shards the training data across local worker processes,
+and optionally across workers running on other hosts:
+
+    # Single host, 4 workers
+    python -m app.model_train_distributed_main --workers 4
+
+    # Two hosts, 4 workers each, the second host joins the tracker
+    # address logged by the coordinator
+    python -m app.model_train_distributed_main --workers 4 \\
+        --world-size 8 --host-ip 10.0.0.1
+    python -m app.model_train_distributed_main --workers 4 \\
+        --join 10.0.0.1:<port>
+"""
+
+import argparse
+import os
+
+import humanfriendly
+
+from app.ml.model.model_builder import ModelBuilderService
+
+
+def process_args():
+    """
+    Terminal argument parser for the distributed training application.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Build and train the model on several workers.'
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of local worker processes'
+    )
+    parser.add_argument(
+        '--world-size',
+        type=int,
+        default=None,
+        help='Total number of workers on all hosts, defaults to --workers'
+    )
+    parser.add_argument(
+        '--host-ip',
+        default=None,
+        help='Address the tracker listens on, reachable by all hosts'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=0,
+        help='Port the tracker listens on, any free port by default. '
+             'The tracker address is logged'
+    )
+    parser.add_argument(
+        '--join',
+        metavar='HOST:PORT',
+        default=None,
+        help='Join the training run of the tracker at HOST:PORT'
+    )
+    parser.add_argument(
+        '--time-budget',
+        type=humanfriendly.parse_timespan,
+        default=None,
+        help='Total wall-clock budget of the run, e.g. "90m" or "2h"'
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """
+    Run the distributed model training, as the coordinator or as
+    workers joining a coordinator.
+    """
+    args = process_args()
+
+    svc = ModelBuilderService()
+
+    if args.join:
+        host, port = args.join.rsplit(':', 1)
+        print(f'Joining model training at {args.join}...')
+        svc.join_distributed_training(host, int(port), args.workers)
+        print('Worker training complete.')
+        return
+
+    print('Running distributed model training...')
+
+    svc.train_distributed_model(
+        args.workers,
+        world_size=args.world_size,
+        host_ip=args.host_ip,
+        port=args.port,
+        time_budget=args.time_budget
+    )
+
+    print('Model training complete.')
+
+
+if __name__ == '__main__':
+    main()
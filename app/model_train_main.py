@@ -5,20 +5,72 @@ This module is the entry point for the model builder application.
 The module contains the main function that runs the model training pipeline.
 """
 
+import argparse
+
+import humanfriendly
+
 from app.ml.model.model_builder import ModelBuilderService
 
 
+def process_args():
+    """
+    Terminal argument parser for the model training application.
+    """
+
+    parser = argparse.ArgumentParser(
+        description='Build and train the model.'
+    )
+
+    parser.add_argument(
+        '--time-budget',
+        type=humanfriendly.parse_timespan,
+        default=None,
+        help='Total wall-clock budget of the run, e.g. "90m" or "2h"'
+    )
+
+    parser.add_argument(
+        '--external-memory',
+        action='store_true',
+        help='Stream the dataset in chunks, for datasets larger than memory'
+    )
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Resume the training from the last checkpoint'
+    )
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        help='Refresh the deployed model with the rows added since it was '
+             'trained, instead of building a new model'
+    )
+
+    return parser.parse_args()
+
+
 def main():
     """
     Run the model training pipeline.
 
     The function runs the model training pipeline to build and train the model.
     """
+    args = process_args()
+
     print('Running model training...')
 
     # Create service
     svc = ModelBuilderService()
-    svc.train_model()
+    if args.refresh:
+        svc.refresh_model(time_budget=args.time_budget)
+        print('Model refresh complete.')
+        return
+
+    svc.train_model(
+        time_budget=args.time_budget,
+        external_memory=args.external_memory,
+        resume=args.resume
+    )
 
     print('Model training complete.')
 
@@ -0,0 +1,347 @@
+"""
+This module provides the admission control of the inference routes.
+
+A worker admits at most a concurrency limit of inference requests at a
+time, the evaluations and the prediction API batches, from the request
+until their inference is done. A request over the limit waits for a
+slot at most ADMISSION_MAX_WAIT seconds, and is then shed with a fast
+503 and a Retry-After, rather than queued in gunicorn until it times
+out. The light routes, the pages, the login and the static files, are
+not guarded and are served whatever the inference load.
+
+A worker only runs WEB_THREADS request threads, the requests beyond
+them wait in the gunicorn backlog, unseen by the worker. The inference
+requests holding a request thread are therefore bounded by the threads
+less ADMISSION_RESERVED_THREADS, whatever the adaptive limit: a reserved
+thread keeps draining the backlog, shedding the inference requests and
+serving the light routes, rather than the backlog growing until the
+requests time out.
+
+The wait of a request in the backlog is measured from the
+X-Request-Start header of the proxy, 't=<epoch>' in seconds,
+milliseconds or microseconds. A request which waited longer than
+ADMISSION_MAX_BACKLOG_WAIT is shed at once, its client is likely gone or
+about to retry. A request whose inference timed out, the model server
+overloaded, is shed as well.
+
+The limit adapts to the latency of the admitted requests, additive
+increase and multiplicative decrease: it grows while the requests use
+all the slots within the target latency, and shrinks when a request
+takes longer.
+
+    @bp.route('/api/v1/predict', methods=['POST'])
+    @admission.guard()
+    def predict():
+        ...
+
+A view whose inference outlives the request, a background evaluation
+or a streamed response, detaches the permit of the request, and
+releases it once the inference is done. A background evaluation frees
+the request thread, its permit no longer counts against the threads.
+
+The module contains the following classes:
+    - AdmissionController: Adaptive admission control of a worker
+
+Properties:
+    admission: AdmissionController object
+"""
+
+import functools
+import math
+import threading
+import time
+
+from flask import flash, g, jsonify, render_template, request
+
+from app.ml.metrics import metrics
+from app.web.settings import settings
+
+# Limit decrease factor on a slow request
+_DECREASE = 0.9
+# Smoothing factor of the latency average
+_SMOOTHING = 0.1
+# Largest Retry-After, in seconds
+_MAX_RETRY_AFTER = 30
+# X-Request-Start epochs beyond which the unit is milliseconds, and
+# microseconds
+_EPOCH_MS = 1e11
+_EPOCH_US = 1e14
+
+
+class _Permit:
+    """ Admission of a request, released once its inference is done """
+
+    __slots__ = ('controller', 'start', 'released', 'attached')
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.start = time.perf_counter()
+        self.released = False
+        # The inference holds a request thread
+        self.attached = True
+
+    def free_thread(self):
+        if self.attached and not self.released:
+            self.attached = False
+            self.controller._free_thread()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(
+                time.perf_counter() - self.start, self.attached)
+
+
+class _NullPermit:
+    """ Permit of a request not guarded """
+
+    def free_thread(self):
+        pass
+
+    def release(self):
+        pass
+
+
+_NULL_PERMIT = _NullPermit()
+
+
+class AdmissionController:
+    """
+    Adaptive admission control of a worker.
+
+    Attributes:
+      enabled: (bool) the inference routes are guarded
+      limit: (float) concurrency limit, the admitted requests are its
+        integer part
+      min_limit: (int) lowest limit
+      max_limit: (int) highest limit
+      target_latency: (float) seconds of an admitted request, beyond
+        which the limit is decreased
+      max_wait: (float) seconds a request waits for a slot
+      max_threads: (int) admitted requests holding a request thread
+      max_backlog_wait: (float) seconds a request waited in the gunicorn
+        backlog, beyond which it is shed
+      in_flight: (int) admitted requests
+      threads_in_use: (int) admitted requests holding a request thread
+      latency: (float) smoothed latency of the admitted requests
+
+    Methods:
+      acquire: Admit a request, or shed it
+      guard: Decorate a view with the admission control
+      detach: Take over the permit of the request
+      retry_after: Return the seconds a shed request should wait
+    """
+
+    def __init__(self, enabled=True, initial_limit=8, min_limit=2,
+                 max_limit=64, target_latency=1.0, max_wait=0.05,
+                 threads=2, reserved_threads=1, max_backlog_wait=2.0):
+
+        self.enabled = enabled
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial_limit, min_limit), max_limit))
+        self.target_latency = target_latency
+        self.max_wait = max_wait
+        self.max_threads = max(1, threads - reserved_threads)
+        self.max_backlog_wait = max_backlog_wait
+
+        self.in_flight = 0
+        self.threads_in_use = 0
+        self.latency = None
+
+        self._decreased = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, route) -> _Permit | None:
+        """
+        Admit a request, waiting at most max_wait for a slot.
+
+        Args:
+          route: (str) route of the request
+
+        Returns:
+          _Permit: permit of the request, None when it is shed
+        """
+
+        start = time.perf_counter()
+        deadline = start + self.max_wait
+
+        with self._cond:
+            while self.in_flight >= int(self.limit) or \
+                    self.threads_in_use >= self.max_threads:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    metrics.inc('admission_shed_total', route=route)
+                    return None
+                self._cond.wait(remaining)
+            self.in_flight += 1
+            self.threads_in_use += 1
+            in_flight = self.in_flight
+
+        metrics.observe(
+            'admission_queue_seconds', time.perf_counter() - start,
+            route=route)
+        metrics.set('admission_in_flight', in_flight)
+        return _Permit(self)
+
+    def guard(self, methods=('POST',)):
+        """
+        Decorate a view with the admission control. The permit is held
+        until the view returns, unless the view detaches it.
+
+        Args:
+          methods: (tuple) request methods guarded, e.g. not the GET of
+            a form
+
+        Returns:
+          callable: the view decorator
+        """
+
+        def decorator(view):
+
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or request.method not in methods:
+                    return view(*args, **kwargs)
+
+                backlog_wait = _backlog_wait()
+                if backlog_wait is not None:
+                    metrics.observe(
+                        'admission_backlog_seconds', backlog_wait,
+                        route=request.endpoint)
+                    if backlog_wait > self.max_backlog_wait:
+                        metrics.inc(
+                            'admission_shed_total', route=request.endpoint)
+                        return self._shed()
+
+                permit = self.acquire(request.endpoint)
+                if permit is None:
+                    return self._shed()
+
+                g.admission_permit = permit
+                try:
+                    return view(*args, **kwargs)
+                except TimeoutError:
+                    # The inference backend is overloaded
+                    metrics.inc(
+                        'admission_shed_total', route=request.endpoint)
+                    return self._shed()
+                finally:
+                    g.pop('admission_permit', _NULL_PERMIT).release()
+
+            return wrapper
+
+        return decorator
+
+    def detach(self, background=False):
+        """
+        Take over the permit of the request, to release it when the
+        inference is done.
+
+        Args:
+          background: (bool) the inference runs in the background, it
+            no longer holds the request thread, e.g. an evaluation. A
+            streamed response holds the thread until it is closed
+
+        Returns:
+          permit: the permit, a no-op permit when the request is not
+            guarded
+        """
+        permit = g.pop('admission_permit', _NULL_PERMIT)
+        if background:
+            permit.free_thread()
+        return permit
+
+    def retry_after(self) -> int:
+        """
+        Return the seconds a shed request should wait, the time to serve
+        the requests in flight.
+
+        Returns:
+          int: seconds
+        """
+
+        latency = self.latency or self.target_latency
+        rounds = max(1, self.in_flight) / max(1, int(self.limit))
+        return max(1, min(_MAX_RETRY_AFTER, math.ceil(latency * rounds)))
+
+    def _free_thread(self):
+
+        with self._cond:
+            self.threads_in_use -= 1
+            self._cond.notify()
+
+    def _release(self, latency, attached):
+
+        with self._cond:
+            saturated = self.in_flight >= int(self.limit)
+            self.in_flight -= 1
+            if attached:
+                self.threads_in_use -= 1
+
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += _SMOOTHING * (latency - self.latency)
+
+            now = time.monotonic()
+            if latency > self.target_latency:
+                # The requests in flight saw the same overload, the limit
+                # is decreased once per target latency
+                if now - self._decreased >= self.target_latency:
+                    self.limit = max(self.min_limit, self.limit * _DECREASE)
+                    self._decreased = now
+            elif saturated:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self._cond.notify()
+            limit, in_flight = self.limit, self.in_flight
+
+        metrics.set('admission_limit', limit)
+        metrics.set('admission_in_flight', in_flight)
+
+    def _shed(self):
+        """ Fast 503 response of a shed request """
+
+        retry_after = self.retry_after()
+        message = 'The service is busy. Please try again.'
+
+        if request.blueprint == 'api':
+            response = jsonify({'error': message, 'retry_after': retry_after})
+        else:
+            flash(message, 'danger')
+            response = render_template('error.html')
+
+        return response, 503, {'Retry-After': str(retry_after)}
+
+
+def _backlog_wait():
+    """
+    Seconds the request waited before a request thread picked it up,
+    from the X-Request-Start header of the proxy, None without it.
+    """
+
+    value = request.headers.get('X-Request-Start', '')
+    try:
+        start = float(value[2:] if value.startswith('t=') else value)
+    except ValueError:
+        return None
+
+    if start > _EPOCH_US:
+        start /= 1e6
+    elif start > _EPOCH_MS:
+        start /= 1e3
+    return max(0.0, time.time() - start)
+
+
+admission = AdmissionController(
+    enabled=settings.ADMISSION_ENABLED,
+    initial_limit=settings.ADMISSION_INITIAL_LIMIT,
+    min_limit=settings.ADMISSION_MIN_LIMIT,
+    max_limit=settings.ADMISSION_MAX_LIMIT,
+    target_latency=settings.ADMISSION_TARGET_LATENCY,
+    max_wait=settings.ADMISSION_MAX_WAIT,
+    threads=settings.WEB_THREADS,
+    reserved_threads=settings.ADMISSION_RESERVED_THREADS,
+    max_backlog_wait=settings.ADMISSION_MAX_BACKLOG_WAIT
+)
@@ -10,9 +10,11 @@ from flask import Flask, request, redirect
 from flask_talisman import Talisman
 from flask_login import current_user
 
-from app.web.routes import main, auth
+from app.web.routes import main, auth, metrics, api
 from app.web.settings import settings
 from app.web.extensions import jwt, login_manager, limiter
+from app.web.metrics import init_metrics
+from app.ml.metrics import metrics as registry
 from app.web.models.user import User
 
 from loguru import logger
@@ -52,7 +54,8 @@ def init_app_configs(app):
     app.config['SECRET_KEY'] = settings.SECRET_KEY
     app.config['JWT_SECRET_KEY'] = settings.JWT_SECRET_KEY
     app.config['JWT_COOKIE_SECURE'] = settings.JWT_COOKIE_SECURE
-    app.config['JWT_TOKEN_LOCATION'] = ['cookies']
+    # Cookies for the pages, the Authorization header for the API
+    app.config['JWT_TOKEN_LOCATION'] = ['cookies', 'headers']
     app.config['JWT_ACCESS_COOKIE_NAME'] = 'access_token'
     # Disable CSRF protection for now
     app.config['JWT_COOKIE_CSRF_PROTECT'] = False
@@ -83,17 +86,23 @@ def init_middleware_callbacks(app, failback_page='auth.home'):
         app (Flask): The Flask application instance.
     """
 
+    def failback(message):
+        # The API clients are not redirected to a page
+        if request.blueprint == api.bp.name:
+            return jsonify({'error': message}), 401
+        return redirect(url_for(failback_page))
+
     @jwt.expired_token_loader
     def expired_token_callback(jwt_header, jwt_payload):
-        return redirect(url_for(failback_page))
+        return failback('Token has expired')
 
     @jwt.invalid_token_loader
     def invalid_token_callback(error):
-        return redirect(url_for(failback_page))
+        return failback(error)
 
     @jwt.unauthorized_loader
     def missing_token_callback(error):
-        return redirect(url_for(failback_page))
+        return failback(error)
 
     @login_manager.user_loader
     def load_user(user_id):
@@ -170,6 +179,14 @@ def create_app(db, jwt, limiter, oauth, csrf):
     # Register blueprints
     app.register_blueprint(main.bp)
     app.register_blueprint(auth.bp)
+    # The API is authenticated by the Authorization header, not cookies
+    csrf.exempt(api.bp)
+    app.register_blueprint(api.bp)
+    if registry.enabled:
+        app.register_blueprint(metrics.bp)
+
+    # Request latency and in-flight metrics
+    init_metrics(app)
 
     with app.app_context():
         db.create_all()
@@ -0,0 +1,119 @@
+"""
+This module provides the background evaluation pool of the web workers.
+
+The evaluation form is validated by the request thread, which queues
+the evaluation, its inference, chart and database writes, and redirects
+to the report page at once. The report page waits for the evaluation,
+so the request threads of the worker are not held by a slow inference,
+e.g. the GCP backend.
+
+The pool is bounded: EVALUATION_WORKERS threads run the evaluations,
+and at most EVALUATION_QUEUE_SIZE evaluations are queued or running,
+beyond which the evaluations are refused rather than queued for longer
+than a user waits. The threads of the pool are started by the worker
+process, on its first evaluation, as gunicorn forks the workers.
+
+The module contains the following classes:
+    - EvaluationQueueFull: The evaluation pool is full
+    - EvaluationPool: Bounded background evaluation pool
+
+Properties:
+    evaluation_pool: EvaluationPool object
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+from app.ml.metrics import metrics
+from app.web.settings import settings
+
+
+class EvaluationQueueFull(RuntimeError):
+    """ The evaluation pool is full """
+
+
+class EvaluationPool:
+    """
+    Bounded background evaluation pool.
+
+    Attributes:
+      workers: (int) threads running the evaluations
+      queue_size: (int) evaluations queued or running, at most
+
+    Methods:
+      submit: Queue an evaluation
+    """
+
+    def __init__(self, workers=4, queue_size=64):
+
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """
+        Queue an evaluation.
+
+        Args:
+          fn: (callable) evaluation
+          args: arguments of the evaluation
+
+        Returns:
+          concurrent.futures.Future: the evaluation future
+
+        Raises:
+          EvaluationQueueFull: the pool is full
+        """
+
+        if not self._slots.acquire(blocking=False):
+            metrics.inc('evaluations_refused_total')
+            raise EvaluationQueueFull('The evaluation pool is full.')
+
+        try:
+            future = self._pool().submit(
+                self._run, fn, time.perf_counter(), *args)
+        except Exception:
+            self._slots.release()
+            raise
+
+        metrics.add('evaluations_in_flight', 1)
+        return future
+
+    def _run(self, fn, queued, *args):
+
+        metrics.observe(
+            'inference_stage_seconds', time.perf_counter() - queued,
+            stage='evaluation_queue')
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f'Evaluation error: {e}')
+        finally:
+            metrics.add('evaluations_in_flight', -1)
+            self._slots.release()
+
+    def _pool(self):
+        """ The thread pool of the process, started on first use """
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers,
+                    thread_name_prefix='evaluation'
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+
+evaluation_pool = EvaluationPool(
+    workers=settings.EVALUATION_WORKERS,
+    queue_size=settings.EVALUATION_QUEUE_SIZE
+)
@@ -23,6 +23,7 @@ Properties:
     ttl_cache: TTLCache object
 """
 
+import threading
 import uuid
 # TODO: Use redis for caching in production
 from cachetools import TTLCache
@@ -52,6 +53,8 @@ login_manager = LoginManager()
 CACHE_TTL = 60 * 30  # 30 minutes
 CACHE_MAXSIZE = 1000
 ttl_cache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+# The cache is not thread-safe, every access holds the lock
+_cache_lock = threading.Lock()
 
 
 def cache_push(data: dict) -> str:
@@ -64,7 +67,8 @@ def cache_push(data: dict) -> str:
         str: The key to retrieve the data from the cache.
     """
     key = str(uuid.uuid4())
-    ttl_cache[key] = data
+    with _cache_lock:
+        ttl_cache[key] = data
     return key
 
 
@@ -77,9 +81,8 @@ def cache_get(key: str) -> dict:
     Returns:
         dict: The data from the cache.
     """
-    if key not in ttl_cache:
-        return None
-    return ttl_cache[key]
+    with _cache_lock:
+        return ttl_cache.get(key)
 
 
 def cache_pop(key: str) -> dict:
@@ -91,6 +94,5 @@ def cache_pop(key: str) -> dict:
     Returns:
         dict: The data from the cache.
     """
-    if key not in ttl_cache:
-        return None
-    return ttl_cache.pop(key)
+    with _cache_lock:
+        return ttl_cache.pop(key, None)
@@ -0,0 +1,452 @@
+"""
+This module provides the scoring jobs, the batches of surveys uploaded
+as a CSV file and scored in the background by the job workers.
+
+A job is a directory of the jobs path:
+
+    <job id>/job.json           state of the job, see ScoringJobs.get
+    <job id>/job.lock           locked by the worker scoring the job
+    <job id>/input_00000.npy    answer codes of a chunk of surveys
+    <job id>/output_00000.npy   class probabilities of a scored chunk
+    <job id>/results.csv        predictions of the job, once done
+
+The upload is parsed as a stream, a chunk of surveys at a time, into
+the input files of a hidden directory, moved into the queue once the
+upload is complete. The job workers, python -m app.model_jobs_main, run
+apart from the web workers, niced and given their own share of the
+cores, so the jobs do not compete with the interactive predictions.
+
+A worker locks the job it scores, and scores the chunks without an
+output file. A job interrupted by a worker restart is resumed from its
+last scored chunk, by the first worker to lock it.
+
+The module contains the following classes:
+    - JobError: Invalid scoring job upload
+    - ScoringJobs: Queue of the scoring jobs
+    - JobWorker: Worker scoring the jobs of the queue
+
+Properties:
+    scoring_jobs: ScoringJobs object
+"""
+
+import csv
+import fcntl
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import List
+
+import numpy as np
+from loguru import logger
+from pydantic import TypeAdapter, ValidationError
+
+from app.ml.model.model_inference import EXPECTED_FEATURE_ORDER
+from app.ml.model.model_inference import PREDICTION_CLASSES
+from app.ml.model.model_inference import ModelInferenceService
+from app.ml.model.schema.ml_features import MlModelFeatures
+from app.ml.model.sidecar import encode_records
+from app.web.settings import settings
+
+_JOB_ID = re.compile(r'[0-9a-f]{32}')
+_STATE_FILE = 'job.json'
+_LOCK_FILE = 'job.lock'
+_RESULTS_FILE = 'results.csv'
+
+_surveys = TypeAdapter(List[MlModelFeatures])
+
+
+class JobError(ValueError):
+    """ Invalid scoring job upload """
+
+
+class ScoringJobs:
+    """
+    Queue of the scoring jobs.
+
+    Attributes:
+      path: (str) directory of the jobs
+      chunk_rows: (int) surveys of a chunk
+      retention: (int) seconds a finished job is kept
+
+    Methods:
+      create: Create a job from a CSV upload
+      get: Return the state of a job
+      results_path: Return the results file of a job
+      pending: Return the jobs to score, oldest first
+      remove_expired: Remove the expired jobs
+    """
+
+    def __init__(self, path, chunk_rows=5_000, retention=7 * 24 * 3600):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self.retention = retention
+
+    def create(self, stream, user) -> dict:
+        """
+        Create a job from a CSV upload, parsed as a stream. The CSV header
+        names the survey fields, the other columns are ignored.
+
+        Args:
+          stream: (io.RawIOBase) binary stream of the CSV file
+          user: (str) owner of the job
+
+        Returns:
+          dict: state of the job
+
+        Raises:
+          JobError: the upload is not a valid CSV file of surveys
+        """
+
+        job_id = uuid.uuid4().hex
+        staging = os.path.join(self.path, f'.{job_id}')
+        os.makedirs(staging)
+
+        try:
+            rows, chunks = self._write_chunks(stream, staging)
+
+            job = {
+                'id': job_id,
+                'user': user,
+                'status': 'queued',
+                'rows': rows,
+                'chunks': chunks,
+                'created': time.time(),
+                'started': None,
+                'completed': None,
+                'error': None,
+            }
+            _write_state(staging, job)
+            os.rename(staging, self._job_dir(job_id))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        logger.info(f'Scoring job {job_id} queued: {rows} surveys, '
+                    f'{chunks} chunks, uid: {user}')
+        return self.get(job_id)
+
+    def get(self, job_id) -> dict | None:
+        """
+        Return the state of a job, and its progress.
+
+        Args:
+          job_id: (str) job id
+
+        Returns:
+          dict: state of the job, None when the job does not exist
+        """
+
+        if not _JOB_ID.fullmatch(job_id or ''):
+            return None
+
+        job = _read_state(self._job_dir(job_id))
+        if job is None:
+            return None
+
+        done = job['chunks'] if job['status'] == 'done' else len(
+            _chunk_files(self._job_dir(job_id), 'output'))
+        job['chunks_done'] = done
+        job['progress'] = done / job['chunks']
+        return job
+
+    def results_path(self, job_id) -> str:
+        """
+        Return the results file of a job.
+
+        Args:
+          job_id: (str) job id
+
+        Returns:
+          str: path of the results CSV file
+        """
+        return os.path.join(self._job_dir(job_id), _RESULTS_FILE)
+
+    def pending(self) -> list:
+        """
+        Return the jobs to score, queued or interrupted, oldest first.
+
+        Returns:
+          list: job ids
+        """
+
+        jobs = []
+        for name in _list_dir(self.path):
+            if not _JOB_ID.fullmatch(name):
+                continue
+            job = _read_state(self._job_dir(name))
+            if job and job['status'] in ('queued', 'running'):
+                jobs.append((job['created'], name))
+
+        return [name for _, name in sorted(jobs)]
+
+    def remove_expired(self):
+        """
+        Remove the finished jobs older than the retention, and the
+        uploads abandoned in the staging directories.
+        """
+
+        expiry = time.time() - self.retention
+        for name in _list_dir(self.path):
+            job_dir = os.path.join(self.path, name)
+            job = _read_state(job_dir)
+            if job is None:
+                try:
+                    finished = os.path.getmtime(job_dir)
+                except OSError:
+                    continue
+            elif job['status'] in ('done', 'failed'):
+                finished = job['completed']
+            else:
+                continue
+
+            if finished < expiry:
+                logger.info(f'Removing expired scoring job {name}')
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.path, job_id)
+
+    def _write_chunks(self, stream, staging):
+        """ Parse the CSV stream into the input files of the chunks """
+
+        try:
+            reader = csv.reader(io.TextIOWrapper(
+                stream, encoding='utf-8-sig', newline=''))
+            header = next(reader, None)
+            if not header:
+                raise JobError('The CSV file is empty.')
+
+            fields = [name.strip().lower() for name in header]
+            missing = [f for f in EXPECTED_FEATURE_ORDER if f not in fields]
+            if missing:
+                raise JobError(f'Missing columns: {", ".join(missing)}')
+            columns = [fields.index(f) for f in EXPECTED_FEATURE_ORDER]
+
+            rows = chunks = 0
+            lines = (line for line in reader if line)
+            for chunk in itertools.batched(lines, self.chunk_rows):
+                records = [
+                    {field: line[c] if c < len(line) else None
+                     for field, c in zip(EXPECTED_FEATURE_ORDER, columns)}
+                    for line in chunk
+                ]
+                try:
+                    surveys = _surveys.validate_python(records)
+                except ValidationError as e:
+                    raise JobError(_invalid_surveys(e, rows))
+
+                codes = encode_records(
+                    [survey.model_dump() for survey in surveys],
+                    EXPECTED_FEATURE_ORDER)
+                np.save(_chunk_path(staging, 'input', chunks), codes)
+                rows += len(chunk)
+                chunks += 1
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise JobError(f'Invalid CSV file: {e}')
+
+        if rows == 0:
+            raise JobError('The CSV file has no surveys.')
+
+        return rows, chunks
+
+
+class JobWorker:
+    """
+    Worker scoring the jobs of the queue.
+
+    Attributes:
+      jobs: (ScoringJobs) queue of the jobs
+      poll_interval: (float) seconds between the queue scans
+
+    Methods:
+      run: Score the jobs until stopped
+      score: Score a job, when no other worker does
+    """
+
+    def __init__(self, jobs, poll_interval=1.0):
+        self.jobs = jobs
+        self.poll_interval = poll_interval
+        self.service = ModelInferenceService()
+
+    def run(self, stop):
+        """
+        Score the jobs until stopped. A stopped worker finishes the chunk
+        it scores, the job is resumed from the next one.
+
+        Args:
+          stop: (threading.Event) set to stop the worker
+        """
+
+        logger.info(f'Job worker {os.getpid()} scoring {self.jobs.path}')
+        while not stop.is_set():
+            self.jobs.remove_expired()
+            for job_id in self.jobs.pending():
+                if stop.is_set():
+                    break
+                self.score(job_id, stop)
+            stop.wait(self.poll_interval)
+
+    def score(self, job_id, stop=None):
+        """
+        Score a job, when no other worker does.
+
+        Args:
+          job_id: (str) job id
+          stop: (threading.Event) set to stop scoring after a chunk
+        """
+
+        job_dir = os.path.join(self.jobs.path, job_id)
+        with _locked(job_dir) as locked:
+            if not locked:
+                return
+
+            # Read again, the job may be finished since it was listed
+            job = _read_state(job_dir)
+            if job is None or job['status'] not in ('queued', 'running'):
+                return
+
+            if job['status'] == 'running':
+                logger.info(f'Resuming scoring job {job_id}')
+            job.update(
+                status='running', started=job['started'] or time.time())
+            _write_state(job_dir, job)
+
+            try:
+                for chunk in range(job['chunks']):
+                    if stop is not None and stop.is_set():
+                        return
+                    self._score_chunk(job_dir, chunk)
+
+                _write_results(job_dir, job['chunks'])
+                for kind in ('input', 'output'):
+                    for path in _chunk_files(job_dir, kind):
+                        os.remove(path)
+                job.update(status='done', completed=time.time())
+                logger.info(f'Scoring job {job_id} done: '
+                            f'{job["rows"]} surveys')
+            except Exception as e:
+                logger.error(f'Scoring job {job_id} failed: {e}')
+                job.update(status='failed', completed=time.time(),
+                           error=str(e))
+
+            _write_state(job_dir, job)
+
+    def _score_chunk(self, job_dir, chunk):
+
+        output = _chunk_path(job_dir, 'output', chunk)
+        if os.path.exists(output):
+            return
+
+        # A chunk is an offline batch, predicted with the batch threads
+        # of the worker, whatever the chunk size
+        codes = np.load(_chunk_path(job_dir, 'input', chunk))
+        probabilities = self.service.predict_codes(codes, batch=True)
+
+        # Written whole, a restart scores the chunk again
+        np.save(f'{output}.tmp.npy', probabilities)
+        os.replace(f'{output}.tmp.npy', output)
+
+
+def _write_results(job_dir, chunks):
+    """ Write the predictions of the scored chunks as a CSV file """
+
+    path = os.path.join(job_dir, _RESULTS_FILE)
+    with open(f'{path}.tmp', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['row', 'prediction'] + PREDICTION_CLASSES)
+
+        row = 1
+        for chunk in range(chunks):
+            probabilities = np.load(_chunk_path(job_dir, 'output', chunk))
+            labels = np.argmax(probabilities, axis=1).tolist()
+            values = np.round(probabilities.astype(np.float64), 6).tolist()
+            writer.writerows(
+                [row + i, PREDICTION_CLASSES[label]] + probs
+                for i, (label, probs) in enumerate(zip(labels, values))
+            )
+            row += len(labels)
+
+    os.replace(f'{path}.tmp', path)
+
+
+@contextmanager
+def _locked(job_dir):
+    """ Lock a job, yield whether the lock was acquired """
+
+    try:
+        f = open(os.path.join(job_dir, _LOCK_FILE), 'a')
+    except OSError:
+        # The job was removed
+        yield False
+        return
+
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        yield False
+        return
+
+    # The lock is released when the file is closed, or the worker dies
+    try:
+        yield True
+    finally:
+        f.close()
+
+
+def _read_state(job_dir):
+    try:
+        with open(os.path.join(job_dir, _STATE_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_state(job_dir, job):
+    path = os.path.join(job_dir, _STATE_FILE)
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(job, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def _chunk_path(job_dir, kind, chunk):
+    return os.path.join(job_dir, f'{kind}_{chunk:05d}.npy')
+
+
+def _chunk_files(job_dir, kind):
+    return [
+        os.path.join(job_dir, name) for name in _list_dir(job_dir)
+        if re.fullmatch(rf'{kind}_\d{{5}}\.npy', name)
+    ]
+
+
+def _list_dir(path):
+    try:
+        return os.listdir(path)
+    except OSError:
+        return []
+
+
+def _invalid_surveys(error, first):
+    """ Describe the first invalid value of a chunk of surveys """
+
+    errors = error.errors(include_url=False, include_context=False,
+                          include_input=False)
+    index, field = errors[0]['loc'][:2]
+    message = f'Survey {first + index + 1}, {field}: {errors[0]["msg"]}'
+    if len(errors) > 1:
+        message += f', and {len(errors) - 1} more invalid values'
+    return message
+
+
+scoring_jobs = ScoringJobs(
+    settings.JOBS_PATH,
+    chunk_rows=settings.JOB_CHUNK_ROWS,
+    retention=settings.JOB_RETENTION
+)
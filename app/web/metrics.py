@@ -0,0 +1,52 @@
+"""
+This module provides the request metrics hooks of the web application,
+recorded into the metrics registry of app.ml.metrics.
+
+Every request but the static files and the metrics scrapes is measured,
+its latency and the in-flight count by endpoint.
+
+The module contains the following functions:
+    - init_metrics: Register the request metrics hooks of the application
+"""
+
+import time
+
+from flask import g, request
+
+from app.ml.metrics import metrics
+
+# Requests not measured
+_SKIPPED_ENDPOINTS = {'static', 'metrics.metrics'}
+
+
+def init_metrics(app):
+    """
+    Register the request metrics hooks of the application: the latency
+    and the in-flight count of every request, by endpoint.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    if not metrics.enabled:
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        if request.endpoint in _SKIPPED_ENDPOINTS:
+            return
+        g.metrics_start = time.perf_counter()
+        g.metrics_endpoint = request.endpoint or 'unknown'
+        metrics.add('http_requests_in_flight', 1, route=g.metrics_endpoint)
+
+    @app.teardown_request
+    def end_request_metrics(exc):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return
+        endpoint = g.pop('metrics_endpoint')
+        metrics.add('http_requests_in_flight', -1, route=endpoint)
+        metrics.observe(
+            'http_request_seconds', time.perf_counter() - start,
+            route=endpoint)
+        metrics.snapshot()
@@ -0,0 +1,97 @@
+"""
+This module contains the EvaluationReport model, the state of the
+evaluations queued by the evaluation page.
+
+The report is stored in the database, shared by the web workers, so the
+report page and its status requests are served by any worker, whichever
+worker runs the evaluation.
+
+Classes:
+    EvaluationReport: The db model of an evaluation report.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+
+from app.web.extensions import db
+from app.web.settings import settings
+
+
+class EvaluationReport(db.Model):
+    """
+    The EvaluationReport class defines the db model of an evaluation
+    report, pending until the evaluation is done or failed.
+
+    Attributes:
+        key: The report key, of the report page URL.
+        user_id: The id of the user.
+        status: The evaluation status, pending, done or failed.
+        answers: The evaluation form answers.
+        data: The prediction report table, once done.
+        chart_url: The prediction chart, once done.
+        created: The creation date of the report.
+
+    Methods:
+        create: Create the pending report of an evaluation.
+        find: Return the report of a user, unless expired.
+        remove_expired: Remove the expired reports.
+        current_status: Return the status, failed when the evaluation
+            was lost.
+    """
+    __tablename__ = 'evaluation_reports'
+
+    key = db.Column(db.String(36), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey(
+        'app_user.id'), nullable=False)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    answers = db.Column(db.JSON, nullable=False)
+    data = db.Column(db.JSON, nullable=True)
+    chart_url = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    @classmethod
+    def create(cls, user_id: int, answers: dict) -> 'EvaluationReport':
+        """Create and commit the pending report of an evaluation."""
+        cls.remove_expired()
+        report = cls(
+            key=str(uuid.uuid4()),
+            user_id=user_id,
+            status='pending',
+            answers=answers
+        )
+        db.session.add(report)
+        db.session.commit()
+        return report
+
+    @classmethod
+    def find(cls, key: str, user_id: int = None) -> 'EvaluationReport':
+        """Return the report, None when expired or of another user."""
+        if not key:
+            return None
+        report = db.session.get(cls, key)
+        if report is None or report.created < _expiry():
+            return None
+        if user_id is not None and report.user_id != user_id:
+            return None
+        return report
+
+    @classmethod
+    def remove_expired(cls):
+        """Remove the reports older than REPORT_TTL."""
+        cls.query.filter(cls.created < _expiry()).delete()
+
+    def current_status(self) -> str:
+        """
+        Return the status of the report. A report pending for longer than
+        EVALUATION_TIMEOUT is failed, its evaluation was lost, e.g. the
+        worker running it was restarted.
+        """
+        timeout = timedelta(seconds=settings.EVALUATION_TIMEOUT)
+        if self.status == 'pending' and \
+                self.created < datetime.now() - timeout:
+            return 'failed'
+        return self.status
+
+
+def _expiry():
+    return datetime.now() - timedelta(seconds=settings.REPORT_TTL)
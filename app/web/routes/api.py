@@ -0,0 +1,325 @@
+"""
+This module contains the prediction API routes, the JSON entry points of
+the partner integrations.
+
+The API is authenticated by a JWT access token in the Authorization
+header, and exempt from the CSRF protection of the forms. A request is a
+batch of surveys, validated against MlModelFeatures and scored in a
+single prediction:
+
+    POST /api/v1/predict
+    Authorization: Bearer <access token>
+
+    {"instances": [{"poorhlth": 88, "physhlth": 88, ...}, ...]}
+
+The response is a JSON document of the predictions. When the client
+accepts application/x-ndjson, or the batch is larger than
+API_STREAM_ROWS, the predictions are streamed instead, a JSON line per
+survey, predicted in chunks of API_STREAM_ROWS surveys.
+
+The batch size is limited by API_MAX_BATCH_ROWS, and by the surveys that
+fit in MAX_CONTENT_LENGTH. Larger batches are uploaded as a CSV file,
+scored in the background by a scoring job, see app.web.jobs:
+
+    POST /api/v1/jobs                   CSV upload, returns the job
+    GET  /api/v1/jobs/<job id>          state and progress of the job
+    GET  /api/v1/jobs/<job id>/results  predictions, as a CSV file
+
+Entry points:
+    - token: Create the access token of a user.
+    - predict: Predict a batch of surveys.
+    - create_job: Create a scoring job from a CSV upload.
+    - job: Return the state of a scoring job.
+    - job_results: Download the predictions of a scoring job.
+"""
+
+import json
+from typing import Annotated, List
+
+import numpy as np
+from loguru import logger
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+
+from flask import Blueprint, Response, jsonify, request, send_file
+from flask import url_for
+from flask_jwt_extended import create_access_token, get_jwt_identity
+from flask_jwt_extended import jwt_required
+
+from app.ml.model.model_inference import EXPECTED_FEATURE_ORDER
+from app.ml.model.model_inference import PREDICTION_CLASSES
+from app.ml.model.model_inference import ModelInferenceService
+from app.ml.model.schema.ml_features import MlModelFeatures
+from app.web.admission import admission
+from app.web.extensions import limiter
+from app.web.jobs import JobError, scoring_jobs
+from app.ml.metrics import metrics
+from app.web.models.user import User
+from app.web.settings import settings
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+NDJSON = 'application/x-ndjson'
+
+# Smallest survey of a request, every answer code a single digit
+_MIN_SURVEY_BYTES = len(json.dumps(
+    {field: 0 for field in EXPECTED_FEATURE_ORDER}, separators=(',', ':')))
+
+# Largest batch of a request
+MAX_BATCH_ROWS = max(1, min(
+    settings.API_MAX_BATCH_ROWS,
+    settings.MAX_CONTENT_LENGTH // _MIN_SURVEY_BYTES
+))
+
+# Validation errors returned to the client
+_MAX_ERRORS = 20
+
+
+class TokenRequest(BaseModel):
+    """ Credentials of an access token request """
+    username: str
+    password: str
+
+
+class PredictRequest(BaseModel):
+    """ Batch of surveys of a prediction request """
+    instances: Annotated[
+        List[MlModelFeatures],
+        Field(min_length=1, max_length=MAX_BATCH_ROWS)
+    ]
+
+
+_token_request = TypeAdapter(TokenRequest)
+_predict_request = TypeAdapter(PredictRequest)
+
+
+@bp.route('/token', methods=['POST'])
+@limiter.limit("10 per minute")
+def token():
+    """
+    Create the access token of a user, from the username, or email, and
+    password in the request body.
+
+    Returns:
+        400: If the request body is invalid.
+        401: If the username or password are invalid.
+        200: The access token.
+    """
+
+    try:
+        credentials = _token_request.validate_json(request.get_data())
+    except ValidationError as e:
+        return _validation_error(e)
+
+    user = User.query.filter_by(username=credentials.username).first()
+    if not user:
+        # User may have registered with email
+        user = User.query.filter_by(email=credentials.username).first()
+    if not user or not user.check_password(credentials.password):
+        logger.warning(f'API token denied: addr: {request.remote_addr}')
+        return jsonify({'error': 'Invalid username or password'}), 401
+
+    return jsonify({
+        'access_token': create_access_token(identity=user.username),
+        'token_type': 'Bearer',
+    })
+
+
+@bp.route('/predict', methods=['POST'])
+@limiter.limit("100 per minute")
+@jwt_required(locations=['headers'])
+@admission.guard()
+def predict():
+    """
+    Predict a batch of surveys.
+
+    Returns:
+        400: If the request body is not a valid batch of surveys.
+        413: If the request body is larger than MAX_CONTENT_LENGTH.
+        200: The predictions, as JSON or as NDJSON.
+    """
+
+    with metrics.timer('api_validate'):
+        try:
+            batch = _predict_request.validate_json(request.get_data())
+        except ValidationError as e:
+            return _validation_error(e)
+        records = [instance.model_dump() for instance in batch.instances]
+
+    logger.debug(
+        f'API prediction: addr: {request.remote_addr}, '
+        f'uid: {get_jwt_identity()}, {len(records)} surveys'
+    )
+
+    service = ModelInferenceService()
+    stream = NDJSON in request.accept_mimetypes.values() or \
+        len(records) > settings.API_STREAM_ROWS
+
+    if stream:
+        # The request is admitted until the stream is closed
+        response = Response(
+            _stream_predictions(service, records), mimetype=NDJSON)
+        response.call_on_close(admission.detach().release)
+        return response
+
+    with metrics.timer('inference'):
+        probabilities = service.predict(records)
+
+    with metrics.timer('api_serialize'):
+        predictions = [
+            {'prediction': PREDICTION_CLASSES[label], 'probabilities': row}
+            for label, row in zip(
+                np.argmax(probabilities, axis=1).tolist(),
+                _rounded(probabilities))
+        ]
+
+    return jsonify({
+        'classes': PREDICTION_CLASSES,
+        'predictions': predictions,
+    })
+
+
+@bp.route('/jobs', methods=['POST'])
+@limiter.limit("10 per minute")
+@jwt_required(locations=['headers'])
+def create_job():
+    """
+    Create a scoring job from a CSV upload, the request body, or the
+    'file' field of a multipart form. The upload is parsed as a stream.
+
+    Returns:
+        400: If the upload is not a valid CSV file of surveys.
+        413: If the upload is larger than JOB_MAX_CONTENT_LENGTH.
+        202: The state of the job.
+    """
+
+    # The uploads are larger than the other requests
+    request.max_content_length = settings.JOB_MAX_CONTENT_LENGTH
+
+    if request.mimetype == 'multipart/form-data':
+        upload = request.files.get('file')
+        if upload is None:
+            return jsonify({'error': 'Missing file field'}), 400
+        stream = upload.stream
+    else:
+        stream = request.stream
+
+    try:
+        job = scoring_jobs.create(stream, get_jwt_identity())
+    except JobError as e:
+        return jsonify({'error': str(e)}), 400
+
+    location = url_for('api.job', job_id=job['id'])
+    return jsonify(_job_response(job)), 202, {'Location': location}
+
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+@limiter.limit("100 per minute")
+@jwt_required(locations=['headers'])
+def job(job_id):
+    """
+    Return the state of a scoring job, and its progress.
+
+    Returns:
+        404: If the job does not exist.
+        200: The state of the job.
+    """
+
+    job = _user_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify(_job_response(job))
+
+
+@bp.route('/jobs/<job_id>/results', methods=['GET'])
+@limiter.limit("100 per minute")
+@jwt_required(locations=['headers'])
+def job_results(job_id):
+    """
+    Download the predictions of a scoring job, as a CSV file.
+
+    Returns:
+        404: If the job does not exist.
+        409: If the job is not done.
+        200: The predictions.
+    """
+
+    job = _user_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f'Job is {job["status"]}'}), 409
+
+    return send_file(
+        scoring_jobs.results_path(job_id),
+        mimetype='text/csv',
+        as_attachment=True,
+        download_name=f'predictions_{job_id}.csv'
+    )
+
+
+@bp.errorhandler(413)
+def request_too_large(error):
+    response = {
+        'error': 'Request body too large',
+        'max_content_length': request.max_content_length,
+    }
+    if request.endpoint == 'api.predict':
+        response['max_batch_rows'] = MAX_BATCH_ROWS
+    return jsonify(response), 413
+
+
+def _stream_predictions(service, records):
+    """ Predict the records in chunks, a JSON line per record """
+
+    chunk_rows = settings.API_STREAM_ROWS
+    for first in range(0, len(records), chunk_rows):
+        probabilities = service.predict(records[first:first + chunk_rows])
+        labels = np.argmax(probabilities, axis=1).tolist()
+
+        yield ''.join(
+            json.dumps({
+                'index': first + i,
+                'prediction': PREDICTION_CLASSES[label],
+                'probabilities': row,
+            }) + '\n'
+            for i, (label, row) in enumerate(
+                zip(labels, _rounded(probabilities)))
+        )
+
+
+def _user_job(job_id):
+    """ Job of the authenticated user, None for the jobs of others """
+    job = scoring_jobs.get(job_id)
+    if job is None or job['user'] != get_jwt_identity():
+        return None
+    return job
+
+
+def _job_response(job):
+    """ Public state of a job """
+
+    response = {key: job[key] for key in (
+        'id', 'status', 'rows', 'chunks', 'chunks_done', 'progress',
+        'created', 'started', 'completed', 'error')}
+    if job['status'] == 'done':
+        response['results_url'] = url_for(
+            'api.job_results', job_id=job['id'])
+    return response
+
+
+def _rounded(probabilities):
+    """ Probabilities rounded for the response, as lists """
+    return np.round(np.asarray(probabilities, dtype=np.float64), 6).tolist()
+
+
+def _validation_error(error):
+    """ Bad request response of a validation error """
+
+    errors = error.errors(
+        include_url=False, include_context=False, include_input=False)
+    return jsonify({
+        'error': 'Invalid request',
+        'error_count': len(errors),
+        'details': errors[:_MAX_ERRORS],
+    }), 400
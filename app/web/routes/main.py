@@ -9,11 +9,12 @@ from datetime import datetime
 from loguru import logger
 
 from flask import Blueprint, render_template, request
-from flask import flash, redirect, url_for
+from flask import flash, redirect, url_for, jsonify, current_app
 from flask_jwt_extended import jwt_required
 from flask_jwt_extended import get_jwt_identity
 from flask_login import current_user
 
+from app.web.admission import admission
 from app.web.extensions import limiter
 from app.web.models.mental_health_inference import MentalHealthDbInferenceModel
 from app.web.extensions import db
@@ -24,8 +25,11 @@ from app.web.templates.ui.forms.ml_input_form import process_form
 from app.ml.model.model_inference import ModelInferenceService
 from app.ml.model.model_inference import prediction_report
 from app.web.models.user_inference_log import UserInferenceLog
+from app.web.models.evaluation_report import EvaluationReport
 
-from app.web.extensions import cache_get, cache_push
+from app.web.evaluations import EvaluationQueueFull, evaluation_pool
+from app.ml.metrics import metrics
+from app.web.settings import settings
 
 
 bp = Blueprint('main', __name__)
@@ -47,22 +51,56 @@ def report():
     logger.debug(f'Report request: addr: {request.remote_addr}')
     key = request.args.get('key')
 
-    data = cache_get(key)
-    if data:
-        return render_template(
-            'report.html',
-            form=data['form'],
-            data=data['data'],
-            chart_url=data['chart_url']
-        )
-    else:
+    report = EvaluationReport.find(key, current_user.id)
+    metrics.inc(
+        'report_cache_requests_total', result='hit' if report else 'miss')
+    if not report:
         flash('Report is expired and no longer accessible.', 'danger')
         return redirect(url_for('main.evaluation'))
 
+    status = report.current_status()
+    if status == 'pending':
+        # The page polls the report status, and reloads when ready
+        return render_template(
+            'report_pending.html',
+            status_url=url_for('main.report_status', key=key),
+            evaluation_url=url_for('main.evaluation'),
+            poll_interval=int(settings.EVALUATION_POLL_INTERVAL * 1000)
+        )
+
+    # The form of the answers, showing the user's input
+    form = process_form(MlInputForm(formdata=None, data=report.answers))
+
+    if status == 'failed':
+        _flash_error()
+        return render_template(
+            'evaluation.html',
+            form=form
+        )
+
+    return render_template(
+        'report.html',
+        form=form,
+        data=report.data,
+        chart_url=report.chart_url
+    )
+
+
+@bp.route('/report/status', methods=['GET'])
+@limiter.limit("600 per minute")
+@jwt_required()
+def report_status():
+
+    report = EvaluationReport.find(request.args.get('key'), current_user.id)
+    if not report:
+        return jsonify({'status': 'expired'}), 404
+    return jsonify({'status': report.current_status()})
+
 
 @bp.route('/evaluation', methods=['GET', 'POST'])
 @limiter.limit("100 per minute")
 @jwt_required()
+@admission.guard()
 def evaluation():
 
     user = get_jwt_identity()
@@ -75,69 +113,134 @@ def evaluation():
             f'{request.remote_addr}, uid: {user}',
         )
 
+        filtered_data = {
+            key: value for key, value in form.data.items()
+            if key not in ['submit_button', 'csrf_token']
+        }
+
+        # 1. Queue the evaluation, the report page waits for it.
+        # The report is stored in the database, any worker serves the
+        # report page. The evaluation is admitted until its inference
+        # is done
+        key = EvaluationReport.create(current_user.id, filtered_data).key
+        permit = admission.detach(background=True)
+        try:
+            evaluation_pool.submit(
+                _evaluate,
+                current_app._get_current_object(),
+                key,
+                filtered_data,
+                current_user.id,
+                permit
+            )
+        except EvaluationQueueFull:
+            permit.release()
+            db.session.delete(db.session.get(EvaluationReport, key))
+            db.session.commit()
+            logger.warning(f'Evaluation refused, the pool is full: '
+                           f'addr: {request.remote_addr}, uid: {user}')
+            flash('The service is busy. Please try again.', 'danger')
+            return render_template(
+                'evaluation.html',
+                form=form
+            ), 503
+
+        return redirect(url_for('main.report', key=key))
+
+    logger.debug(f'Evaluation request: addr: {request.remote_addr}')
+    return render_template(
+        'evaluation.html',
+        current_user=current_user,
+        form=form
+    )
+
+
+def _evaluate(app, key, filtered_data, user_id, permit):
+    """
+    Run a queued evaluation, in the evaluation pool, and update its
+    report in the database.
+
+    Args:
+        app (Flask): The Flask application instance.
+        key (str): The cache key of the report.
+        filtered_data (dict): The evaluation form answers.
+        user_id (int): The id of the user.
+        permit: The admission permit of the evaluation.
+    """
+
+    try:
+        _run_evaluation(app, key, filtered_data, user_id)
+    finally:
+        permit.release()
+
+
+def _run_evaluation(app, key, filtered_data, user_id):
+
+    with app.app_context():
+        report = EvaluationReport.find(key)
+        if report is None:
+            # The report expired while queued
+            return
+
         try:
-            # 1. Run inference on this request
+            # 2. Run inference on this request
             model_inference = ModelInferenceService()
             logger.debug('Running model inference...')
 
-            filtered_data = {key: value for key, value in form.data.items() if key not in [
-                'submit_button', 'csrf_token']}
-
-            predictions = model_inference.predict([filtered_data])
+            with metrics.timer('inference'):
+                predictions = model_inference.predict([filtered_data])
             logger.info(f'Prediction results: {predictions}')
 
-            # 2. Generate the report data and chart
-            data, chart_url = prediction_report(predictions[0])
+            # 3. Generate the report data and chart
+            with metrics.timer('prediction_report'):
+                report_data, chart_url = prediction_report(predictions[0])
 
-            # 3. Save the inference data in the db, and log the event
+            # 4. Save the inference data in the db, and log the event
 
             # Save the inference data in the database
             inference = MentalHealthDbInferenceModel()
-            # Automatically assigns matching fields
-            form.populate_obj(inference)
+            # Assigns the matching fields, as the form populate_obj
+            for field, value in filtered_data.items():
+                setattr(inference, field, value)
             db.session.add(inference)
-            db.session.commit()
+            with metrics.timer('db_commit_inference'):
+                db.session.commit()
 
             # Log the inference event
             log = UserInferenceLog(
-                user_id=current_user.id,
+                user_id=user_id,
                 inference_id=inference.id,
-                description=str(data),
+                description=str(report_data),
                 purpose=""
             )
             db.session.add(log)
-            db.session.commit()
+            with metrics.timer('db_commit_log'):
+                db.session.commit()
 
-            # 4. Send the update form to the report template
-            process_form(form)
-            # process_form() did the work for us to update the
-            # form poperties ('selected'), we need
-            # this in the report page to show the user's input
-
-            key = cache_push({
-                'form': form,
-                'data': data,
-                'chart_url': chart_url
-            })
-            return redirect(url_for('main.report', key=key))
+            # 5. Publish the report to the report page
+            report.data = report_data
+            report.chart_url = chart_url
+            report.status = 'done'
+            db.session.commit()
 
         except Exception as e:
             logger.error(f'Model inference error: {e.with_traceback(None)}')
-            # Send a flash message back to the originating page
-            now = datetime.now()
-            msg_date = now.strftime("%A, %b. %d %-I:%M:%S %p")
-            flash(
-                f'{msg_date} - '
-                'Error processing the form. Please try again.', 'danger'
-            )
-            return render_template(
-                'evaluation.html',
-                form=form
-            )
-
-    logger.debug(f'Evaluation request: addr: {request.remote_addr}')
-    return render_template(
-        'evaluation.html',
-        current_user=current_user,
-        form=form
+            db.session.rollback()
+            # The report is failed once pending for EVALUATION_TIMEOUT
+            # when the database is not reachable either
+            try:
+                report.status = 'failed'
+                db.session.commit()
+            except Exception as e:
+                logger.error(f'Error saving the failed report: {e}')
+                db.session.rollback()
+
+
+def _flash_error():
+    """ Send a flash message back to the originating page """
+    now = datetime.now()
+    msg_date = now.strftime("%A, %b. %d %-I:%M:%S %p")
+    flash(
+        f'{msg_date} - '
+        'Error processing the form. Please try again.', 'danger'
     )
@@ -0,0 +1,72 @@
+"""
+This module contains the metrics route, scraped by Prometheus.
+
+The metrics expose the worker pids, the model version and the traffic of
+every route, they are not public. A scrape is served only to the client
+addresses of METRICS_ALLOWED_IPS, and, when METRICS_TOKEN is set, with
+the token as bearer token:
+
+    Authorization: Bearer <METRICS_TOKEN>
+
+The route is exempt from the rate limits, the scrapes of an allowed
+client are never refused.
+
+Entry points:
+    - metrics: Export the metrics of all the workers.
+"""
+
+import hmac
+import ipaddress
+
+from flask import Blueprint, Response, abort, request
+from loguru import logger
+
+from app.web.extensions import limiter
+from app.ml.metrics import metrics as registry
+from app.web.settings import settings
+
+bp = Blueprint('metrics', __name__)
+
+_ALLOWED_NETWORKS = [
+    ipaddress.ip_network(network, strict=False)
+    for network in settings.METRICS_ALLOWED_IPS
+]
+
+
+@bp.route('/metrics', methods=['GET'])
+@limiter.exempt
+def metrics():
+    """
+    Export the metrics of all the workers, to the allowed clients.
+
+    Returns:
+        404: If the client is not allowed.
+        200: The metrics, in the Prometheus text format.
+    """
+
+    if not _allowed():
+        logger.warning(f'Metrics scrape denied: addr: {request.remote_addr}')
+        # Not found rather than forbidden, the route is not advertised
+        abort(404)
+
+    return Response(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def _allowed():
+    """ The client address is allowed, and presents the token if any """
+
+    try:
+        address = ipaddress.ip_address(request.remote_addr or '')
+    except ValueError:
+        return False
+    if not any(address in network for network in _ALLOWED_NETWORKS):
+        return False
+
+    if not settings.METRICS_TOKEN:
+        return True
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(
+        token.encode(), settings.METRICS_TOKEN.encode())
@@ -26,6 +26,48 @@ class Settings(BaseSettings):
         GOOGLE_CLIENT_ID: (str) Google client ID
         GOOGLE_CLIENT_SECRET: (str) Google
         MAX_CONTENT_LENGTH: (int) maximum content length
+        METRICS_ALLOWED_IPS: (list) client addresses or networks allowed
+            to scrape the metrics
+        METRICS_TOKEN: (str) bearer token of the metrics scrapes, not
+            required when empty
+        API_MAX_BATCH_ROWS: (int) surveys of a prediction API request,
+            bounded by the surveys fitting in MAX_CONTENT_LENGTH
+        API_STREAM_ROWS: (int) batch size from which the predictions are
+            streamed as NDJSON, and the surveys predicted per chunk
+        JOBS_PATH: (str) directory of the scoring jobs
+        JOB_MAX_CONTENT_LENGTH: (int) maximum content length of a CSV
+            upload
+        JOB_CHUNK_ROWS: (int) surveys of a chunk of a scoring job
+        JOB_WORKERS: (int) job worker processes
+        JOB_THREADS: (int) cores given to a job worker
+        JOB_NICE: (int) niceness of the job workers
+        JOB_POLL_INTERVAL: (float) seconds between the job queue scans
+        JOB_RETENTION: (int) seconds a finished job is kept
+        EVALUATION_WORKERS: (int) background evaluation threads of a
+            worker
+        EVALUATION_QUEUE_SIZE: (int) evaluations queued or running in a
+            worker, at most
+        EVALUATION_POLL_INTERVAL: (float) seconds between the status
+            requests of a pending report page
+        EVALUATION_TIMEOUT: (int) seconds an evaluation is pending at
+            most, its report is failed beyond
+        REPORT_TTL: (int) seconds an evaluation report is kept
+        ADMISSION_ENABLED: (bool) admission control of the inference
+            routes
+        ADMISSION_INITIAL_LIMIT: (int) initial inference requests of a
+            worker at a time
+        ADMISSION_MIN_LIMIT: (int) lowest adaptive limit
+        ADMISSION_MAX_LIMIT: (int) highest adaptive limit
+        ADMISSION_TARGET_LATENCY: (float) seconds of an inference request
+            beyond which the limit is decreased
+        ADMISSION_MAX_WAIT: (float) seconds a request waits for a slot
+            before it is shed
+        ADMISSION_RESERVED_THREADS: (int) request threads of a worker
+            never held by an inference request
+        ADMISSION_MAX_BACKLOG_WAIT: (float) seconds a request waited in
+            the gunicorn backlog, from the X-Request-Start header, beyond
+            which it is shed
+        WEB_THREADS: (int) gunicorn request threads of a worker
     """
 
     ENV: str
@@ -46,6 +88,38 @@ class Settings(BaseSettings):
     GOOGLE_DISCOVERY_URL: str
     MAX_CONTENT_LENGTH: int
 
+    METRICS_ALLOWED_IPS: list[str] = ['127.0.0.1/32', '::1/128']
+    METRICS_TOKEN: str = ''
+
+    API_MAX_BATCH_ROWS: int = 10_000
+    API_STREAM_ROWS: int = 1_000
+
+    JOBS_PATH: str = '/tmp/ml_mental_health_jobs'
+    JOB_MAX_CONTENT_LENGTH: int = 256 * 1024 * 1024
+    JOB_CHUNK_ROWS: int = 5_000
+    JOB_WORKERS: int = 1
+    JOB_THREADS: int = 1
+    JOB_NICE: int = 10
+    JOB_POLL_INTERVAL: float = 1.0
+    JOB_RETENTION: int = 7 * 24 * 3600
+
+    EVALUATION_WORKERS: int = 4
+    EVALUATION_QUEUE_SIZE: int = 64
+    EVALUATION_POLL_INTERVAL: float = 0.5
+    EVALUATION_TIMEOUT: int = 2 * 60
+    REPORT_TTL: int = 30 * 60
+
+    ADMISSION_ENABLED: bool = True
+    ADMISSION_INITIAL_LIMIT: int = 8
+    ADMISSION_MIN_LIMIT: int = 2
+    ADMISSION_MAX_LIMIT: int = 64
+    ADMISSION_TARGET_LATENCY: float = 1.0
+    ADMISSION_MAX_WAIT: float = 0.05
+    ADMISSION_RESERVED_THREADS: int = 1
+    ADMISSION_MAX_BACKLOG_WAIT: float = 2.0
+
+    WEB_THREADS: int = 2
+
     # Initialize config based on .env file
     model_config = SettingsConfigDict(
         env_file='.env',
@@ -53,7 +127,10 @@ class Settings(BaseSettings):
         extra='ignore'
     )
 
-    @field_validator('MAX_CONTENT_LENGTH', mode='before', check_fields=False)
+    @field_validator(
+        'MAX_CONTENT_LENGTH', 'JOB_MAX_CONTENT_LENGTH',
+        mode='before', check_fields=False
+    )
     def parse_max_content_length(cls, v):
         """
         Convert the max content length to Integer.
@@ -61,6 +138,7 @@ class Settings(BaseSettings):
         """
         if isinstance(v, str):
             return eval(v)
+        return v
 
 
 settings = Settings()
@@ -172,7 +172,7 @@ def create_features() -> MLFeaturesMap:
     feat = MLFeature(
         id='CHECKUP1',
         options={'Less than 1 year': '1', 'Less than 2 years': '2',
-                 '3': 'Less than 5 years', '5+ Years': '4', 'Not Sure': '7',
+                 'Less than 5 years': '3', '5+ Years': '4', 'Not Sure': '7',
                  'Never': '8', 'Refused': '9'},
         label='Length of time since last routine checkup',
         question='About how long has it been since you last visited a '
@@ -0,0 +1,87 @@
+"""
+Benchmark the categorical encoding of the survey answers, the previous
+ordinal answer codes against the native xgboost categorical features:
+training time, model size and inference latency.
+
+Both models are trained with the same parameters on the same synthetic
+survey rows, the encoding is the only difference.
+
+Usage:
+    python -m benchmarks.bench_categorical_encoding --rows 200000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import xgboost as xgb
+from sklearn.metrics import log_loss
+
+from app.ml.model.pipeline.preparation import MentalHealthData, NUM_CLASSES
+from benchmarks.synthetic import make_survey_frame
+
+_PARAMS = {
+    'objective': 'multi:softprob',
+    'num_class': NUM_CLASSES,
+    'tree_method': 'hist',
+    'max_depth': 6,
+    'learning_rate': 0.1,
+}
+
+
+def _matrix(mh, rows):
+    return xgb.DMatrix(
+        mh.features[rows],
+        label=mh.labels[rows],
+        feature_names=mh.feature_names,
+        feature_types=mh.feature_types
+    )
+
+
+def _latency_ms(model, X, repeat):
+    """ Median latency of a prediction in milliseconds """
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.inplace_predict(X)
+        latencies.append(time.perf_counter() - start)
+    return float(np.median(latencies) * 1000)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    df = make_survey_frame(args.rows)
+    train = slice(0, int(args.rows * 0.8))
+    test = slice(int(args.rows * 0.8), args.rows)
+
+    print(f'{args.rows} rows, {args.rounds} rounds')
+
+    for name, categorical in (('ordinal', False), ('categorical', True)):
+        mh = MentalHealthData(df, categorical=categorical)
+
+        start = time.perf_counter()
+        model = xgb.train(
+            _PARAMS, _matrix(mh, train), num_boost_round=args.rounds)
+        elapsed = time.perf_counter() - start
+
+        x_test = np.ascontiguousarray(mh.features[test])
+        loss = log_loss(
+            mh.labels[test], model.inplace_predict(x_test),
+            labels=list(range(NUM_CLASSES)))
+
+        print(f'{name:>11}: train {elapsed:.2f}s, '
+              f'size {len(model.save_raw("ubj")) / 2 ** 20:.2f} MB, '
+              f'row {_latency_ms(model, x_test[:1], args.repeat):.3f} ms, '
+              f'batch of 1000 '
+              f'{_latency_ms(model, x_test[:1000], args.repeat):.3f} ms, '
+              f'test log-loss {loss:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark the shared, pre-binned training matrices of the DatasetCache
+against rebuilding the xgboost matrices for tuning and final training.
+
+Usage:
+    python -m benchmarks.bench_dataset_cache --rows 200000 --trials 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+import xgboost as xgb
+
+from app.ml.model.pipeline.preparation import MentalHealthData
+from app.ml.model.pipeline.preparation import _split_order, target_labels
+from app.ml.model.pipeline.xgb_model import DatasetCache, _base_params
+from benchmarks.synthetic import make_survey_frame
+
+
+def _trial_params(n_trials, seed=0):
+    """ Fixed hyperparameter samples, the same for every mode """
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            'max_depth': int(rng.integers(3, 10)),
+            'learning_rate': float(rng.uniform(0.01, 0.1)),
+            'subsample': float(rng.uniform(0.6, 1.0)),
+            'colsample_bytree': float(rng.uniform(0.6, 1.0)),
+        }
+        for _ in range(n_trials)
+    ]
+
+
+def _splits(n_rows):
+    df = make_survey_frame(n_rows)
+    labels = target_labels(df['_MENT14D'])
+    order, sizes = _split_order(labels, 0.4, 0.5, 0)
+    mh = MentalHealthData(df, row_order=order, split_sizes=sizes)
+
+    return mh, [*mh.split('train'), *mh.split('val'), *mh.split('test')]
+
+
+def _run_rebuild(mh, splits, trials, rounds, max_bin):
+    """ Previous behaviour, plain DMatrix built for tuning and training """
+    X_train, y_train, x_val, y_val, x_test, y_test = splits
+    base = {'objective': 'multi:softprob', 'num_class': 4,
+            'tree_method': 'hist', 'max_bin': max_bin}
+    names = {'feature_names': mh.feature_names}
+
+    dtrain = xgb.DMatrix(X_train, label=y_train, **names)
+    dval = xgb.DMatrix(x_val, label=y_val, **names)
+    for params in trials:
+        booster = xgb.train({**base, **params}, dtrain, rounds)
+        booster.predict(dval)
+
+    dtrain = xgb.DMatrix(X_train, label=y_train, **names)
+    dtest = xgb.DMatrix(x_test, label=y_test, **names)
+    booster = xgb.train({**base, **trials[0]}, dtrain, rounds)
+    booster.predict(dtest)
+
+
+def _run_cache(mh, splits, trials, rounds, max_bin):
+    """ DatasetCache, quantized once and shared by every fit """
+    X_train, y_train, x_val, y_val, x_test, y_test = splits
+
+    cache = DatasetCache(tree_method='hist', max_bin=max_bin,
+                         feature_names=mh.feature_names)
+    cache.add_split('train', X_train, y_train, reference=True)
+    cache.add_split('val', x_val, y_val)
+    cache.add_split('test', x_test, y_test)
+    base = _base_params(cache)
+
+    for params in trials:
+        booster = xgb.train({**base, **params}, cache.get('train'), rounds)
+        booster.predict(cache.get('val'))
+
+    booster = xgb.train({**base, **trials[0]}, cache.get('train'), rounds)
+    booster.predict(cache.get('test'))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--trials', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--max-bin', type=int, default=256)
+    args = parser.parse_args()
+
+    mh, splits = _splits(args.rows)
+    trials = _trial_params(args.trials)
+
+    timings = {}
+    for name, run in (('rebuild', _run_rebuild), ('cache', _run_cache)):
+        start = time.perf_counter()
+        run(mh, splits, trials, args.rounds, args.max_bin)
+        timings[name] = time.perf_counter() - start
+        print(f'{name:>8}: {timings[name]:.2f}s')
+
+    print(f' speedup: {timings["rebuild"] / timings["cache"]:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
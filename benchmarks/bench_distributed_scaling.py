@@ -0,0 +1,83 @@
+"""
+Benchmark the distributed training scaling, the same synthetic training
+rows sharded across 1, 2, 4 and 8 local worker processes.
+
+The worker processes use the production training worker, only the shard
+loader differs: the shards are read from a synthetic dataset file
+instead of the database.
+
+Usage:
+    python -m benchmarks.bench_distributed_scaling --rows 1000000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from app.ml.model.pipeline.distributed import run_workers, start_tracker
+from benchmarks.synthetic import make_survey_frame
+
+_PARAMS = {
+    'eval_metric': 'mlogloss',
+    'objective': 'multi:softprob',
+    'num_class': 4,
+    'tree_method': 'hist',
+    'max_bin': 256,
+    'max_depth': 6,
+    'learning_rate': 0.1,
+    # Each worker uses its share of the cores
+    'nthread': 1,
+}
+
+
+def _load_synthetic_shard(rank, world_size, path, columns):
+    """ Every world_size-th row of the synthetic dataset file """
+    rows = np.load(path, mmap_mode='r')[rank::world_size]
+    return pd.DataFrame(np.ascontiguousarray(rows), columns=columns)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--rounds', type=int, default=50)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    df = make_survey_frame(args.rows)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'dataset.npy')
+        np.save(path, df.to_numpy())
+        load_shard = partial(
+            _load_synthetic_shard, path=path, columns=list(df.columns))
+        del df
+
+        print(f'{os.cpu_count()} cores, {args.rows} rows, '
+              f'{args.rounds} rounds')
+
+        baseline = None
+        for n_workers in args.workers:
+            start = time.perf_counter()
+            tracker, worker_args = start_tracker(n_workers, '127.0.0.1')
+            run_workers(n_workers, worker_args, load_shard, 'bench',
+                        _PARAMS, args.rounds)
+            tracker.wait_for()
+            elapsed = time.perf_counter() - start
+
+            # Speedup relative to the first run, assumed to scale linearly
+            baseline = baseline or elapsed * n_workers
+            speedup = baseline / elapsed
+            print(f'{n_workers:>2} workers: {elapsed:.2f}s, '
+                  f'speedup {speedup:.2f}x, '
+                  f'efficiency {speedup / n_workers:.0%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark training on the unique, count weighted training rows against
+training on every row, and verify the validation log-loss is unchanged.
+
+The synthetic rows are resampled from a pool of unique respondents, the
+pool size sets the duplicate rate of the dataset.
+
+Usage:
+    python -m benchmarks.bench_duplicate_collapse --rows 500000 --unique 50000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import xgboost as xgb
+from sklearn.metrics import log_loss
+
+from app.ml.model.pipeline.preparation import MentalHealthData
+from app.ml.model.pipeline.preparation import _split_order
+from app.ml.model.pipeline.preparation import class_weights, target_labels
+from app.ml.model.pipeline.preparation import collapse_duplicates
+from app.ml.model.pipeline.xgb_model import DatasetCache, _base_params
+from benchmarks.synthetic import make_survey_frame
+
+# Deterministic parameters, row and column sampling disabled, so both
+# runs optimize exactly the same objective
+_PARAMS = {
+    'max_depth': 6,
+    'learning_rate': 0.1,
+    'subsample': 1.0,
+    'colsample_bytree': 1.0,
+}
+
+
+def _fit(mh, X_train, y_train, weight, x_val, y_val, rounds):
+
+    cache = DatasetCache(feature_names=mh.feature_names)
+    cache.add_split('train', X_train, y_train, weight, reference=True)
+    cache.add_split('val', x_val, y_val)
+
+    start = time.perf_counter()
+    booster = xgb.train(
+        {**_base_params(cache), **_PARAMS}, cache.get('train'), rounds)
+    elapsed = time.perf_counter() - start
+
+    return elapsed, log_loss(y_val, booster.predict(cache.get('val')))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--unique', type=int, default=50_000)
+    parser.add_argument('--rounds', type=int, default=100)
+    args = parser.parse_args()
+
+    # Resample the respondents pool to the dataset size
+    pool = make_survey_frame(args.unique)
+    rng = np.random.default_rng(0)
+    df = pool.iloc[rng.integers(0, args.unique, args.rows)]
+
+    labels = target_labels(df['_MENT14D'])
+    order, sizes = _split_order(labels, 0.4, 0.5, 0)
+    mh = MentalHealthData(df, row_order=order, split_sizes=sizes)
+    X_train, y_train = mh.split('train')
+    x_val, y_val = mh.split('val')
+    weights = class_weights(y_train)
+
+    full_time, full_loss = _fit(
+        mh, X_train, y_train, weights[y_train], x_val, y_val, args.rounds)
+
+    start = time.perf_counter()
+    X_unique, y_unique, counts = collapse_duplicates(X_train, y_train)
+    collapse_time = time.perf_counter() - start
+
+    unique_time, unique_loss = _fit(
+        mh, X_unique, y_unique, weights[y_unique] * counts,
+        x_val, y_val, args.rounds)
+
+    print(f'      rows: {len(y_train)} -> {len(y_unique)} '
+          f'(compression {len(y_train) / len(y_unique):.2f}x)')
+    print(f'  collapse: {collapse_time:.2f}s')
+    print(f'  training: {full_time:.2f}s -> {unique_time:.2f}s '
+          f'(speedup {full_time / unique_time:.2f}x)')
+    print(f'  log-loss: {full_loss:.6f} -> {unique_loss:.6f} '
+          f'(delta {abs(full_loss - unique_loss):.2e})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+Benchmark the model inference end to end, through ModelInferenceService,
+on every inference backend.
+
+A synthetic booster is trained on synthetic survey rows and published to
+a temporary model registry, so the benchmark does not depend on the real
+model or data. Every backend is measured on the same requests:
+
+    - local: the booster in the process
+    - gcp: the GCP backend, against a local stand-in of the Cloud Run
+      prediction service, serving the same booster over HTTP
+    - sidecar: the model server of the host, serving the same booster
+      over a Unix domain socket
+
+Measured for each backend: the single row latency (p50, p99), the
+throughput at each batch size, the memory allocated per call (peak
+Python and numpy allocations, traced by tracemalloc), and for the local
+backend the cold start, a new process up to its first prediction.
+
+The results are written as JSON, tagged with the commit, to be compared
+across commits.
+
+Usage:
+    python -m benchmarks.bench_inference --batch-sizes 1 100 10000 100000
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import xgboost as xgb
+from loguru import logger
+
+from benchmarks.bench_sidecar import start_model_server
+from benchmarks.common import git_commit
+from benchmarks.synthetic import make_survey_records
+from benchmarks.synthetic import publish_synthetic_model
+
+_BACKENDS = ('local', 'gcp', 'sidecar')
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """ Local stand-in of the Cloud Run prediction service """
+
+    service = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        instances = json.loads(body)['instances']
+        predictions = self.service._local_backend_processing_predict(
+            instances)
+        payload = json.dumps({
+            'success': True,
+            'prediction': predictions.tolist(),
+        }).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_gcp_stand_in():
+    """ Serve the stand-in on a free local port, return its URL """
+
+    from app.ml.model.model_inference import ModelInferenceService
+
+    _StandInHandler.service = ModelInferenceService()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def _latency(service, record, repeat):
+    """ Single row latency percentiles, in milliseconds """
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        service.predict([record])
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    return {
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'mean_ms': float(latencies.mean()),
+    }
+
+
+def _throughput(service, batch, min_seconds):
+    """ Rows per second of a batch size, and memory per call """
+
+    tracemalloc.start()
+    service.predict(batch)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        service.predict(batch)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            break
+
+    return {
+        'batch_size': len(batch),
+        'calls': calls,
+        'seconds_per_call': elapsed / calls,
+        'rows_per_second': len(batch) * calls / elapsed,
+        'peak_alloc_mb': peak / 2 ** 20,
+    }
+
+
+def _cold_start(model_path, record):
+    """ A new process, from start up to its first local prediction """
+
+    env = dict(os.environ, MODEL_PATH=model_path, AI_BACKEND='local')
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.bench_inference',
+         '--cold-start-child', json.dumps(record)],
+        check=True, capture_output=True, text=True, env=env
+    ).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result['process_seconds'] = time.perf_counter() - start
+    return result
+
+
+def _cold_start_child(record):
+
+    start = time.perf_counter()
+    from app.ml.model.model_inference import ModelInferenceService
+    imported = time.perf_counter()
+
+    ModelInferenceService().predict([json.loads(record)])
+    predicted = time.perf_counter()
+
+    print(json.dumps({
+        'import_seconds': imported - start,
+        'first_predict_seconds': predicted - imported,
+    }))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backends', nargs='+', default=list(_BACKENDS),
+                        choices=_BACKENDS)
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 10, 100, 1000, 10_000, 100_000])
+    parser.add_argument('--latency-repeat', type=int, default=1000)
+    parser.add_argument('--min-seconds', type=float, default=2.0)
+    parser.add_argument('--train-rows', type=int, default=50_000)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--log-level', default='WARNING',
+                        help='Log level of the service, the debug logs '
+                             'dump every batch')
+    parser.add_argument('--cold-start-child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    if args.cold_start_child:
+        _cold_start_child(args.cold_start_child)
+        return
+
+    from app.ml.config.gcp import gcp_settings
+    from app.ml.model.model_inference import ModelInferenceService
+    from app.ml.model.sidecar import sidecar_client
+
+    commit = git_commit()
+    records = make_survey_records(max(args.batch_sizes))
+
+    with tempfile.TemporaryDirectory() as model_path:
+        version = publish_synthetic_model(
+            model_path, args.train_rows, args.rounds)
+
+        results = {
+            'commit': commit,
+            'created': datetime.now().isoformat(),
+            'host': {
+                'cpu_count': os.cpu_count(),
+                'python': platform.python_version(),
+                'xgboost': xgb.__version__,
+            },
+            'config': {
+                'batch_sizes': args.batch_sizes,
+                'latency_repeat': args.latency_repeat,
+                'min_seconds': args.min_seconds,
+            },
+            'model': {
+                'version': version,
+                'train_rows': args.train_rows,
+                'rounds': args.rounds,
+            },
+            'backends': {},
+        }
+
+        server = sidecar = None
+        for backend in args.backends:
+            gcp_settings.ai_backend = backend
+            if backend == 'gcp':
+                server, gcp_settings.gcp_endpoint_url = _start_gcp_stand_in()
+            elif backend == 'sidecar':
+                sidecar_client.socket_path = os.path.join(
+                    model_path, 'model.sock')
+                sidecar = start_model_server(
+                    model_path, sidecar_client.socket_path)
+
+            service = ModelInferenceService()
+            service.predict(records[:1])
+
+            result = {
+                'latency': _latency(
+                    service, records[0], args.latency_repeat),
+                'throughput': [
+                    _throughput(service, records[:size], args.min_seconds)
+                    for size in args.batch_sizes
+                ],
+            }
+            if backend == 'local':
+                result['cold_start'] = _cold_start(model_path, records[0])
+            results['backends'][backend] = result
+
+            latency = result['latency']
+            print(f'{backend}: single row p50 {latency["p50_ms"]:.3f} ms, '
+                  f'p99 {latency["p99_ms"]:.3f} ms')
+            for row in result['throughput']:
+                print(f'  batch {row["batch_size"]:>7}: '
+                      f'{row["rows_per_second"]:>12,.0f} rows/s, '
+                      f'{row["peak_alloc_mb"]:.1f} MB per call')
+            if 'cold_start' in result:
+                print(f'  cold start: '
+                      f'{result["cold_start"]["process_seconds"]:.2f}s')
+
+        if server is not None:
+            server.shutdown()
+        if sidecar is not None:
+            sidecar_client.close()
+            sidecar.terminate()
+            sidecar.wait()
+
+    output = args.output or os.path.join(
+        'benchmarks', 'results', f'inference_{(commit or "local")[:12]}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results: {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Benchmark the model loading, the previous pickle artifacts against the
+native binary artifacts, memory mapped with a lazy checksum.
+
+A model is trained on synthetic survey rows and saved in both formats.
+Every load runs in a fresh process, the load time is measured from the
+open of the file to the verified model, the peak memory is the growth
+of the process peak RSS during the load.
+
+Usage:
+    python -m benchmarks.bench_model_loading --rounds 500 --depth 8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import xgboost as xgb
+
+from app.ml.model.pipeline.preparation import MentalHealthData
+from app.ml.model.serialization import load_model, save_model
+from benchmarks.synthetic import make_survey_frame
+
+
+def _train(rows, rounds, depth):
+
+    mh = MentalHealthData(make_survey_frame(rows))
+    dtrain = xgb.DMatrix(
+        mh.features,
+        label=mh.labels,
+        feature_names=mh.feature_names,
+        feature_types=mh.feature_types
+    )
+    return xgb.train({
+        'objective': 'multi:softprob',
+        'num_class': 4,
+        'tree_method': 'hist',
+        'max_depth': depth,
+    }, dtrain, num_boost_round=rounds)
+
+
+def _reset_peak_rss():
+    """ Reset the process peak RSS, the imports dwarf the model load """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    """ Process peak RSS, VmHWM when available, else ru_maxrss """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load_child(path, fmt, sha256):
+    """ Load the artifact in this process, print the measurements """
+
+    _reset_peak_rss()
+    before = _peak_rss_mb()
+    start = time.perf_counter()
+    _, verification = load_model(path, fmt, sha256)
+    loaded = time.perf_counter() - start
+    verification.verify()
+    verified = time.perf_counter() - start
+
+    print(json.dumps({
+        'loaded': loaded,
+        'verified': verified,
+        'peak_rss_mb': _peak_rss_mb() - before,
+    }))
+
+
+def _measure(path, fmt, repeat):
+
+    with open(path, 'rb') as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_model_loading',
+             '--child', path, fmt, sha256],
+            check=True, capture_output=True, text=True
+        ).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+
+    return {
+        key: float(np.median([run[key] for run in runs]))
+        for key in runs[0]
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--rounds', type=int, default=500)
+    parser.add_argument('--depth', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _load_child(*args.child)
+        return
+
+    model = _train(args.rows, args.rounds, args.depth)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for fname, fmt in (('model.pkl', 'pickle'), ('model.ubj', 'ubj')):
+            path = os.path.join(tmp, fname)
+            with open(path, 'wb') as f:
+                f.write(save_model(model, fmt))
+
+            result = _measure(path, fmt, args.repeat)
+            print(f'{fmt:>6}: {os.path.getsize(path) / 2 ** 20:.1f} MB, '
+                  f'loaded {result["loaded"] * 1000:.1f} ms, '
+                  f'verified {result["verified"] * 1000:.1f} ms, '
+                  f'peak RSS +{result["peak_rss_mb"]:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
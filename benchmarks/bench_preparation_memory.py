@@ -0,0 +1,87 @@
+"""
+Benchmark the peak memory of the training data preparation, the previous
+DataFrame copies and train_test_split copies, against the array-native
+MentalHealthData with zero-copy split views.
+
+Usage:
+    python -m benchmarks.bench_preparation_memory --rows 1000000
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+from sklearn.utils.class_weight import compute_class_weight
+
+from app.ml.model.pipeline.preparation import MentalHealthData
+from app.ml.model.pipeline.preparation import _split_order
+from app.ml.model.pipeline.preparation import class_weights, target_labels
+from benchmarks.synthetic import make_survey_frame
+
+
+def _prepare_dataframe(df):
+    """ Previous behaviour, DataFrame copies and a copy per split """
+    df = df.copy()
+    df['Physical_Mental_Interaction'] = df['GENHLTH'].astype(
+        int) * df['PHYSHLTH']
+    df['Income_Education_Interaction'] = df['INCOME3'].astype(
+        int) * df['EDUCA'].astype(int)
+    df['Mental_Health_Composite'] = df[
+        ['EMTSUPRT', 'ADDEPEV3', 'POORHLTH']].mean(axis=1)
+
+    X, y = df.drop(columns=['_MENT14D']), df['_MENT14D']
+    X_train, x_temp, y_train, y_temp = train_test_split(
+        X, y, stratify=y, test_size=0.4, random_state=0)
+    x_val, x_test, y_val, y_test = train_test_split(
+        x_temp, y_temp, stratify=y_temp, test_size=0.5, random_state=0)
+
+    label_mapping = {1: 0, 2: 1, 3: 2, 9: 3}
+    _y_train = np.vectorize(label_mapping.get)(y_train)
+    weights = dict(enumerate(compute_class_weight(
+        'balanced', classes=np.unique(_y_train), y=_y_train)))
+    sample_weight = np.array([weights[label] for label in _y_train])
+
+    return X_train, x_val, x_test, sample_weight
+
+
+def _prepare_arrays(df):
+    """ MentalHealthData, one matrix laid out in split order """
+    labels = target_labels(df['_MENT14D'])
+    order, sizes = _split_order(labels, 0.4, 0.5, 0)
+    mh = MentalHealthData(df, row_order=order, split_sizes=sizes)
+
+    X_train, y_train = mh.split('train')
+    sample_weight = class_weights(y_train)[y_train]
+
+    return mh, sample_weight
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    df = make_survey_frame(args.rows)
+    dataset_mb = df.memory_usage(index=False).sum() / 2**20
+    print(f' dataset: {dataset_mb:.1f} MB')
+
+    for name, prepare in (('dataframe', _prepare_dataframe),
+                          ('arrays', _prepare_arrays)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = prepare(df)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+
+        peak_mb = peak / 2**20
+        print(f'{name:>9}: peak {peak_mb:.1f} MB '
+              f'({peak_mb / dataset_mb:.1f}x dataset), {elapsed:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Benchmark the web server topology with a booster in every worker, the
+local backend, against the workers sharing the model server sidecar.
+
+The gunicorn topology is reproduced as in bench_thread_budget, worker
+processes serving concurrent requests from their request threads, on a
+synthetic model. For each backend are measured the request latencies,
+the throughput, and the memory of the host: the proportional set size
+(PSS) of the workers, and of the model server for the sidecar backend,
+so the pages shared between the processes are counted once.
+
+Usage:
+    python -m benchmarks.bench_sidecar --workers 4 --threads 2 \\
+        --batch-sizes 1 100
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from loguru import logger
+
+from benchmarks.common import git_commit, pss_mb, run_workers
+from benchmarks.synthetic import publish_synthetic_model
+
+_BACKENDS = ('local', 'sidecar')
+
+
+def start_model_server(model_path, socket_path, timeout=60.0):
+    """
+    Start the model server of a model path, and wait until it accepts
+    connections.
+
+    Args:
+      model_path: (str) model registry of the server
+      socket_path: (str) Unix domain socket of the server
+      timeout: (float) seconds to wait for the server
+
+    Returns:
+      subprocess.Popen: server process
+    """
+
+    env = dict(os.environ, MODEL_PATH=model_path)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'app.model_server_main',
+         '--socket', socket_path],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('The model server exited on start up')
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            return process
+        except OSError:
+            time.sleep(0.1)
+        finally:
+            probe.close()
+
+    process.terminate()
+    raise RuntimeError('The model server did not start in time')
+
+
+def _run(model_path, socket_path, backend, workers, threads, batch_size,
+         requests):
+    """ Run the workers at once, return the latencies and memory """
+
+    run = run_workers(
+        {'MODEL_PATH': model_path, 'AI_BACKEND': backend,
+         'SIDECAR_SOCKET': socket_path},
+        workers, threads, batch_size, requests, memory=True)
+
+    latencies = run['latencies_ms']
+    return {
+        'requests': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'rows_per_second': len(latencies) * batch_size / run['wall'],
+        'workers_pss_mb': run['workers_pss_mb'],
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 100])
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Requests of each request thread')
+    parser.add_argument('--train-rows', type=int, default=50_000)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created': datetime.now().isoformat(),
+        'host': {'cpu_count': os.cpu_count()},
+        'config': {
+            'workers': args.workers,
+            'threads': args.threads,
+            'requests': args.requests,
+        },
+        'batches': [],
+    }
+
+    with tempfile.TemporaryDirectory() as model_path:
+        publish_synthetic_model(model_path, args.train_rows, args.rounds)
+        socket_path = os.path.join(model_path, 'model.sock')
+        server = start_model_server(model_path, socket_path)
+
+        try:
+            for batch_size in args.batch_sizes:
+                row = {'batch_size': batch_size}
+                for backend in _BACKENDS:
+                    row[backend] = result = _run(
+                        model_path, socket_path, backend, args.workers,
+                        args.threads, batch_size, args.requests)
+                    result['total_pss_mb'] = result['workers_pss_mb']
+                    if backend == 'sidecar':
+                        result['server_pss_mb'] = pss_mb(server.pid)
+                        result['total_pss_mb'] += result['server_pss_mb']
+
+                    print(f'batch {batch_size:>6} {backend:<8} '
+                          f'p50 {result["p50_ms"]:>8.2f} ms  '
+                          f'p99 {result["p99_ms"]:>8.2f} ms  '
+                          f'{result["rows_per_second"]:>10,.0f} rows/s  '
+                          f'{result["total_pss_mb"]:>8.1f} MB')
+                results['batches'].append(row)
+        finally:
+            server.terminate()
+            server.wait()
+
+    output = args.output or os.path.join(
+        'benchmarks', 'results', f'sidecar_{(commit or "local")[:12]}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results: {output}')
+
+
+if __name__ == '__main__':
+    main()
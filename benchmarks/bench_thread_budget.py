@@ -0,0 +1,111 @@
+"""
+Benchmark the inference tail latency under the web server topology,
+with the xgboost and native library thread defaults against the thread
+budget.
+
+The gunicorn topology is reproduced with worker processes, each serving
+concurrent requests from its request threads, every request a
+prediction through ModelInferenceService, on a synthetic model. All the
+workers start at once, and the latencies of the requests are compared:
+without the budget every booster and BLAS pool runs a thread per core,
+with the budget the cores are divided between the workers.
+
+Usage:
+    python -m benchmarks.bench_thread_budget --workers 4 --threads 2 \\
+        --batch-sizes 1 100 1000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import numpy as np
+from loguru import logger
+
+from benchmarks.common import git_commit, run_workers
+from benchmarks.synthetic import publish_synthetic_model
+
+
+def _run(model_path, budget, workers, threads, batch_size, requests):
+    """ Run the workers at once, return the request latencies """
+
+    run = run_workers(
+        {'MODEL_PATH': model_path, 'AI_BACKEND': 'local',
+         'THREAD_BUDGET': str(budget)},
+        workers, threads, batch_size, requests)
+
+    latencies = run['latencies_ms']
+    return {
+        'requests': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'max_ms': float(latencies.max()),
+        'requests_per_second': len(latencies) / run['wall'],
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[1, 100, 1000])
+    parser.add_argument('--requests', type=int, default=200,
+                        help='Requests of each request thread')
+    parser.add_argument('--train-rows', type=int, default=50_000)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level='WARNING')
+
+    from app.ml.model.threads import available_cores
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created': datetime.now().isoformat(),
+        'host': {
+            'cpu_count': os.cpu_count(),
+            'available_cores': available_cores(),
+        },
+        'config': {
+            'workers': args.workers,
+            'threads': args.threads,
+            'requests': args.requests,
+        },
+        'batches': [],
+    }
+
+    with tempfile.TemporaryDirectory() as model_path:
+        publish_synthetic_model(model_path, args.train_rows, args.rounds)
+
+        for batch_size in args.batch_sizes:
+            row = {'batch_size': batch_size}
+            for budget in (False, True):
+                name = 'budget' if budget else 'default'
+                row[name] = _run(
+                    model_path, budget, args.workers, args.threads,
+                    batch_size, args.requests)
+                print(f'batch {batch_size:>6} {name:<8} '
+                      f'p50 {row[name]["p50_ms"]:>8.2f} ms  '
+                      f'p99 {row[name]["p99_ms"]:>8.2f} ms  '
+                      f'{row[name]["requests_per_second"]:>8.1f} req/s')
+            results['batches'].append(row)
+
+    output = args.output or os.path.join(
+        'benchmarks', 'results',
+        f'thread_budget_{(commit or "local")[:12]}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results: {output}')
+
+
+if __name__ == '__main__':
+    main()
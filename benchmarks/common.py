@@ -0,0 +1,149 @@
+"""
+This module provides the helpers shared by the benchmarks.
+
+The web server topology is reproduced with worker processes, each
+serving concurrent requests from its request threads, every request a
+prediction through ModelInferenceService. The workers are spawned with
+the settings of the benchmarked configuration, and start at once:
+
+    run = run_workers(
+        {'MODEL_PATH': model_path, 'AI_BACKEND': 'local'},
+        workers=4, threads=2, batch_size=100, requests=200)
+
+The module contains the following functions:
+    - git_commit: Return the commit the benchmark runs on
+    - pss_mb: Return the proportional set size of a process
+    - run_workers: Run the web worker processes at once
+"""
+
+import os
+import subprocess
+import threading
+import time
+from multiprocessing import get_context
+
+import numpy as np
+from loguru import logger
+
+from benchmarks.synthetic import make_survey_records
+
+
+def git_commit():
+    """
+    Return the commit the benchmark runs on, recorded in the results.
+
+    Returns:
+      str: commit hash, None outside of a git checkout
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def pss_mb(pid):
+    """
+    Return the proportional set size of a process, in MB, the pages
+    shared with other processes divided between them.
+
+    Args:
+      pid: (int) process id
+
+    Returns:
+      float: proportional set size
+    """
+    # Only the memory benchmarks depend on psutil
+    import psutil
+
+    return psutil.Process(pid).memory_full_info().pss / 2 ** 20
+
+
+def run_workers(env, workers, threads, batch_size, requests,
+                memory=False) -> dict:
+    """
+    Run the web worker processes at once, each serving the requests of
+    its request threads, and return the request latencies.
+
+    Args:
+      env: (dict) settings of the workers, environment variables
+      workers: (int) worker processes
+      threads: (int) request threads of a worker
+      batch_size: (int) records of a request
+      requests: (int) requests of each request thread
+      memory: (bool) measure the memory of the workers
+
+    Returns:
+      dict: latencies in ms, wall time in seconds, and the proportional
+        set size of the workers in MB when measured
+    """
+
+    env = dict(env, WEB_WORKERS=str(workers), WEB_THREADS=str(threads))
+
+    spawn = get_context('spawn')
+    ready, results, start = spawn.Queue(), spawn.Queue(), spawn.Event()
+
+    processes = [
+        spawn.Process(target=_worker, args=(
+            env, threads, batch_size, requests, memory, ready, start,
+            results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.get()
+
+    wall_start = time.perf_counter()
+    start.set()
+    latencies, workers_mb = [], 0.0
+    for _ in processes:
+        worker_latencies, worker_mb = results.get()
+        latencies.extend(worker_latencies)
+        workers_mb += worker_mb or 0.0
+    wall = time.perf_counter() - wall_start
+
+    for process in processes:
+        process.join()
+
+    return {
+        'latencies_ms': np.array(latencies) * 1000,
+        'wall': wall,
+        'workers_pss_mb': workers_mb if memory else None,
+    }
+
+
+def _worker(env, threads, batch_size, requests, memory, ready, start,
+            results):
+    """ A web worker process, serving requests from its threads """
+
+    # The settings are read when the service is imported
+    os.environ.update(env)
+    logger.remove()
+
+    from app.ml.model.model_inference import ModelInferenceService
+
+    batch = make_survey_records(batch_size, seed=os.getpid())
+    service = ModelInferenceService()
+    service.predict(batch)
+
+    latencies = []
+
+    def serve():
+        for _ in range(requests):
+            request_start = time.perf_counter()
+            service.predict(batch)
+            latencies.append(time.perf_counter() - request_start)
+
+    ready.put(os.getpid())
+    start.wait()
+
+    pool = [threading.Thread(target=serve) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    results.put((latencies, pss_mb(os.getpid()) if memory else None))